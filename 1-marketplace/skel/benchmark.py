@@ -0,0 +1,487 @@
+"""
+This module measures the Marketplace's performance
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import tracemalloc
+from dataclasses import dataclass
+from json import dumps, loads
+from threading import Barrier, Thread
+from time import perf_counter, perf_counter_ns
+
+from test import load_market_config, run_threads
+from tema.catalog import ProductCatalog
+from tema.marketplace import Marketplace
+from tema.marketplace_logging import OFF, stop_logger
+from tema.product import Coffee, Tea
+
+SHELF_SIZES = [10, 100, 1000, 10000, 100000]
+THREAD_COUNTS = [1, 8, 32, 128]
+LOG_LEVELS = {"off": OFF, "warning": logging.WARNING,
+              "info": logging.INFO, "debug": logging.DEBUG}
+NUM_PRODUCTS = 20
+CATALOG_SHELF_SIZE = 100000
+SCENARIOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "*.in")
+
+# The per-operation cost at the largest shelf size may exceed the one at
+# the smallest shelf size at most by this factor
+MAX_SCALING_RATIO = 3.0
+
+
+def make_products(count):
+    """
+    Builds 'count' distinct products, half of them coffees and half teas
+    """
+    return [Coffee(f"Coffee {i}", i % 10 + 1, 5.0, "MEDIUM") if i % 2 == 0
+            else Tea(f"Tea {i}", i % 10 + 1, "Black")
+            for i in range(count)]
+
+
+def fill_shelf(marketplace, products, units):
+    """
+    Publishes 'units' units on the marketplace's shelf, spread over all products
+    """
+    producer = marketplace.register_producer()
+    for i in range(units):
+        marketplace.publish(producer, products[i % len(products)])
+    return producer
+
+
+def shelf_scaling(shelf_sizes, operations):
+    """
+    Measures the cost of a publish, add_to_cart, remove_from_cart, add_to_cart
+    round for each shelf size, while the shelf is holding that many units.
+
+    :returns a list of dicts with the shelf size and the cost of a round in microseconds
+    """
+    results = []
+    products = make_products(NUM_PRODUCTS)
+    for shelf_size in shelf_sizes:
+        marketplace = Marketplace(shelf_size + operations, log_config={"level": OFF})
+        producer = fill_shelf(marketplace, products, shelf_size)
+        cart_id = marketplace.new_cart()
+
+        start = perf_counter()
+        for i in range(operations):
+            product = products[i % len(products)]
+            marketplace.publish(producer, product)
+            marketplace.add_to_cart(cart_id, product)
+            marketplace.remove_from_cart(cart_id, product)
+            marketplace.add_to_cart(cart_id, product)
+        elapsed = perf_counter() - start
+
+        results.append({"shelf_size": shelf_size,
+                        "round_us": elapsed / operations * 1e6})
+    return results
+
+
+def consumer_rounds(marketplace, products, rounds):
+    """
+    Adds and then removes a product 'rounds' times, using a single cart
+    """
+    cart_id = marketplace.new_cart()
+    for i in range(rounds):
+        product = products[i % len(products)]
+        if marketplace.add_to_cart(cart_id, product):
+            marketplace.remove_from_cart(cart_id, product)
+
+
+def lock_scaling(thread_counts, operations):
+    """
+    Measures the add_to_cart and remove_from_cart throughput with the
+    fine-grained locks and with a single global lock, for each number of
+    consumer threads. The total number of rounds is split between the threads.
+
+    :returns a list of dicts with the number of threads and the operations per second
+    of each locking scheme
+    """
+    results = []
+    products = make_products(NUM_PRODUCTS)
+    for num_threads in thread_counts:
+        result = {"threads": num_threads}
+        for scheme, striped in (("striped", True), ("global_lock", False)):
+            marketplace = Marketplace(num_threads * NUM_PRODUCTS, striped=striped,
+                                      log_config={"level": OFF})
+            fill_shelf(marketplace, products, num_threads * NUM_PRODUCTS)
+            threads = [Thread(target=consumer_rounds,
+                              args=(marketplace, products, operations // num_threads))
+                       for _ in range(num_threads)]
+
+            start = perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = perf_counter() - start
+
+            result[f"{scheme}_ops_per_sec"] = 2 * operations / elapsed
+        results.append(result)
+    return results
+
+
+def logging_throughput(log_levels, operations):
+    """
+    Measures the publish, add_to_cart and remove_from_cart throughput of a
+    single thread for each logging level. The records are written to a temporary file.
+
+    :returns a dict mapping each level to the operations per second
+    """
+    results = {}
+    products = make_products(NUM_PRODUCTS)
+    with tempfile.TemporaryDirectory() as log_dir:
+        for name, level in log_levels.items():
+            marketplace = Marketplace(
+                operations,
+                log_config={"level": level,
+                            "filename": os.path.join(log_dir, "marketplace.log")},
+            )
+            producer = marketplace.register_producer()
+            cart_id = marketplace.new_cart()
+
+            start = perf_counter()
+            for i in range(operations):
+                product = products[i % len(products)]
+                marketplace.publish(producer, product)
+                marketplace.add_to_cart(cart_id, product)
+                marketplace.remove_from_cart(cart_id, product)
+            elapsed = perf_counter() - start
+
+            results[f"{name}_ops_per_sec"] = 3 * operations / elapsed
+        stop_logger()
+    return results
+
+
+@dataclass(frozen=True)
+class PlainTea:
+    """
+    Tea product as a plain frozen dataclass, which hashes its fields on every lookup
+    """
+    name: str
+    price: int
+    type: str
+
+
+def unit_products(tea_class, units, catalog=None):
+    """
+    Builds one tea per shelf unit, out of NUM_PRODUCTS distinct teas,
+    interning them in the catalog if one is given
+    """
+    shelf = []
+    for i in range(units):
+        product = tea_class(f"Tea {i % NUM_PRODUCTS}", i % NUM_PRODUCTS + 1, "Black")
+        shelf.append(catalog.intern(product) if catalog is not None else product)
+    return shelf
+
+
+def measure_memory(build):
+    """
+    Returns the bytes still allocated after calling 'build' and the value it returned
+    """
+    tracemalloc.start()
+    value = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated, value
+
+
+def measure_lookups(inventory, keys):
+    """
+    Returns the number of inventory lookups per second for the given keys
+    """
+    start = perf_counter()
+    for key in keys:
+        inventory[key] += 1
+    return len(keys) / (perf_counter() - start)
+
+
+def catalog_savings(units):
+    """
+    Measures the memory of a shelf holding 'units' products and the inventory
+    lookup throughput, with plain dataclass products, with slotted products that
+    cache their hash, with interned products and with the catalog's integer ids.
+
+    :returns a dict with the bytes and the lookups per second of each representation
+    """
+    results = {}
+    catalog = ProductCatalog()
+    for name, build in (("plain", lambda: unit_products(PlainTea, units)),
+                        ("slotted", lambda: unit_products(Tea, units)),
+                        ("interned", lambda: unit_products(Tea, units, catalog))):
+        allocated, shelf = measure_memory(build)
+        results[f"{name}_bytes"] = allocated
+        results[f"{name}_lookups_per_sec"] = measure_lookups(dict.fromkeys(shelf, 0), shelf)
+
+    ids = [catalog.product_id(product) for product in shelf]
+    start = perf_counter()
+    counts = [0] * len(catalog)
+    for product_id in ids:
+        counts[product_id] += 1
+    results["ids_lookups_per_sec"] = len(ids) / (perf_counter() - start)
+    return results
+
+
+def percentile(sorted_values, percent):
+    """
+    Returns the given nearest-rank percentile of a sorted, non-empty list
+    """
+    return sorted_values[max(0, (len(sorted_values) * percent + 99) // 100 - 1)]
+
+
+def time_calls(method, args_list):
+    """
+    Calls the method with each of the arguments in turn
+
+    :returns the list of results and the list of latencies in nanoseconds
+    """
+    results, latencies = [], []
+    for args in args_list:
+        start = perf_counter_ns()
+        results.append(method(*args))
+        latencies.append(perf_counter_ns() - start)
+    return results, latencies
+
+
+def micro_worker(marketplace, products, operations, barrier, samples):
+    """
+    Calls each Marketplace method about 'operations' times, one method at a time.
+    The threads start each method together, after waiting at the barrier.
+    A (method, start, end, latencies) sample is appended for each method.
+    """
+    def phase(name, args_list):
+        barrier.wait()
+        start = perf_counter()
+        results, latencies = time_calls(getattr(marketplace, name), args_list)
+        samples.append((name, start, perf_counter(), latencies))
+        return results
+
+    producers = phase("register_producer", [()] * operations)
+    carts = phase("new_cart", [()] * operations)
+    units = [products[i % len(products)] for i in range(2 * operations)]
+    phase("publish", [(producers[0], product) for product in units])
+    added = phase("add_to_cart", [(carts[i % operations], product)
+                                  for i, product in enumerate(units)])
+    phase("remove_from_cart", [(carts[i], units[i]) for i in range(operations) if added[i]])
+    phase("place_order", [(cart_id,) for cart_id in carts])
+
+
+def micro_benchmarks(thread_counts, operations):
+    """
+    Measures the throughput and the latency of each Marketplace method, for each
+    number of contending threads. The operations of a method are split between the threads.
+
+    :returns a dict mapping each method to a list of dicts with the number of threads,
+    the operations per second, the p50 and p99 latencies in microseconds and the
+    throughput relative to a single thread
+    """
+    results = {}
+    products = make_products(NUM_PRODUCTS)
+    for num_threads in thread_counts:
+        per_thread = max(1, operations // num_threads)
+        samples = []
+        with open(os.devnull, "w", encoding="utf-8") as output:
+            marketplace = Marketplace(2 * per_thread, log_config={"level": OFF},
+                                      order_output={"stream": output})
+            barrier = Barrier(num_threads)
+            threads = [Thread(target=micro_worker,
+                              args=(marketplace, products, per_thread, barrier, samples))
+                       for _ in range(num_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        for name in dict.fromkeys(sample[0] for sample in samples):
+            method_samples = [sample for sample in samples if sample[0] == name]
+            latencies = sorted(latency for sample in method_samples for latency in sample[3])
+            elapsed = (max(sample[2] for sample in method_samples)
+                       - min(sample[1] for sample in method_samples))
+            curve = results.setdefault(name, [])
+            ops_per_sec = len(latencies) / elapsed
+            curve.append({"threads": num_threads,
+                          "ops_per_sec": ops_per_sec,
+                          "p50_us": percentile(latencies, 50) / 1e3,
+                          "p99_us": percentile(latencies, 99) / 1e3,
+                          "scaling": ops_per_sec / curve[0]["ops_per_sec"] if curve else 1.0})
+    return results
+
+
+def run_scenario(filename, connection):
+    """
+    Runs a test's input file with the threads engine and the producers' sleeps
+    disabled, sending the number of cart operations and the elapsed time
+    """
+    market_config = load_market_config(filename)
+    for producer in market_config['producers']:
+        producer['products'] = [(product, quantity, 0)
+                                for product, quantity, _ in producer['products']]
+    operations = sum(quantity
+                     for consumer in market_config['consumers']
+                     for cart in consumer['carts']
+                     for _, _, quantity in cart)
+
+    with open(os.devnull, "w", encoding="utf-8") as output:
+        market_config['marketplace']['log_config'] = {"level": OFF}
+        market_config['marketplace']['order_output'] = {"stream": output}
+        start = perf_counter()
+        run_threads(market_config, True)
+        connection.send((operations, perf_counter() - start))
+
+
+def macro_benchmarks(scenarios, repeats, timeout):
+    """
+    Runs each scenario end to end 'repeats' times, each run in its own process.
+    A run that takes longer than 'timeout' seconds is stopped, and so are the
+    scenario's remaining runs.
+
+    :returns a dict mapping each scenario's name to the cart operations per second
+    of the median run and the p50 and p99 run times in seconds, or to a timed_out flag
+    """
+    results = {}
+    for filename in scenarios:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        elapsed = []
+        operations = 0
+        for _ in range(repeats):
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=run_scenario,
+                                              args=(filename, sender), daemon=True)
+            process.start()
+            finished = receiver.poll(timeout)
+            if finished:
+                operations, run_time = receiver.recv()
+                elapsed.append(run_time)
+            process.terminate()
+            process.join()
+            if not finished:
+                break
+
+        if len(elapsed) < repeats:
+            results[name] = {"timed_out": True, "timeout_s": timeout}
+            continue
+        elapsed.sort()
+        results[name] = {"operations": operations,
+                         "ops_per_sec": operations / percentile(elapsed, 50),
+                         "p50_s": percentile(elapsed, 50),
+                         "p99_s": percentile(elapsed, 99)}
+    return results
+
+
+def find_regressions(results, baseline, max_regression):
+    """
+    Compares the throughputs of the micro and macro suites with a previous run's
+
+    :returns a list of messages, one for each throughput that dropped by more than
+    the 'max_regression' fraction
+    """
+    regressions = []
+    for name, curve in results.get("micro", {}).items():
+        previous = {point["threads"]: point
+                    for point in baseline.get("micro", {}).get(name, [])}
+        for point in curve:
+            old = previous.get(point["threads"])
+            if old and point["ops_per_sec"] < old["ops_per_sec"] * (1 - max_regression):
+                regressions.append(f"{name} with {point['threads']} threads: "
+                                   f"{old['ops_per_sec']:.0f} -> {point['ops_per_sec']:.0f}"
+                                   " ops/sec")
+    for name, result in results.get("macro", {}).items():
+        old = baseline.get("macro", {}).get(name, {})
+        if "ops_per_sec" not in old:
+            continue
+        if result.get("timed_out"):
+            regressions.append(f"scenario {name}: timed out")
+        elif result["ops_per_sec"] < old["ops_per_sec"] * (1 - max_regression):
+            regressions.append(f"scenario {name}: {old['ops_per_sec']:.0f} -> "
+                               f"{result['ops_per_sec']:.0f} ops/sec")
+    return regressions
+
+
+def main():
+    """
+    Runs the benchmarks and prints the results as JSON.
+    Exits with an error code if the per-operation cost grows with the shelf size.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--operations", type=int, default=2000,
+                        help="number of measured rounds per shelf size or thread count")
+    parser.add_argument("--suite",
+                        choices=["shelf", "locks", "logging", "catalog", "micro", "macro"],
+                        default="shelf",
+                        help="shelf: per-operation cost by shelf size, "
+                             "locks: throughput by number of consumer threads, "
+                             "logging: throughput by logging level, "
+                             "catalog: memory and lookups of a 100k-unit shelf "
+                             "by product representation, "
+                             "micro: throughput and latency of each method by number "
+                             "of threads, macro: test scenarios run end to end")
+    parser.add_argument("--scenarios", nargs="+", default=None,
+                        help="the input files of the macro suite, tests/*.in by default")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="number of runs of each macro scenario")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="seconds after which a macro scenario's run is stopped")
+    parser.add_argument("--output", help="file the micro or macro results are written to")
+    parser.add_argument("--baseline",
+                        help="results of a previous micro or macro run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="the fraction by which a throughput may drop from the baseline")
+    args = parser.parse_args()
+
+    if args.suite == "catalog":
+        results = catalog_savings(CATALOG_SHELF_SIZE)
+        print(dumps({"catalog_savings": results}, indent=4))
+        return
+
+    if args.suite == "logging":
+        results = logging_throughput(LOG_LEVELS, args.operations)
+        print(dumps({"logging_throughput": results}, indent=4))
+        return
+
+    logging.disable(logging.INFO)
+
+    if args.suite in ("micro", "macro"):
+        if args.suite == "micro":
+            results = {"micro": micro_benchmarks(THREAD_COUNTS, args.operations)}
+        else:
+            results = {"macro": macro_benchmarks(args.scenarios or sorted(glob.glob(SCENARIOS)),
+                                                 args.repeats, args.timeout)}
+        print(dumps(results, indent=4))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as output_file:
+                output_file.write(dumps(results, indent=4))
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as baseline_file:
+                regressions = find_regressions(results, loads(baseline_file.read()),
+                                               args.max_regression)
+            for regression in regressions:
+                print(f"regression: {regression}", file=sys.stderr)
+            if regressions:
+                sys.exit(1)
+        return
+
+    if args.suite == "locks":
+        results = lock_scaling(THREAD_COUNTS, args.operations)
+        print(dumps({"lock_scaling": results}, indent=4))
+        return
+
+    results = shelf_scaling(SHELF_SIZES, args.operations)
+    ratio = results[-1]["round_us"] / results[0]["round_us"]
+    print(dumps({"shelf_scaling": results, "ratio": ratio}, indent=4))
+
+    if ratio > MAX_SCALING_RATIO:
+        print(f"per-operation cost grew {ratio:.2f} times with the shelf size",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
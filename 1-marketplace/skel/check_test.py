@@ -1,12 +1,73 @@
 """
 This module checks that the homework's solution output is correct
 
+The output and the reference are compared as multisets of lines: both files are
+read in chunks and their lines are counted, so the check takes linear time and
+its memory only grows with the number of distinct lines.
+
 Computer Systems Architecture Course
 Assignment 1
 March 2021
 """
-import subprocess
 import sys
+from collections import Counter
+
+# The size of the chunks the files are read in
+CHUNK_SIZE = 1 << 20
+
+BOUGHT = " bought "
+
+
+def read_lines(filename):
+    """
+    Yields the lines of a file, read in chunks. A line ends with the closing
+    parenthesis of its product, since sometimes there is no new line between
+    consumer outputs.
+
+    :param filename: the file
+    """
+    with open(filename, encoding="utf-8") as input_file:
+        rest = ""
+        for chunk in iter(lambda: input_file.read(CHUNK_SIZE), ""):
+            lines = (rest + chunk).split(")")
+            rest = lines.pop()
+            for line in lines:
+                line = line.strip()
+                if line:
+                    yield line + ")"
+        if rest.strip():
+            yield rest.strip()
+
+
+def compare(output_filename, ref_filename):
+    """
+    Compares an output file with the reference output, ignoring the order of the lines
+
+    :param output_filename: the output file
+    :param ref_filename: the reference output file
+    :return: a dict mapping each (consumer, product) pair whose purchases differ to
+    the number of purchases the output has in surplus (positive) or deficit (negative)
+    """
+    counts = Counter(read_lines(output_filename))
+    counts.subtract(read_lines(ref_filename))
+
+    differences = {}
+    for line, difference in counts.items():
+        if difference:
+            consumer, _, product = line.partition(BOUGHT)
+            differences[consumer, product] = difference
+    return differences
+
+
+def check(output_filename, ref_filename):
+    """
+    Checks an output file against the reference output, ignoring the order of the lines
+
+    :param output_filename: the output file
+    :param ref_filename: the reference output file
+    :return: True if the output has the same lines as the reference
+    """
+    return not compare(output_filename, ref_filename)
 
 
 def main():
@@ -17,29 +78,15 @@ def main():
     testname = sys.argv[1]
     output_filename = sys.argv[2]
     ref_filename = sys.argv[3]
-    # load the lines from the output file and sort them
-    with open(output_filename) as output_file:
-        output_lines = output_file.read()
-
-    output_lines = output_lines.split(")")  # sometimes there is no new line between consumer outputs
-    output_lines = [line.strip() + ")" for line in output_lines if len(line.strip()) > 0]
-
-    output_lines.sort()
-
-    sorted_output_filename = output_filename + ".sorted"
-
-    # write to input file (tests/{test_name}.in)
-    with open(sorted_output_filename, 'w') as sorted_output_file:
-        for line in output_lines:
-            print(line, file=sorted_output_file)
-
-    command = subprocess.Popen(["diff", sorted_output_filename, ref_filename], stdout=subprocess.PIPE)
-    out, err = command.communicate()
 
-    if len(out) == 0:
+    differences = compare(output_filename, ref_filename)
+    if not differences:
         print(f"Test {testname}" + ":\t\t" + "PASSED")
     else:
         print(f"Test {testname}" + ":\t\t" + "FAILED")
+        for (consumer, product), difference in sorted(differences.items()):
+            kind = "surplus" if difference > 0 else "deficit"
+            print(f"\t{consumer}: {kind} of {abs(difference)} x {product}")
 
 
 if __name__ == "__main__":
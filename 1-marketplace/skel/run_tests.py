@@ -0,0 +1,171 @@
+"""
+This module runs the homework's tests concurrently and reports, for each test,
+its wall time, CPU time, peak RSS and result.
+
+Each test runs test.py in its own process, driven by a thread of a pool. Since the
+tests spend most of their time waiting, all of them run at the same time by default
+and the whole suite takes about as long as the slowest test.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import glob
+import os
+import signal
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+from threading import Event, Timer
+from time import perf_counter
+
+from check_test import compare
+
+TESTS_DIR = "tests"
+
+# The maximum number of seconds a test may run, by test name
+DEFAULT_TIMEOUT = 30
+TIMEOUTS = {"09": 60, "10": 60}
+
+
+def kill_test(process, expired):
+    """
+    Kills the test's process and the processes it started, once its timeout expired
+    """
+    expired.set()
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_test(name, timeout, test_args, profile_dir=None):
+    """
+    Runs a test, writing its output to tests/{name}.out, and checks the output
+
+    :param name: the test's name
+    :param timeout: the number of seconds after which the test is killed
+    :param test_args: the other arguments of test.py
+    :param profile_dir: if given, the test is profiled in its {name} subdirectory
+    :return: a dict with the test's name, result, wall time, CPU time, peak RSS and
+    the purchases that differ from the reference
+    """
+    prefix = os.path.join(TESTS_DIR, name)
+    if profile_dir is not None:
+        test_args = [*test_args, "--profile", os.path.join(profile_dir, name)]
+    expired = Event()
+    with open(f"{prefix}.out", "w", encoding="utf-8") as output_file:
+        start = perf_counter()
+        # the test gets its own session, so that its worker processes can be killed too
+        with subprocess.Popen([sys.executable, "test.py", f"{prefix}.in", *test_args],
+                              stdout=output_file, start_new_session=True) as process:
+            timer = Timer(timeout, kill_test, args=(process, expired))
+            timer.start()
+            # wait4() reaps the process and returns its resource usage, including
+            # the usage of its own reaped child processes
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            timer.cancel()
+        wall_time = perf_counter() - start
+
+    differences = compare(f"{prefix}.out", f"{prefix}.ref.out")
+    return {"test": name,
+            "passed": not expired.is_set() and not differences,
+            "timed_out": expired.is_set(),
+            "timeout_s": timeout,
+            "exit_code": process.returncode,
+            "wall_s": wall_time,
+            "cpu_s": usage.ru_utime + usage.ru_stime,
+            "peak_rss_mb": usage.ru_maxrss / 1024,
+            "differences": [{"consumer": consumer, "product": product, "difference": difference}
+                            for (consumer, product), difference in sorted(differences.items())]}
+
+
+def test_label(name):
+    """
+    Returns the label of a test in the report, the test's number if it has one
+    """
+    return str(int(name)) if name.isdigit() else name
+
+
+def print_report(results, wall_time):
+    """
+    Prints a line for each test, in the format of check_test.py, followed by the
+    purchases that differ from the reference, then a table
+    with the resource usage of each test
+    """
+    for result in results:
+        label = test_label(result["test"])
+        if result["timed_out"]:
+            print(f"TIMEOUT. Test {label} exceeded maximum allowed time of "
+                  f"{result['timeout_s']:g}")
+        print(f"Test {label}" + ":\t\t" + ("PASSED" if result["passed"] else "FAILED"))
+        for difference in result["differences"]:
+            kind = "surplus" if difference["difference"] > 0 else "deficit"
+            print(f"\t{difference['consumer']}: {kind} of {abs(difference['difference'])} x "
+                  f"{difference['product']}")
+
+    print()
+    print(f"{'Test':<6}{'Result':>8}{'Wall (s)':>10}{'CPU (s)':>10}{'Peak RSS (MB)':>15}")
+    for result in results:
+        status = "TIMEOUT" if result["timed_out"] else "PASSED" if result["passed"] else "FAILED"
+        print(f"{result['test']:<6}{status:>8}{result['wall_s']:>10.2f}"
+              f"{result['cpu_s']:>10.2f}{result['peak_rss_mb']:>15.1f}")
+    print(f"{'Total':<6}{sum(result['passed'] for result in results):>5}/{len(results):<2}"
+          f"{wall_time:>10.2f}{sum(result['cpu_s'] for result in results):>10.2f}")
+
+
+def main():
+    """
+    Runs the tests and prints the report.
+    Exits with an error code if a test failed.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tests", nargs="*",
+                        help="the names of the tests to run, all the tests by default")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="the number of tests run at the same time, all of them by default")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="the timeout of every test, instead of the default ones")
+    parser.add_argument("--json", help="file the JSON report is written to")
+    parser.add_argument("--engine", choices=["threads", "pool", "asyncio", "processes"],
+                        default="threads", help="test.py's engine")
+    parser.add_argument("--wait", choices=["block", "poll", "backorder"], default="block",
+                        help="test.py's waiting mode")
+    parser.add_argument("--profile", metavar="OUT_DIR",
+                        help="directory each test's profile is written to, in the "
+                             "test's subdirectory; a timed out test keeps its last summary")
+    parser.add_argument("--clock", choices=["real", "virtual"], default="real",
+                        help="test.py's clock")
+    parser.add_argument("--fair", action="store_true",
+                        help="run test.py in fair mode")
+    args = parser.parse_args()
+
+    names = args.tests or sorted(os.path.basename(filename)[:-len(".in")]
+                                 for filename in glob.glob(os.path.join(TESTS_DIR, "*.in")))
+    test_args = ["--engine", args.engine, "--wait", args.wait, "--clock", args.clock]
+    if args.fair:
+        test_args.append("--fair")
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs or len(names)) as executor:
+        results = list(executor.map(
+            lambda name: run_test(name, args.timeout or TIMEOUTS.get(name, DEFAULT_TIMEOUT),
+                                  test_args, args.profile),
+            names))
+    wall_time = perf_counter() - start
+
+    print_report(results, wall_time)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json_file.write(dumps({"tests": results, "wall_s": wall_time}, indent=4))
+
+    if not all(result["passed"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+This module represents the asyncio Consumer.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import asyncio
+
+
+class AsyncConsumer:
+    """
+    Class that represents a consumer running as an asyncio task.
+    """
+
+    def __init__(self, carts, marketplace, retry_wait_time, name=None, blocking=True):
+        """
+        Constructor.
+
+        :type carts: List
+        :param carts: a list of carts, each of them an iterable of
+        (type, product, quantity) add and remove operations
+
+        :type marketplace: AsyncMarketplace
+        :param marketplace: a reference to the marketplace
+
+        :type retry_wait_time: Time
+        :param retry_wait_time: the number of seconds that a producer must wait
+        until the Marketplace becomes available
+
+        :type name: String
+        :param name: the consumer's name, used for its carts' orders
+
+        :type blocking: Bool
+        :param blocking: if True, a consumer waits inside add_many() until the
+        product becomes available instead of sleeping between attempts
+        """
+        self.carts = carts
+        self.marketplace = marketplace
+        self.retry_wait_time = retry_wait_time
+        self.name = name
+        self.blocking = blocking
+
+    async def run(self):
+        """
+        Creates a new cart and then performs the specified operations on it.
+        The waits are the same as the ones of Consumer.run(), done with asyncio.sleep().
+        When all the operations have been done, the consumer places the cart's order.
+        """
+        for cart in self.carts:
+            cart_id = self.marketplace.new_cart(self.name)
+            for operation_type, product, quantity in cart:
+                if operation_type == "remove":
+                    removed = await self.marketplace.remove_many(cart_id, product, quantity)
+                    if removed < quantity:
+                        raise ValueError(f"only {removed} of {quantity} units of {product} "
+                                         f"were in cart {cart_id}")
+                    continue
+                while quantity > 0:
+                    result = await self.marketplace.add_many(
+                        cart_id, product, quantity,
+                        block=self.blocking, timeout=self.retry_wait_time
+                    )
+                    quantity -= result
+                    if result == 0 and not self.blocking:
+                        await asyncio.sleep(self.retry_wait_time)
+            await self.marketplace.place_order(cart_id)
@@ -0,0 +1,311 @@
+"""
+This module represents the asyncio Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import asyncio
+import unittest
+
+from .marketplace import Marketplace
+from .product import Product
+
+
+class TestAsyncMarketplace(unittest.IsolatedAsyncioTestCase):
+    """
+    Class that represents the test unit of AsyncMarketplace.
+    """
+
+    def setUp(self):
+        """
+        Used for creating an AsyncMarketplace object instantiation
+        """
+        self.marketplace = AsyncMarketplace(15)
+
+    async def test_add_to_cart(self):
+        """
+        Used for testing the add_to_cart() coroutine
+        """
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        self.assertFalse(
+            await self.marketplace.add_to_cart(cart, Product("Linden", 9)),
+            "wrong return value for add_to_cart()",
+        )
+        self.assertFalse(
+            await self.marketplace.add_to_cart(
+                cart, Product("Linden", 9), block=True, timeout=0.01
+            ),
+            "wrong return value for a timed out add_to_cart()",
+        )
+        consumer = asyncio.create_task(
+            self.marketplace.add_to_cart(cart, Product("Linden", 9), block=True)
+        )
+        await asyncio.sleep(0)
+        self.assertTrue(await self.marketplace.publish(producer, Product("Linden", 9)))
+        self.assertTrue(await consumer, "wrong return value for add_to_cart()")
+
+    async def test_fair_add(self):
+        """
+        Used for testing that in fair mode the waiting tasks get the units
+        in arrival order
+        """
+        self.marketplace = AsyncMarketplace(15, fair=True)
+        producer = self.marketplace.register_producer()
+        first, second = self.marketplace.new_cart(), self.marketplace.new_cart()
+        consumers = [asyncio.create_task(self.marketplace.add_many(cart, Product("Linden", 9),
+                                                                   2, block=True))
+                     for cart in (first, second)]
+        await asyncio.sleep(0)
+        self.assertEqual(await self.marketplace.publish_many(producer, Product("Linden", 9), 3),
+                         3)
+        self.assertEqual(await consumers[0], 2)
+        self.assertEqual(await consumers[1], 1)
+
+    async def test_publish(self):
+        """
+        Used for testing the publish() coroutine
+        """
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        self.assertEqual(
+            await self.marketplace.publish_many(producer, Product("Linden", 9), 20), 15,
+            "wrong return value for publish_many()",
+        )
+        publisher = asyncio.create_task(
+            self.marketplace.publish(producer, Product("Linden", 9), block=True)
+        )
+        await asyncio.sleep(0)
+        self.assertEqual(await self.marketplace.add_many(cart, Product("Linden", 9), 2), 2)
+        self.assertTrue(await publisher, "wrong return value for publish()")
+        await self.marketplace.remove_from_cart(cart, Product("Linden", 9))
+        self.assertEqual(
+            await self.marketplace.place_order(cart), [Product("Linden", 9)],
+            "place_order failed",
+        )
+
+
+class AsyncMarketplace:
+    """
+    Class that represents the Marketplace for producers and consumers that are
+    asyncio tasks of the same event loop, instead of threads.
+
+    The state is kept by a Marketplace, whose locks are never contended here.
+    The waits are done on asyncio conditions, so a waiting task yields the event loop.
+    """
+
+    def __init__(self, queue_size_per_producer, **kwargs):
+        """
+        Constructor
+
+        :type queue_size_per_producer: Int
+        :param queue_size_per_producer: the maximum size of a queue associated with each producer
+
+        :type kwargs:
+        :param kwargs: other arguments that are passed to the Marketplace's __init__()
+        """
+        self.marketplace = Marketplace(queue_size_per_producer, **kwargs)
+
+        # A dictionary mapping products to the conditions their waiting consumers
+        # wait on, and one mapping producers to the conditions they wait on
+        # while their queue is full
+        self.product_conditions = {}
+        self.producer_conditions = {}
+
+    @staticmethod
+    async def _wait(condition, predicate, timeout):
+        """
+        Waits on the condition until the predicate is true or the timeout expires
+
+        :returns the last value of the predicate
+        """
+        async with condition:
+            try:
+                return await asyncio.wait_for(condition.wait_for(predicate), timeout)
+            except asyncio.TimeoutError:
+                return predicate()
+
+    @staticmethod
+    async def _notify(condition, quantity, everyone=False):
+        """
+        Wakes at most 'quantity' tasks waiting on the condition, or all of them
+        if 'everyone' is True
+        """
+        if condition is not None and quantity > 0:
+            async with condition:
+                if everyone:
+                    condition.notify_all()
+                else:
+                    condition.notify(quantity)
+
+    async def _notify_product(self, product, quantity):
+        """
+        Wakes the tasks waiting for the units of the product. In fair mode, the
+        Marketplace hands the units to the carts in an order the condition doesn't
+        know, so all the waiting tasks are woken to check their carts.
+        """
+        await self._notify(self.product_conditions.get(product), quantity,
+                           everyone=self.marketplace.waiters.fair)
+
+    def register_producer(self):
+        """
+        Returns an id for a producer which calls this procedure
+        """
+        producer_id = self.marketplace.register_producer()
+        self.producer_conditions[producer_id] = asyncio.Condition()
+        return producer_id
+
+    def new_cart(self, owner=None):
+        """
+        Creates a new cart for the consumer.
+
+        :type owner: String
+        :param owner: the name of the consumer that buys the cart's products,
+        the current task's name by default
+
+        :returns an int representing the cart_id
+        """
+        if owner is None and asyncio.current_task() is not None:
+            owner = asyncio.current_task().get_name()
+        return self.marketplace.new_cart(owner)
+
+    async def publish_many(self, producer_id, product, quantity, block=False, timeout=None):
+        """
+        Adds at most 'quantity' units of the product to the Marketplace.
+        See Marketplace.publish_many().
+
+        :returns the number of published units
+        """
+        marketplace = self.marketplace
+        producer_id = int(producer_id)
+        if block:
+            await self._wait(
+                self.producer_conditions[producer_id],
+                lambda: marketplace.producers_queue_size[producer_id]
+                < marketplace.queue_size_per_producer,
+                timeout,
+            )
+        published = marketplace.publish_many(producer_id, product, quantity)
+        await self._notify_product(product, published)
+        return published
+
+    async def publish(self, producer_id, product, block=False, timeout=None):
+        """
+        Adds the product created by the producer to the Marketplace.
+        See Marketplace.publish().
+
+        :returns True or False. If the caller receives False, it should wait and then try again.
+        """
+        return await self.publish_many(producer_id, product, 1, block, timeout) == 1
+
+    async def add_many(self, cart_id, product, quantity, block=False, timeout=None):
+        """
+        Adds at most 'quantity' units of the product to the given cart.
+        See Marketplace.add_many().
+
+        :returns the number of added units
+        """
+        marketplace = self.marketplace
+        if block:
+            if marketplace.waiters.fair and not marketplace.available(cart_id, product):
+                # The cart takes its place in the product's queue before waiting
+                added = await self._add_units(cart_id, product, quantity)
+                if added > 0:
+                    return added
+            condition = self.product_conditions.setdefault(product, asyncio.Condition())
+            await self._wait(condition, lambda: marketplace.available(cart_id, product), timeout)
+        return await self._add_units(cart_id, product, quantity)
+
+    async def _add_units(self, cart_id, product, quantity):
+        """
+        Adds at most 'quantity' units of the product to the cart without waiting,
+        waking the producers whose units were bought
+
+        :returns the number of added units
+        """
+        marketplace = self.marketplace
+        before = dict(marketplace.carts[cart_id].get(product, {}))
+        added = marketplace.add_many(cart_id, product, quantity)
+        if added > 0:
+            # The producers of the bought units are the ones whose counts grew in the cart
+            for producer_id, num_units in marketplace.carts[cart_id][product].items():
+                await self._notify(self.producer_conditions[producer_id],
+                                   num_units - before.get(producer_id, 0))
+        return added
+
+    async def add_to_cart(self, cart_id, product, block=False, timeout=None):
+        """
+        Adds a product to the given cart.
+        See Marketplace.add_to_cart().
+
+        :returns True or False. If the caller receives False, it should wait and then try again
+        """
+        return await self.add_many(cart_id, product, 1, block, timeout) == 1
+
+    async def remove_many(self, cart_id, product, quantity):
+        """
+        Removes at most 'quantity' units of the product from the cart.
+        See Marketplace.remove_many().
+
+        :returns the number of removed units
+        """
+        removed = self.marketplace.remove_many(cart_id, product, quantity)
+        await self._notify_product(product, removed)
+        return removed
+
+    async def remove_from_cart(self, cart_id, product):
+        """
+        Removes a product from cart.
+        See Marketplace.remove_from_cart().
+        """
+        if await self.remove_many(cart_id, product, 1) == 0:
+            raise ValueError(f"{product} is not in cart {cart_id}")
+
+    async def place_order(self, cart_id):
+        """
+        Return a list with all the products in the cart.
+        See Marketplace.place_order().
+        """
+        return self.marketplace.place_order(cart_id)
+
+    def is_running(self):
+        """
+        Returns False once the Marketplace is shut down
+        """
+        return self.marketplace.is_running()
+
+    def shutdown(self):
+        """
+        Stops accepting products. The producers' waits end by their timeouts.
+        See Marketplace.shutdown().
+        """
+        self.marketplace.shutdown()
+
+    def drain(self):
+        """
+        Removes all the units left in the inventory.
+        See Marketplace.drain().
+        """
+        return self.marketplace.drain()
+
+    def stats(self):
+        """
+        Returns the runtime statistics gathered so far.
+        See Marketplace.stats().
+        """
+        return self.marketplace.stats()
+
+    def latencies(self):
+        """
+        Returns the latencies of the Marketplace's methods recorded so far.
+        See Marketplace.latencies().
+        """
+        return self.marketplace.latencies()
+
+    def close(self):
+        """
+        Writes all the placed orders that are still buffered
+        """
+        self.marketplace.close()
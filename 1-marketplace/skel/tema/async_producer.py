@@ -0,0 +1,67 @@
+"""
+This module represents the asyncio Producer.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import asyncio
+
+
+class AsyncProducer:
+    """
+    Class that represents a producer running as an asyncio task.
+    """
+
+    def __init__(self, products, marketplace, republish_wait_time, name=None, blocking=True):
+        """
+        Constructor.
+
+        @type products: List()
+        @param products: a list of products that the producer will produce
+
+        @type marketplace: AsyncMarketplace
+        @param marketplace: a reference to the marketplace
+
+        @type republish_wait_time: Time
+        @param republish_wait_time: the number of seconds that a producer must
+        wait until the marketplace becomes available
+
+        @type name: String
+        @param name: the producer's name, used as the name of its task
+
+        @type blocking: Bool
+        @param blocking: if True, a producer waits inside publish_many() until its queue
+        has room instead of sleeping between attempts
+        """
+        self.products = products
+        self.marketplace = marketplace
+        self.republish_wait_time = republish_wait_time
+        self.name = name
+        self.blocking = blocking
+        self.prod_id = marketplace.register_producer()
+
+    async def run(self):
+        """
+        Takes a product from the list and then publishes all of its units
+        in the Marketplace, as many as possible at a time.
+        The waits are the same as the ones of Producer.run(), done with asyncio.sleep().
+        The producer returns once the Marketplace is shut down.
+        """
+        while 1:
+            for product, quantity, wait_time in self.products:
+                cnt = quantity
+                while cnt > 0:
+                    result = await self.marketplace.publish_many(
+                        self.prod_id, product, cnt,
+                        block=self.blocking, timeout=self.republish_wait_time
+                    )
+                    if not result:
+                        if not self.marketplace.is_running():
+                            return
+                        if not self.blocking:
+                            await asyncio.sleep(self.republish_wait_time)
+                    else:
+                        await asyncio.sleep(wait_time * result)
+                        cnt -= result
@@ -0,0 +1,307 @@
+"""
+This module reads and writes the binary scenarios.
+
+A binary scenario is made of the following sections, in this order:
+    - the header: the magic, the version and the sections' sizes
+    - the metadata: a JSON object with the marketplace's arguments, the product
+      definitions, in the order of their indexes, and the producers, whose products
+      are product indexes
+    - the operations: fixed-width (op code, product index, quantity) records
+    - the carts: fixed-width (first operation, number of operations) records
+    - the consumers: fixed-width (name's offset, name's length, first cart,
+      number of carts, retry wait time) records
+    - the consumers' names, encoded as UTF-8
+
+The file is memory-mapped and the consumers' operations are unpacked from it as
+(type, product, quantity) tuples while the consumers iterate their carts.
+
+Usage: python -m tema.binary_scenario test.in test.bin, to convert a test's input file.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import unittest
+from json import dumps, loads
+
+from .product import Tea
+from .scenario import load_products, read_test_input
+
+MAGIC = b"MKTB"
+VERSION = 1
+
+# magic, version, metadata's size, number of operations, carts and consumers,
+# names' size
+HEADER = struct.Struct("<4sIQQQQQ")
+OPERATION = struct.Struct("<BII")
+CART = struct.Struct("<QI")
+CONSUMER = struct.Struct("<QIQId")
+
+# The operation types, indexed by their op codes
+OPERATION_TYPES = ("add", "remove")
+OPERATION_CODES = {operation_type: code for code, operation_type in enumerate(OPERATION_TYPES)}
+
+
+class TestBinaryScenario(unittest.TestCase):
+    """
+    Class that represents the test unit of the binary scenario's reader and writer.
+    """
+
+    def test_round_trip(self):
+        """
+        Used for testing that a written scenario is read back with actual products
+        """
+        products = {"id1": {"product_type": "Tea", "name": "Linden", "type": "Herbal",
+                            "price": 9}}
+        producers = [{"name": "prod1", "products": [["id1", 2, 0.1]],
+                      "republish_wait_time": 0.2}]
+        consumers = [{"name": "cons1", "retry_wait_time": 0.1,
+                      "carts": [[{"type": "add", "product": "id1", "quantity": 3},
+                                 {"type": "remove", "product": "id1", "quantity": 1}],
+                                [{"type": "add", "product": "id1", "quantity": 2}]]}]
+        with tempfile.TemporaryDirectory() as scenario_dir:
+            filename = os.path.join(scenario_dir, "test.bin")
+            with open(filename, "wb") as scenario_file:
+                writer = BinaryScenarioWriter(scenario_file, {"queue_size_per_producer": 4},
+                                              products, producers)
+                for consumer in consumers:
+                    writer.add_consumer(consumer)
+                writer.close()
+
+            with BinaryScenario(filename) as scenario:
+                market_config = scenario.market_config()
+                linden = Tea("Linden", 9, "Herbal")
+                self.assertEqual(market_config["marketplace"], {"queue_size_per_producer": 4})
+                self.assertEqual(market_config["producers"][0]["products"],
+                                 [(linden, 2, 0.1)])
+                consumer, = market_config["consumers"]
+                self.assertEqual((consumer["name"], consumer["retry_wait_time"]),
+                                 ("cons1", 0.1))
+                carts = [list(cart) for cart in consumer["carts"]]
+                self.assertEqual(carts, [[("add", linden, 3), ("remove", linden, 1)],
+                                         [("add", linden, 2)]])
+                self.assertEqual(pickle.loads(pickle.dumps(consumer["carts"][1])),
+                                 [("add", linden, 2)])
+            self.assertTrue(scenario.buffer.closed)
+
+
+class BinaryScenarioWriter:
+    """
+    Class that writes a binary scenario, one consumer at a time.
+    The operations are written as they are added, while the carts, the consumers and
+    their names are kept in compact buffers, written by close().
+    """
+
+    def __init__(self, output_file, marketplace, products, producers):
+        """
+        Constructor. Writes the header, to be completed by close(), and the metadata.
+
+        :type output_file: BinaryIO
+        :param output_file: the seekable output file
+
+        :type marketplace: Dict
+        :param marketplace: the marketplace's arguments
+
+        :type products: Dict
+        :param products: the product definitions, by product id
+
+        :type producers: List
+        :param producers: the producers' configurations, with product ids
+        """
+        self.file = output_file
+        self.product_indexes = {product_id: index for index, product_id in enumerate(products)}
+        self.metadata = dumps({
+            "marketplace": marketplace,
+            "products": list(products.values()),
+            "producers": [dict(producer, products=[[self.product_indexes[i], quantity, sleep]
+                                                   for i, quantity, sleep
+                                                   in producer["products"]])
+                          for producer in producers],
+        }).encode()
+        self.num_operations = 0
+        self.carts = bytearray()
+        self.consumers = bytearray()
+        self.names = bytearray()
+
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(self.metadata), 0, 0, 0, 0))
+        self.file.write(self.metadata)
+
+    def add_consumer(self, consumer):
+        """
+        Writes a consumer's operations and records its carts
+
+        :type consumer: Dict
+        :param consumer: the consumer's configuration, with product ids
+        """
+        name = consumer["name"].encode()
+        self.consumers += CONSUMER.pack(len(self.names), len(name),
+                                        len(self.carts) // CART.size, len(consumer["carts"]),
+                                        consumer["retry_wait_time"])
+        self.names += name
+        for cart in consumer["carts"]:
+            self.file.write(b"".join(OPERATION.pack(OPERATION_CODES[operation["type"]],
+                                                    self.product_indexes[operation["product"]],
+                                                    operation["quantity"])
+                                     for operation in cart))
+            self.carts += CART.pack(self.num_operations, len(cart))
+            self.num_operations += len(cart)
+
+    def close(self):
+        """
+        Writes the carts, the consumers and their names, and completes the header
+        """
+        self.file.write(self.carts)
+        self.file.write(self.consumers)
+        self.file.write(self.names)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(self.metadata), self.num_operations,
+                                    len(self.carts) // CART.size,
+                                    len(self.consumers) // CONSUMER.size, len(self.names)))
+
+
+class BinaryCart:
+    """
+    Class that represents a cart of a binary scenario. Its operations are unpacked
+    from the memory-mapped file each time the cart is iterated.
+    A cart is pickled as the list of its operations.
+    """
+
+    __slots__ = ("scenario", "start", "end")
+
+    def __init__(self, scenario, first_operation, num_operations):
+        """
+        Constructor
+
+        :type scenario: BinaryScenario
+        :param scenario: the cart's scenario
+
+        :type first_operation: Int
+        :param first_operation: the index of the cart's first operation
+
+        :type num_operations: Int
+        :param num_operations: the number of the cart's operations
+        """
+        self.scenario = scenario
+        self.start = scenario.operations_offset + first_operation * OPERATION.size
+        self.end = self.start + num_operations * OPERATION.size
+
+    def __iter__(self):
+        products = self.scenario.products
+        for code, product_index, quantity in OPERATION.iter_unpack(
+                self.scenario.buffer[self.start:self.end]):
+            yield OPERATION_TYPES[code], products[product_index], quantity
+
+    def __len__(self):
+        return (self.end - self.start) // OPERATION.size
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+class BinaryScenario:
+    """
+    Class that represents a memory-mapped binary scenario.
+    The mapping is released by close(), once the scenario's carts are no longer iterated.
+    """
+
+    def __init__(self, filename):
+        """
+        Constructor. Maps the file and reads its header and metadata.
+
+        :type filename: String
+        :param filename: the scenario's file
+        """
+        with open(filename, "rb") as scenario_file:
+            self.buffer = mmap.mmap(scenario_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, metadata_size, num_operations, num_carts, self.num_consumers,
+         _) = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            self.buffer.close()
+            raise ValueError(f"{filename} is not a version {VERSION} binary scenario")
+
+        self.operations_offset = HEADER.size + metadata_size
+        self.carts_offset = self.operations_offset + num_operations * OPERATION.size
+        self.consumers_offset = self.carts_offset + num_carts * CART.size
+        self.names_offset = self.consumers_offset + self.num_consumers * CONSUMER.size
+
+        self.metadata = loads(self.buffer[HEADER.size:self.operations_offset])
+        self.products = load_products(self.metadata["products"])
+
+    def producers(self):
+        """
+        Returns the producers' configurations, with products instead of product indexes
+        """
+        return [dict(producer, products=[(self.products[i], quantity, sleep_time)
+                                         for i, quantity, sleep_time in producer["products"]])
+                for producer in self.metadata["producers"]]
+
+    def consumer(self, index):
+        """
+        Returns the configuration of the consumer with the given index.
+        Its carts unpack their operations as they are iterated.
+
+        :type index: Int
+        :param index: the consumer's index
+        """
+        (name_offset, name_size, first_cart, num_carts,
+         retry_wait_time) = CONSUMER.unpack_from(self.buffer,
+                                                 self.consumers_offset + index * CONSUMER.size)
+        name_offset += self.names_offset
+        carts = [BinaryCart(self, first_operation, num_operations)
+                 for first_operation, num_operations
+                 in CART.iter_unpack(self.buffer[self.carts_offset + first_cart * CART.size:
+                                                 self.carts_offset
+                                                 + (first_cart + num_carts) * CART.size])]
+        return {"name": self.buffer[name_offset:name_offset + name_size].decode(),
+                "retry_wait_time": retry_wait_time,
+                "carts": carts}
+
+    def market_config(self):
+        """
+        Returns the scenario as a test's market configuration, whose consumers
+        are an iterator that reads them as they are needed
+        """
+        return {"marketplace": self.metadata["marketplace"],
+                "producers": self.producers(),
+                "consumers": (self.consumer(index) for index in range(self.num_consumers))}
+
+    def close(self):
+        """
+        Unmaps the scenario's file
+        """
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    """
+    Converts a test's input file to a binary scenario
+    """
+    test_input = read_test_input("Usage: python -m tema.binary_scenario input_filepath "
+                                 "scenario_filepath")
+    if test_input is None:
+        return
+
+    market_config, filename = test_input
+    with open(filename, "wb") as scenario_file:
+        writer = BinaryScenarioWriter(scenario_file, market_config["marketplace"],
+                                      market_config["products"], market_config["producers"])
+        for consumer in market_config["consumers"]:
+            writer.add_consumer(consumer)
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
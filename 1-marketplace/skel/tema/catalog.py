@@ -0,0 +1,91 @@
+"""
+This module represents the catalog of the distinct products of a test.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import unittest
+
+from .product import Coffee, Product, Tea
+
+
+class TestProductCatalog(unittest.TestCase):
+    """
+    Class that represents the test unit of ProductCatalog.
+    """
+
+    def setUp(self):
+        """
+        Used for creating a ProductCatalog object instantiation
+        """
+        self.catalog = ProductCatalog()
+
+    def test_intern(self):
+        """
+        Used for testing that equal products are interned to the same object
+        """
+        tea = self.catalog.intern(Tea("Linden", 9, "Herbal"))
+        self.assertIs(self.catalog.intern(Tea("Linden", 9, "Herbal")), tea)
+        self.assertIsNot(self.catalog.intern(Product("Linden", 9)), tea)
+        self.assertEqual(len(self.catalog), 2)
+
+    def test_product_id(self):
+        """
+        Used for testing that the products get dense ids, in interning order
+        """
+        coffee = self.catalog.intern(Coffee("Indonezia", 1, "5.05", "MEDIUM"))
+        tea = self.catalog.intern(Tea("Linden", 9, "Herbal"))
+        self.assertEqual(self.catalog.product_id(coffee), 0)
+        self.assertEqual(self.catalog.product_id(Tea("Linden", 9, "Herbal")), 1)
+        self.assertIs(self.catalog[1], tea)
+
+
+class ProductCatalog:
+    """
+    Class that interns the products: each distinct product is kept once and
+    gets a dense integer id, in the order the products were interned.
+
+    Since the equal products are the same object, the Marketplace's dictionary
+    lookups find them by identity and never compare their fields.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        # The interned products, indexed by their ids
+        self.products = []
+
+        # A dictionary mapping each interned product to its id
+        self.ids = {}
+
+    def intern(self, product):
+        """
+        Returns the catalog's product that is equal to the given one,
+        adding the product to the catalog if it's a new one
+
+        :type product: Product
+        :param product: the product to intern
+        """
+        product_id = self.ids.get(product)
+        if product_id is None:
+            product_id = self.ids[product] = len(self.products)
+            self.products.append(product)
+        return self.products[product_id]
+
+    def product_id(self, product):
+        """
+        Returns the id of an interned product
+
+        :type product: Product
+        :param product: a product equal to an interned one
+        """
+        return self.ids[product]
+
+    def __getitem__(self, product_id):
+        return self.products[product_id]
+
+    def __len__(self):
+        return len(self.products)
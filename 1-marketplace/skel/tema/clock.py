@@ -0,0 +1,231 @@
+"""
+This module offers the clocks the producers and consumers wait on.
+
+The real clock sleeps for real. The virtual clock runs a discrete-event simulation:
+the threads registered on it sleep in virtual time, and the time jumps to the
+earliest wake-up as soon as all of them are sleeping, so a scenario runs as fast
+as its work allows.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import time
+import unittest
+from heapq import heappop, heappush
+from itertools import count
+from threading import Event, Lock, Thread
+
+
+class TestVirtualClock(unittest.TestCase):
+    """
+    Class that represents the test unit of VirtualClock.
+    """
+
+    def setUp(self):
+        """
+        Used for creating a VirtualClock object instantiation
+        """
+        self.clock = VirtualClock()
+
+    def test_sleep(self):
+        """
+        Used for testing that a lone thread's sleeps advance the time at once
+        """
+        self.clock.register()
+        start = time.monotonic()
+        self.clock.sleep(30)
+        self.clock.sleep(0.5)
+        self.assertEqual(self.clock.now(), 30.5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.clock.unregister()
+
+    def test_wake_up_order(self):
+        """
+        Used for testing that the sleeping threads wake up in the order of their
+        virtual wake-up times
+        """
+        woken = []
+
+        def sleeper(name, seconds):
+            self.clock.sleep(seconds)
+            woken.append((name, self.clock.now()))
+            self.clock.unregister()
+
+        self.clock.register()
+        threads = []
+        for name, seconds in (("slow", 3), ("fast", 1), ("medium", 2)):
+            self.clock.register()
+            threads.append(Thread(target=sleeper, args=(name, seconds)))
+            threads[-1].start()
+        self.clock.unregister()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(woken, [("fast", 1), ("medium", 2), ("slow", 3)])
+
+    def test_close(self):
+        """
+        Used for testing that closing the clock wakes the sleeping threads at once
+        and stops the time
+        """
+        self.clock.register()
+        self.clock.register()
+        sleeper = Thread(target=self.clock.sleep, args=(1,), daemon=True)
+        sleeper.start()
+        sleeper.join(0.1)
+        self.assertTrue(sleeper.is_alive())
+        self.clock.close()
+        sleeper.join(1)
+        self.assertFalse(sleeper.is_alive())
+        self.clock.sleep(1)
+        self.assertEqual(self.clock.now(), 0)
+
+
+class RealClock:
+    """
+    Class that represents the wall clock.
+    Its threads sleep for real, so registering them does nothing.
+    """
+
+    @staticmethod
+    def now():
+        """
+        Returns the current time, in seconds
+        """
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(seconds, interrupt=None):
+        """
+        Sleeps for the given number of seconds, or until the interrupt is set
+
+        :type seconds: Float
+        :param seconds: the number of seconds to sleep
+
+        :type interrupt: Event
+        :param interrupt: an event that ends the sleep early when it's set
+        """
+        if interrupt is None:
+            time.sleep(seconds)
+        else:
+            interrupt.wait(seconds)
+
+    def register(self):
+        """
+        Registers a thread that sleeps on the clock
+        """
+
+    def unregister(self):
+        """
+        Unregisters a thread that no longer sleeps on the clock
+        """
+
+    def close(self):
+        """
+        Stops the clock. The real time goes on, the threads are woken by their interrupts.
+        """
+
+
+# The clock used by the producers and consumers by default
+REAL_CLOCK = RealClock()
+
+
+class VirtualClock:
+    """
+    Class that represents a virtual clock, driving a discrete-event simulation.
+
+    Every thread that sleeps on the clock must be registered before it starts,
+    by whoever starts it, and unregistered once it's done. A registered thread is
+    active unless it's sleeping. When no thread is active, the time jumps to the
+    earliest wake-up time and the threads that wake up then become active again.
+
+    The threads must not wait for real time while they're active, e.g. inside
+    the Marketplace's blocking operations, since the time stands still meanwhile.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.lock = Lock()
+
+        # The virtual time, in seconds
+        self.time = 0.0
+
+        # The number of registered threads that aren't sleeping
+        self.active = 0
+
+        # A heap of the sleeping threads' (wake-up time, sequence number, event) entries;
+        # the sequence number wakes up the threads sleeping until the same time in order
+        self.sleepers = []
+        self.sequence = count()
+
+        self.closed = False
+
+    def now(self):
+        """
+        Returns the virtual time, in seconds
+        """
+        return self.time
+
+    def register(self):
+        """
+        Registers a thread that sleeps on the clock. The time stands still
+        until the thread sleeps or is unregistered.
+        """
+        with self.lock:
+            self.active += 1
+
+    def unregister(self):
+        """
+        Unregisters a thread that no longer sleeps on the clock
+        """
+        with self.lock:
+            self.active -= 1
+            self._advance()
+
+    def sleep(self, seconds, interrupt=None):  # pylint: disable=unused-argument
+        """
+        Sleeps for the given number of virtual seconds. Once the clock is closed,
+        the sleeps return at once.
+
+        :type seconds: Float
+        :param seconds: the number of seconds to sleep
+
+        :type interrupt: Event
+        :param interrupt: unused, the virtual sleeps being ended by close()
+        """
+        woken = Event()
+        with self.lock:
+            if self.closed:
+                return
+            heappush(self.sleepers, (self.time + seconds, next(self.sequence), woken))
+            self.active -= 1
+            self._advance()
+        woken.wait()
+
+    def _advance(self):
+        """
+        Moves the time to the earliest wake-up time and wakes up the threads
+        sleeping until then, if no thread is active. Must be called with the lock held.
+        """
+        if self.active or self.closed or not self.sleepers:
+            return
+
+        self.time = self.sleepers[0][0]
+        while self.sleepers and self.sleepers[0][0] == self.time:
+            _, _, woken = heappop(self.sleepers)
+            self.active += 1
+            woken.set()
+
+    def close(self):
+        """
+        Stops the clock: the time no longer advances and the sleeping threads
+        are woken up at once, so that they can finish
+        """
+        with self.lock:
+            self.closed = True
+            for _, _, woken in self.sleepers:
+                woken.set()
+            self.sleepers.clear()
@@ -6,8 +6,10 @@ Assignment 1
 March 2021
 """
 
+from concurrent.futures import wait
 from threading import Thread
-from time import sleep
+
+from .clock import REAL_CLOCK
 
 
 class Consumer(Thread):
@@ -15,12 +17,14 @@ class Consumer(Thread):
     Class that represents a consumer.
     """
 
-    def __init__(self, carts, marketplace, retry_wait_time, **kwargs):
+    def __init__(self, carts, marketplace, retry_wait_time, blocking=True, clock=REAL_CLOCK,
+                 backorders=False, **kwargs):
         """
         Constructor.
 
         :type carts: List
-        :param carts: a list of add and remove operations
+        :param carts: a list of carts, each of them an iterable of
+        (type, product, quantity) add and remove operations
 
         :type marketplace: Marketplace
         :param marketplace: a reference to the marketplace
@@ -29,6 +33,18 @@ class Consumer(Thread):
         :param retry_wait_time: the number of seconds that a producer must wait
         until the Marketplace becomes available
 
+        :type blocking: Bool
+        :param blocking: if True, a consumer waits inside add_to_cart() until the
+        product becomes available instead of sleeping between attempts
+
+        :type clock: RealClock or VirtualClock
+        :param clock: the clock the consumer sleeps on; a virtual clock
+        registers the consumer here, so that the time stands still until it runs
+
+        :type backorders: Bool
+        :param backorders: if True, the consumer places its adds as backorders,
+        all the adds before a remove at once, and waits for them together
+
         :type kwargs:
         :param kwargs: other arguments that are passed to the Thread's __init__()
         """
@@ -36,27 +52,95 @@ class Consumer(Thread):
         self.carts = carts
         self.marketplace = marketplace
         self.functions = {
-            "remove": self.marketplace.remove_from_cart,
-            "add": self.marketplace.add_to_cart,
+            "remove": self.remove_units,
+            "add": self.add_units,
         }
         self.retry_wait_time = retry_wait_time
+        self.blocking = blocking
+        self.backorders = backorders
+        self.clock = clock
+        self.clock.register()
 
-    def run(self):
+    def add_units(self, cart_id, product, quantity):
+        """
+        Adds at most 'quantity' units of the product to the cart with a single
+        Marketplace call. In blocking mode, the call waits for at most
+        'retry_wait_time' seconds inside the Marketplace for the product to appear.
+
+        :returns the number of added units
+        """
+        return self.marketplace.add_many(
+            cart_id, product, quantity,
+            block=self.blocking, timeout=self.retry_wait_time
+        )
+
+    def remove_units(self, cart_id, product, quantity):
+        """
+        Removes 'quantity' units of the product from the cart with a single
+        Marketplace call. The units should have been added by this consumer,
+        so a removal of fewer units raises a ValueError, like remove_from_cart().
+
+        :returns the number of removed units
+        """
+        removed = self.marketplace.remove_many(cart_id, product, quantity)
+        if removed < quantity:
+            raise ValueError(f"only {removed} of {quantity} units of {product} "
+                             f"were in cart {cart_id}")
+        return removed
+
+    def shop(self):
         """
         Creates a new cart and then performs the specified operations on it.
-        If the operation fails, the consumer sleeps 'retry_wait_time' seconds.
+        Each operation moves as many of its units as possible in a single call.
+        If the operation fails, the consumer yields 'retry_wait_time', the number of
+        seconds to wait before trying again, to whoever drives it.
+        In blocking mode, an add operation waits for at most 'retry_wait_time' seconds
+        inside the Marketplace, so the consumer is woken as soon as a unit appears.
+        With backorders, the consumer yields the futures of the backorders to wait for.
         When all the operations have been done, the consumer places the cart's order.
         """
         for _, cart in enumerate(self.carts):
-            cart_id = self.marketplace.new_cart()
-            for _, operation in enumerate(cart):
-                quantity = operation["quantity"]
-                while quantity > 0:
-                    result = self.functions[operation["type"]](
-                        cart_id, operation["product"]
-                    )
-                    if result or result is None:
-                        quantity -= 1
-                    else:
-                        sleep(self.retry_wait_time)
+            cart_id = self.marketplace.new_cart(self.name)
+            if self.backorders:
+                yield from self.backorder_cart(cart_id, cart)
+            else:
+                for operation_type, product, quantity in cart:
+                    while quantity > 0:
+                        result = self.functions[operation_type](cart_id, product, quantity)
+                        quantity -= result
+                        if result == 0 and not self.blocking:
+                            yield self.retry_wait_time
             self.marketplace.place_order(cart_id)
+
+    def backorder_cart(self, cart_id, cart):
+        """
+        Places the cart's adds as backorders, yielding their futures to wait for
+        before each remove, which may only remove units already in the cart,
+        and at the end of the cart
+        """
+        futures = []
+        for operation_type, product, quantity in cart:
+            if operation_type == "add":
+                futures.append(self.marketplace.backorder(cart_id, product, quantity))
+                continue
+            if futures:
+                yield futures
+                futures = []
+            self.functions[operation_type](cart_id, product, quantity)
+        if futures:
+            yield futures
+
+    def run(self):
+        """
+        Shops in its own thread, sleeping on its clock each time an operation fails,
+        or waiting for its backorders.
+        The consumer leaves its clock once all of its carts are ordered.
+        """
+        try:
+            for wait_for in self.shop():
+                if self.backorders:
+                    wait(wait_for)
+                else:
+                    self.clock.sleep(wait_for)
+        finally:
+            self.clock.unregister()
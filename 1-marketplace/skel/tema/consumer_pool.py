@@ -0,0 +1,258 @@
+"""
+This module runs the consumers as tasks of a bounded pool of worker threads,
+instead of a thread per consumer.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import io
+import os
+import unittest
+from collections import deque
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import monotonic
+
+from .consumer import Consumer
+from .marketplace import Marketplace
+from .product import Product
+
+# The number of consumers a pool holds before submit() waits for one to finish
+MAX_PENDING = 4096
+
+
+class TestConsumerPool(unittest.TestCase):
+    """
+    Class that represents the test unit of ConsumerPool.
+    """
+
+    def test_retries(self):
+        """
+        Used for testing that a single worker serves consumers that wait for
+        each other's products, attributing the purchases to the right consumers
+        """
+        output = io.StringIO()
+        marketplace = Marketplace(5, log_config={"level": "OFF"},
+                                  order_output={"stream": output})
+        producer = marketplace.register_producer()
+        linden = Product("Linden", 9)
+        pool = ConsumerPool(workers=1)
+        pool.submit(Consumer([[("add", linden, 2)]], marketplace, 0.01,
+                             blocking=False, name="cons1"))
+        pool.submit(Consumer([[("add", linden, 1), ("remove", linden, 1)]], marketplace, 0.01,
+                             blocking=False, name="cons2"))
+        self.assertEqual(marketplace.publish_many(producer, linden, 3), 3)
+        pool.join()
+        self.assertEqual(output.getvalue(),
+                         f"cons1 bought {linden}\ncons1 bought {linden}\n")
+
+    def test_max_pending(self):
+        """
+        Used for testing that submit() waits for room, so the consumers are served in turn
+        """
+        output = io.StringIO()
+        marketplace = Marketplace(5, log_config={"level": "OFF"},
+                                  order_output={"stream": output})
+        producer = marketplace.register_producer()
+        linden = Product("Linden", 9)
+        self.assertEqual(marketplace.publish_many(producer, linden, 3), 3)
+        pool = ConsumerPool(workers=2, max_pending=1)
+        for name in ("cons1", "cons2", "cons3"):
+            pool.submit(Consumer([[("add", linden, 1)]], marketplace, 0.01,
+                                 blocking=False, name=name))
+            self.assertLessEqual(pool.pending, 1)
+        pool.join()
+        self.assertEqual(output.getvalue(), "".join(f"{name} bought {linden}\n"
+                                                    for name in ("cons1", "cons2", "cons3")))
+
+    def test_backorders(self):
+        """
+        Used for testing that a consumer waiting for its backorders is resumed
+        once a producer fills them
+        """
+        output = io.StringIO()
+        marketplace = Marketplace(5, log_config={"level": "OFF"},
+                                  order_output={"stream": output})
+        producer = marketplace.register_producer()
+        linden = Product("Linden", 9)
+        pool = ConsumerPool(workers=1)
+        pool.submit(Consumer([[("add", linden, 2), ("remove", linden, 1), ("add", linden, 1)]],
+                             marketplace, 0.01, blocking=False, backorders=True, name="cons1"))
+        while not marketplace.waiters.queues:
+            pool.workers[0].join(0.001)
+        self.assertEqual(marketplace.publish_many(producer, linden, 2), 2)
+        pool.join()
+        self.assertEqual(output.getvalue(), f"cons1 bought {linden}\ncons1 bought {linden}\n")
+
+    def test_error(self):
+        """
+        Used for testing that a consumer's error is raised by join()
+        """
+        marketplace = Marketplace(5, log_config={"level": "OFF"})
+        pool = ConsumerPool(workers=2)
+        pool.submit(Consumer([[("buy", Product("Linden", 9), 1)]], marketplace, 0.01,
+                             blocking=False, name="cons1"))
+        pool.submit(Consumer([[("add", Product("Linden", 9), 1)]], marketplace, 0.01,
+                             blocking=False, name="cons2"))
+        with self.assertRaises(KeyError):
+            pool.join()
+
+    def test_failed_remove(self):
+        """
+        Used for testing that a consumer removing units its cart doesn't hold fails
+        """
+        marketplace = Marketplace(5, log_config={"level": "OFF"})
+        producer = marketplace.register_producer()
+        linden = Product("Linden", 9)
+        self.assertEqual(marketplace.publish_many(producer, linden, 1), 1)
+        pool = ConsumerPool(workers=1)
+        pool.submit(Consumer([[("add", linden, 1), ("remove", linden, 2)]], marketplace, 0.01,
+                             blocking=False, name="cons1"))
+        with self.assertRaises(ValueError):
+            pool.join()
+
+
+class ConsumerPool:
+    """
+    Class that runs the consumers as tasks of a bounded pool of worker threads.
+
+    A consumer's task is its shop() generator, which a worker resumes until one of
+    the consumer's adds finds no unit. Instead of sleeping on its worker, the task is
+    then put in a heap of timers, and a worker resumes it once its retry_wait_time
+    has passed. A consumer placing backorders is resumed once they're all filled.
+    The consumers must not block inside the Marketplace.
+    """
+
+    def __init__(self, workers=None, max_pending=MAX_PENDING):
+        """
+        Constructor. Starts the workers.
+
+        :type workers: Int
+        :param workers: the number of worker threads, the number of CPUs by default
+
+        :type max_pending: Int
+        :param max_pending: the number of unfinished consumers after which submit()
+        waits, so that a streamed scenario's consumers are read as they're served
+        """
+        # Guards the tasks and wakes the idle workers, or the submitter waiting for room
+        lock = Lock()
+        self.condition = Condition(lock)
+        self.room = Condition(lock)
+
+        # The tasks that can be resumed
+        self.ready = deque()
+
+        # A heap of the waiting tasks' (resume time, sequence number, task) entries;
+        # the sequence number keeps the order of the tasks resumed at the same time
+        self.timers = []
+        self.sequence = count()
+
+        # The number of submitted tasks that haven't finished
+        self.pending = 0
+        self.max_pending = max_pending
+
+        # True once no more tasks are submitted
+        self.closed = False
+
+        # The first error raised by a task, which stops the pool
+        self.error = None
+
+        self.workers = [Thread(target=self._work, name=f"ConsumerPool-{i}", daemon=True)
+                        for i in range(workers or os.cpu_count() or 1)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, consumer):
+        """
+        Schedules a consumer's task
+
+        :type consumer: Consumer
+        :param consumer: a consumer that polls, instead of blocking in the Marketplace
+        """
+        with self.condition:
+            while self.pending >= self.max_pending and self.error is None:
+                self.room.wait()
+            self.ready.append(consumer.shop())
+            self.pending += 1
+            self.condition.notify()
+
+    def join(self):
+        """
+        Waits for all the submitted consumers to finish, after which no more consumers
+        can be submitted. Raises the first error raised by a consumer.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+        if self.error is not None:
+            raise self.error
+
+    def _next_task(self):
+        """
+        Returns the next task to resume, waiting for one if none is ready,
+        or None once the pool is done
+        """
+        with self.condition:
+            while True:
+                if self.error is not None or (self.closed and not self.pending):
+                    return None
+                now = monotonic()
+                while self.timers and self.timers[0][0] <= now:
+                    self.ready.append(heappop(self.timers)[2])
+                if self.ready:
+                    return self.ready.popleft()
+                self.condition.wait(self.timers[0][0] - now if self.timers else None)
+
+    def _work(self):
+        """
+        Resumes the tasks until the pool is done
+        """
+        task = self._next_task()
+        while task is not None:
+            try:
+                wait_for = next(task)
+            except StopIteration:
+                wait_for = None
+            except Exception as error:  # pylint: disable=broad-except
+                with self.condition:
+                    self.error = self.error or error
+                    self.condition.notify_all()
+                    self.room.notify()
+                return
+
+            if isinstance(wait_for, list):
+                self._resume_when_done(task, wait_for)
+            else:
+                with self.condition:
+                    if wait_for is None:
+                        self.pending -= 1
+                        self.room.notify()
+                        if self.closed and not self.pending:
+                            self.condition.notify_all()
+                    else:
+                        heappush(self.timers,
+                                 (monotonic() + wait_for, next(self.sequence), task))
+                        self.condition.notify()
+            task = self._next_task()
+
+    def _resume_when_done(self, task, futures):
+        """
+        Makes the task ready once all of its backorders' futures are done. The futures
+        are waited for one after the other, by callbacks, run by whoever completes them.
+        Must be called without the pool's lock, since a done future runs its callback at once.
+        """
+        def resume(_=None):
+            waiting = [future for future in futures if not future.done()]
+            if waiting:
+                waiting[0].add_done_callback(resume)
+                return
+            with self.condition:
+                self.ready.append(task)
+                self.condition.notify()
+
+        resume()
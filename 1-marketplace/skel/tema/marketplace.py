@@ -6,216 +6,525 @@ Assignment 1
 March 2021
 """
 
-from threading import Lock, currentThread
-import unittest
-import logging
-import time
-from logging.handlers import RotatingFileHandler
-from .product import Product
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Lock, current_thread
+from .marketplace_logging import setup_logger
+from .marketplace_profiler import PROFILED_METHODS, MethodProfiler
+from .marketplace_state import Backorder, CartWaiter, Demand, ProducerQueues, Waiters
+from .marketplace_stats import MarketplaceStats
+from .order_writer import OrderWriter
 
+# The default number of locks the inventory's products are spread over
+DEFAULT_LOCK_STRIPES = 64
 
-class TestMarketplace(unittest.TestCase):
+
+# The read-only properties keep the public attributes the grouped state replaced
+class Marketplace:  # pylint: disable=too-many-public-methods
     """
-    Class that represents the test unit of Marketplace.
+    Class that represents the Marketplace. It's the central part of the implementation.
+    The producers and consumers use its methods concurrently.
+
+    The state is guarded by fine-grained locks: the inventory is split in stripes
+    of products, each producer's queue size has its own lock and so does each cart.
+    No method holds two of these locks at the same time, thus they can't deadlock.
+
+    In fair mode, a cart whose add gets fewer units than requested waits in the
+    product's FIFO queue, keeping its place between its consumer's attempts, and
+    the published or returned units are handed to the waiting carts in arrival order.
+    The backorders wait in the same queues, in any mode, and their units are
+    put into their carts by the producers and consumers that publish or return them.
+
+    Once the consumers are done, shutdown() stops the publishing and wakes the
+    waiting producers, so that they can be joined, and drain() removes the units
+    left unsold.
     """
 
-    def setUp(self):
+    def __init__(self, queue_size_per_producer, lock_stripes=DEFAULT_LOCK_STRIPES,
+                 striped=True, log_config=None, order_output=None, collect_stats=False,
+                 profile=False, fair=False):
         """
-        Used for creating a Marketplace object instantiation
+        Constructor
+
+        :type queue_size_per_producer: Int
+        :param queue_size_per_producer: the maximum size of a queue associated with each producer
+
+        :type lock_stripes: Int
+        :param lock_stripes: the number of locks the inventory's products are spread over
+
+        :type striped: Bool
+        :param striped: if False, a single lock guards the inventory, the producers'
+        queue sizes and the carts, as a baseline for the fine-grained locking
+
+        :type log_config: Dict
+        :param log_config: overrides of the logger's DEFAULT_LOG_CONFIG, such as the
+        level or the size at which the log file is rotated
+
+        :type order_output: Dict
+        :param order_output: the arguments of the OrderWriter that prints the orders,
+        which writes each order at once to sys.stdout by default
+
+        :type collect_stats: Bool
+        :param collect_stats: if True, the locks are timed and the calls, the producers'
+        queue occupancy and the consumers' retries are counted, to be read by stats()
+
+        :type profile: Bool
+        :param profile: if True, the latencies of the methods are recorded per thread,
+        to be read by latencies()
+
+        :type fair: Bool
+        :param fair: if True, the units of a product are handed to the carts waiting
+        for it in arrival order, instead of to whichever consumer tries first
         """
-        self.marketplace = Marketplace(15)
-        self.assertEqual(
-            self.marketplace.queue_size_per_producer, 15, "wrong queue size"
+
+        # The records are written by a background thread. No record is
+        # logged while a lock is held, so the formatting doesn't extend
+        # the critical sections
+        self.logger = setup_logger(**(log_config or {}))
+
+        # The runtime statistics, None if they're not collected, so that
+        # the methods only pay for a comparison
+        self.statistics = MarketplaceStats() if collect_stats else None
+
+        # The methods' latencies, recorded by wrappers installed on this instance
+        # only, so that an unprofiled Marketplace runs its methods untouched
+        self.profiler = None
+        if profile:
+            self.profiler = MethodProfiler()
+            self.profiler.instrument(self, PROFILED_METHODS)
+
+        # The index of all the available products: each product is mapped
+        # to a dictionary holding the number of units per producer.
+        # A product's entry is only modified under its inventory stripe's lock
+        self.inventory = {}
+
+        # A dictionary of counted carts: each cart maps its products to
+        # dictionaries holding the number of units per producer, like the inventory
+        self.carts = {}
+
+        # The producers' queue sizes and the conditions they wait on
+        self.producers = ProducerQueues(queue_size_per_producer)
+
+        # The consumers and carts waiting for products
+        self.waiters = Waiters(fair)
+
+        # A dictionary containing all the mandatory locks, the global one first,
+        # since all the fine-grained locks are that one when the locking is not striped
+        self.lock_dict = {"global_lock": None if striped else self._timed_lock("global_lock")}
+        self.lock_dict.update({
+
+            # Used in order to synchronize the output stream used by multiple threads
+            "safe_print": self._timed_lock("safe_print"),
+
+            # Used to register a producer atomically
+            "producer_register_lock": self._timed_lock("producer_register_lock"),
+
+            # Used to modify the inventory, a product using the stripe
+            # given by its hash
+            "inventory_stripes": [self._new_lock("inventory_stripes")
+                                  for _ in range(lock_stripes)],
+
+            # Used to modify a producer's queue size, one lock per producer
+            "producer_locks": {},
+
+            # Used to modify a cart, one lock per cart
+            "cart_locks": {},
+
+            # Used to count the open carts, the producers waiting for demand
+            # on its condition
+            "demand_lock": self._new_lock("demand_lock"),
+        })
+
+        # The carts, their consumers and whether the Marketplace still accepts products
+        self.demand = Demand(Condition(self.lock_dict["demand_lock"]))
+
+        # Writes the placed orders, one block of lines per order
+        self.order_writer = OrderWriter(
+            lock=self.lock_dict["safe_print"], **(order_output or {})
         )
 
-    def test_register_producer(self):
+    def _timed_lock(self, name):
         """
-        Used for testing the register_producer() method
+        Returns a new lock, timed under the given name if the statistics are collected
         """
-        self.assertEqual(self.marketplace.register_producer(), 0, "wrong producer id")
+        return Lock() if self.statistics is None else self.statistics.new_lock(name)
 
-    def test_publish(self):
+    def _new_lock(self, name):
         """
-        Used for testing the publish() method
+        Returns a new fine-grained lock, or the global one if the locking is not striped
         """
-        producer = self.marketplace.register_producer()
-        self.assertTrue(
-            self.marketplace.publish(producer, Product("Indonezia", 1)),
-            "wrong return value for publish()",
-        )
-        i = 0
-        while i < self.marketplace.queue_size_per_producer - 1:
-            self.marketplace.publish(producer, Product("Linden", 9))
-            i += 1
-        self.assertFalse(
-            self.marketplace.publish(producer, Product("Indonezia", 1)),
-            "wrong limit size",
-        )
-        self.assertTrue(
-            self.marketplace.publish(
-                self.marketplace.register_producer(), Product("Indonezia", 1)
-            ),
-            "wrong return value for publish()",
-        )
+        return self.lock_dict["global_lock"] or self._timed_lock(name)
 
-    def test_new_cart(self):
+    def _stripe(self, product):
         """
-        Used for testing the new_cart() method
+        Returns the lock of the inventory stripe holding the product
         """
-        self.assertEqual(self.marketplace.new_cart(), 0, "wrong cart id value")
+        stripes = self.lock_dict["inventory_stripes"]
+        return stripes[hash(product) % len(stripes)]
 
-    def test_add_to_cart(self):
+    @property
+    def queue_size_per_producer(self):
         """
-        Used for testing the add_cart() method
+        The maximum size of a queue associated with each producer
         """
-        self.marketplace.publish(
-            self.marketplace.register_producer(), Product("Indonezia", 1)
-        )
-        self.assertFalse(
-            self.marketplace.add_to_cart(
-                self.marketplace.new_cart(), Product("Linden", 9)
-            ),
-            "wrong return value for add_to_cart()",
-        )
-        self.assertTrue(
-            self.marketplace.add_to_cart(
-                self.marketplace.new_cart(), Product("Indonezia", 1)
-            ),
-            "wrong return value for add_to_cart()",
-        )
+        return self.producers.capacity
 
-    def test_remove_from_cart(self):
+    @property
+    def producers_queue_size(self):
         """
-        Used for testing the remove_from_cart() method
+        Read-only view of the dictionary mapping each producer to its number of items
+        in the queue. The entries are modified under the producers' locks.
         """
-        producer = self.marketplace.register_producer()
-        cart = self.marketplace.new_cart()
-        self.marketplace.publish(producer, Product("Indonezia", 1))
-        self.marketplace.publish(producer, Product("Linden", 9))
-        self.marketplace.add_to_cart(cart, Product("Linden", 9))
-        self.assertNotEqual(
-            self.marketplace.marketplace_products[0],
-            Product("Linden", 9),
-            "remove failed",
-        )
-        self.marketplace.remove_from_cart(cart, Product("Linden", 9))
-        self.assertEqual(
-            self.marketplace.marketplace_products[0],
-            Product("Indonezia", 1),
-            "add failed",
-        )
-        return cart
+        return self.producers.sizes
 
-    def test_place_order(self):
+    @property
+    def num_carts(self):
         """
-        Used for testing the place_order() method
+        Number of carts in Marketplace
         """
-        cart = self.test_remove_from_cart()
-        self.marketplace.place_order(cart)
-        self.assertEqual(
-            self.marketplace.consumer_carts[cart], [], "place_order failed"
-        )
+        return len(self.carts)
 
-
-class Marketplace:
-    """
-    Class that represents the Marketplace. It's the central part of the implementation.
-    The producers and consumers use its methods concurrently.
-    """
-
-    def __init__(self, queue_size_per_producer):
+    @property
+    def marketplace_products(self):
         """
-        Constructor
-
-        :type queue_size_per_producer: Int
-        :param queue_size_per_producer: the maximum size of a queue associated with each producer
+        Read-only view of all the available products, one entry per unit.
+        It is built from the inventory index and should not be used on hot paths.
         """
+        return self._expand(self.inventory)
 
-        file_handler = RotatingFileHandler(
-            "marketplace.log",
-            mode="a",
-            maxBytes=750,
-            backupCount=10,
-            encoding="utf-8",
-            delay=False,
-        )
-        file_handler.setLevel(logging.INFO)
-        formatter = logging.Formatter("%(asctime)s %(levelname)8s: %(message)s")
-        file_handler.setFormatter(formatter)
-        logging.Formatter.converter = time.gmtime
-        self.logger = logging.getLogger("logger")
-        self.logger.addHandler(file_handler)
-        self.logger.setLevel(logging.INFO)
-
-        # Number of carts in Marketplace
-        self.num_carts = 0
-        self.queue_size_per_producer = queue_size_per_producer
-
-        # The queue containing all the available products
-        self.marketplace_products = []
+    @property
+    def consumer_carts(self):
+        """
+        Read-only view of the carts, each of them expanded to a list
+        with one entry per unit. It should not be used on hot paths.
+        """
+        return {cart_id: self._expand(cart) for cart_id, cart in list(self.carts.items())}
 
-        # A dictionary of lists each representing a consumer's cart
-        self.consumer_carts = {}
+    @staticmethod
+    def _expand(units_by_product):
+        """
+        Expands an inventory or a cart to a list with one entry per unit
+        """
+        return [
+            product
+            for product, units in list(units_by_product.items())
+            for _ in range(sum(units.values()))
+        ]
+
+    @staticmethod
+    def _take(units_by_product, product, quantity, newest_first=False):
+        """
+        Takes at most 'quantity' units of the product out of an inventory or a cart.
+        The units of the oldest producers are taken first, unless 'newest_first' is True.
 
-        # A dictionary mapping products' names and prices to their producers
-        self.producers_products = {}
+        :returns a list of (producer's id, number of units) pairs, empty if
+        the product is not available
+        """
+        units = units_by_product.get(product)
+        taken = []
+        while units and quantity > 0:
+            producer = next(reversed(units)) if newest_first else next(iter(units))
+            num_units = min(units[producer], quantity)
+            units[producer] -= num_units
+            quantity -= num_units
+            taken.append((producer, num_units))
+            if units[producer] == 0:
+                del units[producer]
+        if units is not None and not units:
+            del units_by_product[product]
+        return taken
+
+    @staticmethod
+    def _put(units_by_product, product, producer_id, quantity):
+        """
+        Puts 'quantity' units of the product into an inventory or a cart
+        """
+        units = units_by_product.setdefault(product, {})
+        units[producer_id] = units.get(producer_id, 0) + quantity
 
-        # A producer's number of items in the queue
-        self.producers_queue_size = {}
+    def _put_units(self, producer_id, product, quantity=1):
+        """
+        Puts 'quantity' units of the product back into the inventory,
+        waking as many consumers waiting for it. The units are first handed
+        to the carts and backorders waiting for the product.
+        The caller must hold the product's stripe lock and pass the returned
+        deliveries to _deliver() once it's released.
 
-        # A dictionary containing all the mandatory locks
-        self.lock_dict = {
+        :returns the list of the backorders' deliveries
+        """
+        deliveries = []
+        quantity = self._hand_over(producer_id, product, quantity, deliveries)
+        if quantity > 0:
+            self._put(self.inventory, product, producer_id, quantity)
+            condition = self.waiters.conditions.get(product)
+            if condition is not None:
+                condition.notify(quantity)
+        return deliveries
+
+    def _hand_over(self, producer_id, product, quantity, deliveries):
+        """
+        Hands the units of the product to the carts waiting for it, in arrival order.
+        The caller must hold the product's stripe lock.
 
-            # Used in order to synchronize the output stream used by multiple threads
-            "safe_print": Lock(),
+        :returns the number of units no cart waits for
+        """
+        queue = self.waiters.queues.get(product)
+        while queue and quantity > 0:
+            waiter = queue[0]
+            num_units = min(waiter.wanted, quantity)
+            waiter.wanted -= num_units
+            quantity -= num_units
+            if waiter.wanted == 0:
+                queue.popleft()
+            waiter.grant(producer_id, num_units, deliveries)
+        if queue is not None and not queue:
+            del self.waiters.queues[product]
+        return quantity
+
+    def _deliver(self, deliveries):
+        """
+        Puts the units handed to backorders into their carts, completing the
+        backorders that got all of their units. The units of a cancelled
+        backorder go back to the inventory.
+        The caller must hold no lock.
+        """
+        deliveries = deque(deliveries)
+        while deliveries:
+            backorder, producer, num_units = deliveries.popleft()
+            with self.lock_dict["cart_locks"][backorder.cart_id]:
+                # An ordered cart's backorders are cancelled under the cart's lock,
+                # before the cart is emptied, so the future can't be cancelled
+                # between the check and its completion
+                cancelled = backorder.future.cancelled()
+                if not cancelled:
+                    self._put(self.carts[backorder.cart_id], backorder.product,
+                              producer, num_units)
+                    backorder.delivered += num_units
+                    if backorder.delivered == backorder.quantity:
+                        backorder.future.set_result(backorder.quantity)
+            if cancelled:
+                with self._stripe(backorder.product):
+                    deliveries.extend(self._put_units(producer, backorder.product, num_units))
+            else:
+                self._change_queue_size(producer, -num_units)
+
+    def _take_in_turn(self, cart_id, product, quantity, block, timeout, deliveries):
+        """
+        Takes at most 'quantity' units of the product for the cart, in fair mode:
+        the units handed to the cart, then the inventory's, which only holds the
+        product while no cart waits for it. If they're not enough, the cart waits
+        in the product's queue for the missing units, until its next attempt.
+        The caller must hold the product's stripe lock, the units it returns
+        adding to the backorders' deliveries.
+
+        :returns a list of (producer's id, number of units) pairs
+        """
+        waiters = self.waiters.carts.setdefault(cart_id, {})
+        waiter = waiters.get(product)
+        if waiter is None:
+            taken = self._take(self.inventory, product, quantity)
+            missing = quantity - sum(num_units for _, num_units in taken)
+            if missing == 0:
+                return taken
+            waiter = waiters[product] = CartWaiter(missing, [], None)
+            self.waiters.queues.setdefault(product, deque()).append(waiter)
+        else:
+            taken = []
+
+        if block and not waiter.granted:
+            # The waiting releases the stripe's lock and the consumer is woken
+            # as soon as units are handed to its cart
+            if waiter.condition is None:
+                waiter.condition = Condition(self._stripe(product))
+            waiter.condition.wait_for(lambda: waiter.granted, timeout)
+        taken += waiter.granted
+        waiter.granted = []
+
+        missing = quantity - sum(num_units for _, num_units in taken)
+        if missing > 0:
+            if waiter.wanted == 0:
+                self.waiters.queues.setdefault(product, deque()).append(waiter)
+            waiter.wanted = missing
+            return taken
+
+        # The cart got all of its units and leaves the queue, returning the
+        # units it got beyond the requested ones
+        del waiters[product]
+        self._cancel(product, waiter, deliveries)
+        while missing < 0:
+            producer, num_units = taken.pop()
+            returned = min(num_units, -missing)
+            if returned < num_units:
+                taken.append((producer, num_units - returned))
+            deliveries.extend(self._put_units(producer, product, returned))
+            missing += returned
+        return taken
+
+    def _cancel(self, product, waiter, deliveries):
+        """
+        Removes a cart's waiter from the product's queue, handing the units
+        it was granted to the next carts.
+        The caller must hold the product's stripe lock, the units adding to
+        the backorders' deliveries.
+        """
+        if waiter.wanted > 0:
+            queue = self.waiters.queues[product]
+            queue.remove(waiter)
+            if not queue:
+                del self.waiters.queues[product]
+            waiter.wanted = 0
+        granted, waiter.granted = waiter.granted, []
+        for producer, num_units in granted:
+            deliveries.extend(self._put_units(producer, product, num_units))
+
+    def _change_queue_size(self, producer_id, delta):
+        """
+        Adds 'delta' to the producer's queue size under the producer's lock.
+        A decrease wakes the producer if it's waiting for room in its queue.
+        """
+        with self.lock_dict["producer_locks"][producer_id]:
+            self.producers.sizes[producer_id] += delta
+            if self.statistics is not None:
+                self.statistics.queue_changed(producer_id, self.producers.sizes[producer_id])
+            if delta < 0:
+                self.producers.conditions[producer_id].notify()
+
+    def _publish(self, producer_id, product, quantity, block, timeout):
+        """
+        Publishes at most 'quantity' units of the product, as many as the
+        producer's queue has room for.
 
-            # Used to register a producer atomically
-            "producer_register_lock": Lock(),
+        :returns the number of published units, 0 once the Marketplace is shut down
+        """
+        demand = self.demand
+        if block and demand.open_carts == 0 and demand.running:
+            # A waiting producer pauses while no consumer has an open cart, instead
+            # of filling its queue with products nobody is buying. The demand is
+            # checked without the lock first, so the lock is only taken when there
+            # seems to be none, and the check is repeated under it
+            with demand.condition:
+                if not demand.condition.wait_for(
+                        lambda: demand.open_carts > 0 or not demand.running, timeout):
+                    return 0
+
+        # Only the producer's own lock is needed to reserve room in its queue,
+        # so producers don't contend with each other
+        producers = self.producers
+        with self.lock_dict["producer_locks"][producer_id]:
+            if block:
+                # The waiting releases the producer's lock and the producer is woken
+                # by add_to_cart() as soon as one of its units is bought
+                producers.conditions[producer_id].wait_for(
+                    lambda: producers.sizes[producer_id]
+                    < producers.capacity or not self.demand.running,
+                    timeout,
+                )
+            if not self.demand.running:
+                return 0
+            quantity = max(0, min(
+                quantity,
+                producers.capacity - producers.sizes[producer_id]
+            ))
+            producers.sizes[producer_id] += quantity
+            if quantity > 0 and self.statistics is not None:
+                self.statistics.queue_changed(producer_id, producers.sizes[producer_id])
+        if quantity > 0:
+            with self._stripe(product):
+                deliveries = self._put_units(producer_id, product, quantity)
+            self._deliver(deliveries)
+        return quantity
+
+    def _add(self, cart_id, product, quantity, block, timeout):
+        """
+        Moves at most 'quantity' units of the product from the inventory to the cart.
 
-            # Used to add a product in Marketplace's queue atomically
-            "publish_lock": Lock(),
+        :returns the number of added units
+        """
+        # A lock is mandatory so that multiple consumers don't try to
+        # remove the same product from the inventory
+        # For example, it can be a situation when all the consumers pass
+        # the 'if' statement when there is only 1 product left in buffer.
+        # Only the product's stripe is locked, so consumers of other products proceed
+        stripe = self._stripe(product)
+        deliveries = []
+        with stripe:
+            if self.waiters.fair:
+                taken = self._take_in_turn(cart_id, product, quantity, block, timeout,
+                                           deliveries)
+            else:
+                taken = self._take(self.inventory, product, quantity)
+                if not taken and block:
+                    # The waiting releases the stripe's lock, so producers and
+                    # other consumers are not stalled by the parked caller
+                    condition = self.waiters.conditions.setdefault(
+                        product, Condition(stripe)
+                    )
+                    if condition.wait_for(lambda: product in self.inventory, timeout):
+                        taken = self._take(self.inventory, product, quantity)
+        self._deliver(deliveries)
+
+        for producer, num_units in taken:
+            self._change_queue_size(producer, -num_units)
+        with self.lock_dict["cart_locks"][cart_id]:
+            for producer, num_units in taken:
+                self._put(self.carts[cart_id], product, producer, num_units)
+        added = sum(num_units for _, num_units in taken)
+        if added < quantity and self.statistics is not None:
+            self.statistics.count_retry(self.demand.owners[cart_id])
+        return added
+
+    def _remove(self, cart_id, product, quantity):
+        """
+        Moves at most 'quantity' units of the product from the cart back to the inventory.
 
-            # Used to modify the number of carts
-            "add_cart_lock": Lock(),
+        :returns the number of removed units
+        """
+        with self.lock_dict["cart_locks"][cart_id]:
+            # The units of the most recently added producers are removed first
+            returned = self._take(self.carts[cart_id], product, quantity, newest_first=True)
 
-            # Used to modify a producer's queue size
-            "inc_size_lock": Lock(),
-        }
+        # Multiple consumers may try to remove a product
+        # which was created by the same producer, thus the increasing
+        # of the producer's queue must be atomic.
+        for producer, num_units in returned:
+            self._change_queue_size(producer, num_units)
+            with self._stripe(product):
+                deliveries = self._put_units(producer, product, num_units)
+            self._deliver(deliveries)
+        return sum(num_units for _, num_units in returned)
 
     def register_producer(self):
         """
         Returns an id for a producer which calls this procedure
         Each id is the producer's index in the dictionary of queue sizes
         """
-        self.logger.info(
-            "---Entering in register_producer() method--- \
-                          %s",
-            currentThread().getName(),
-        )
+        self.logger.info("---Entering in register_producer() method---")
         self.logger.info(
             "Number of carts which are stored in Marketplace: %s", self.num_carts
         )
-        self.logger.info("Size of a producer's queue: %s", self.producers_queue_size)
+        self.logger.debug("Size of a producer's queue: %s", self.producers.sizes)
 
         # A lock is needed because the length of the queue sizes
         # may be changed by another registration, before this one proceeds
         with self.lock_dict["producer_register_lock"]:
-            current_id = len(self.producers_queue_size)
-            self.producers_queue_size[current_id] = 0
-        self.producers_products[None] = current_id
+            current_id = len(self.producers.sizes)
+            producer_lock = self._new_lock("producer_locks")
+            self.lock_dict["producer_locks"][current_id] = producer_lock
+            self.producers.conditions[current_id] = Condition(producer_lock)
+            self.producers.sizes[current_id] = 0
+            if self.statistics is not None:
+                self.statistics.add_queue(current_id, self.producers.capacity)
         self.logger.info(
             "The return value of register_producer() method: \
                          %s",
             current_id,
         )
-        self.logger.info(
-            "---Leaving the register_producer() method--- \
-                         %s",
-            currentThread().getName(),
-        )
+        self.logger.info("---Leaving the register_producer() method---")
+        if self.statistics is not None:
+            self.statistics.count_call("register_producer", True)
         return current_id
 
-    def publish(self, producer_id, product):
+    def publish(self, producer_id, product, block=False, timeout=None):
         """
         Adds the product created by the producer to the Marketplace.
         Increments the producer's number of products in the queue using
@@ -227,76 +536,66 @@ class Marketplace:
         :type product: Product
         :param product: the Product that will be published in the Marketplace
 
+        :type block: Bool
+        :param block: if True and the producer's queue is full, the caller waits
+        until one of its products is bought
+
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait when blocking,
+        None meaning no limit
+
         :returns True or False. If the caller receives False, it should wait and then try again.
         """
-        self.logger.info(
-            "---Entering in publish() method--- \
-                         %s",
-            currentThread().getName(),
-        )
+        self.logger.info("---Entering in publish() method---")
         self.logger.info("A producer's ID: %s", producer_id)
         self.logger.info("A producer's product: %s", product)
 
-        # A lock is needed because the list 'marketplace_products' is shared
-        # between multiple producer threads
-        with self.lock_dict["publish_lock"]:
-            return_val = False
-            if self.producers_queue_size[int(producer_id)] >= self.queue_size_per_producer:
-                self.logger.info("The return value of publish() method: %s", return_val)
-                self.logger.info(
-                    "---Leaving the publish() method--- \
-                                 %s",
-                    currentThread().getName(),
-                )
-                return return_val
-            self.marketplace_products = [*self.marketplace_products, product]
-            self.producers_queue_size[int(producer_id)] += 1
-            self.logger.info(
-                "Producer's queue current size: %s \
-                            with ID %s ",
-                self.producers_queue_size[int(producer_id)],
-                producer_id,
-            )
-            self.producers_products[(product.name, product.price)] = int(producer_id)
-            return_val = True
-        self.logger.info("The return value of publish() method: %s", return_val)
+        return_val = self._publish(int(producer_id), product, 1, block, timeout) == 1
         self.logger.info(
-            "---Leaving the publish() method--- \
-                         %s",
-            currentThread().getName(),
+            "Producer's queue current size: %s \
+                        with ID %s ",
+            self.producers.sizes[int(producer_id)],
+            producer_id,
         )
+        self.logger.info("The return value of publish() method: %s", return_val)
+        if self.statistics is not None:
+            self.statistics.count_call("publish", return_val)
+        self.logger.info("---Leaving the publish() method---")
         return return_val
 
-    def new_cart(self):
+    def new_cart(self, owner=None):
         """
         Creates a new cart for the consumer.
         Each new cart receives a new ID so that a new entry in
         the dictionary is made
 
+        :type owner: String
+        :param owner: the name of the consumer that buys the cart's products,
+        the calling thread's name by default
+
         :returns an int representing the cart_id
         """
-        self.logger.info(
-            "---Entering in new_cart() method--- \
-                         %s",
-            currentThread().getName(),
-        )
-
-        # The number of carts should be increased atomically
-        # 'cart_id' is being used for decreasing the sequential code's size
-        with self.lock_dict["add_cart_lock"]:
-            curr_id = self.num_carts
-            self.num_carts += 1
-            self.consumer_carts[curr_id] = []
-            self.logger.info("Current ID of a cart: %s", curr_id)
-            self.logger.info("Carts from Marketplace: %s", self.consumer_carts)
-        self.logger.info(
-            "---Leaving the new_cart() method--- \
-                         %s",
-            currentThread().getName(),
-        )
+        self.logger.info("---Entering in new_cart() method---")
+
+        # The IDs are unique, so each cart's entries are only
+        # created by the consumer owning the cart and need no lock
+        curr_id = next(self.demand.cart_ids)
+        self.lock_dict["cart_locks"][curr_id] = self._new_lock("cart_locks")
+        self.demand.owners[curr_id] = owner or current_thread().name
+        self.carts[curr_id] = {}
+        with self.demand.condition:
+            self.demand.open_carts += 1
+            if self.demand.open_carts == 1:
+                self.demand.condition.notify_all()
+        self.logger.info("Current ID of a cart: %s", curr_id)
+        self.logger.debug("Carts from Marketplace: %s", self.carts)
+        self.logger.info("---Leaving the new_cart() method---")
+        if self.statistics is not None:
+            self.statistics.cart_opened(curr_id)
+            self.statistics.count_call("new_cart", True)
         return curr_id
 
-    def add_to_cart(self, cart_id, product):
+    def add_to_cart(self, cart_id, product, block=False, timeout=None):
         """
         Adds a product to the given cart.
         Decreases the producer's number of products in the queue
@@ -309,46 +608,25 @@ class Marketplace:
         :type product: Product
         :param product: the product to add to cart
 
+        :type block: Bool
+        :param block: if True and the product is not available, the caller waits
+        until a unit is published or returned to the Marketplace
+
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait when blocking,
+        None meaning no limit
+
         :returns True or False. If the caller receives False, it should wait and then try again
         """
-        self.logger.info(
-            "---Entering in add_to_cart() method--- \
-                         %s",
-            currentThread().getName(),
-        )
+        self.logger.info("---Entering in add_to_cart() method---")
         self.logger.info("A consumer's cart ID: %s", cart_id)
         self.logger.info("A product added by the consumer: %s", product)
 
-        # A lock is mandatory so that multiple consumers don't try to
-        # remove the same product from the list
-        # For example, it can be a situation when all the consumers pass
-        # the 'if' statement when there is only 1 product left in buffer
-        with self.lock_dict["add_cart_lock"]:
-            return_val = False
-            if product not in self.marketplace_products or (
-                    (product.name, product.price) not in self.producers_products
-            ):
-                self.logger.info(
-                    "---Leaving the add_to_cart() method--- \
-                                 %s",
-                    currentThread().getName(),
-                )
-                self.logger.info(
-                    "The return value of add_to_cart() method: %s", return_val
-                )
-                return return_val
-            producer = self.producers_products[(product.name, product.price)]
-            self.logger.info("The product's producer: %s", producer)
-            self.producers_queue_size[producer] -= 1
-            self.marketplace_products.remove(product)
-            self.consumer_carts[cart_id] = [*self.consumer_carts[cart_id], product]
-            self.logger.info(
-                "---Leaving the add_to_cart() method--- \
-                             %s",
-                currentThread().getName(),
-            )
-            self.logger.info("The return value of add_to_cart() method: %s", return_val)
-            return_val = True
+        return_val = self._add(cart_id, product, 1, block, timeout) == 1
+        self.logger.info("The return value of add_to_cart() method: %s", return_val)
+        if self.statistics is not None:
+            self.statistics.count_call("add_to_cart", return_val)
+        self.logger.info("---Leaving the add_to_cart() method---")
         return return_val
 
     def remove_from_cart(self, cart_id, product):
@@ -362,62 +640,298 @@ class Marketplace:
         :type product: Product
         :param product: the product to remove from cart
         """
-        self.logger.info(
-            "---Entering in remove_from_cart() method--- \
-                         %s",
-            currentThread().getName(),
-        )
+        self.logger.info("---Entering in remove_from_cart() method---")
         self.logger.info("A consumer's cart ID: %s", cart_id)
         self.logger.info("A product removed by the consumer: %s", product)
-        old_prod = self.consumer_carts[cart_id].pop(
-            self.consumer_carts[cart_id].index(product)
+        removed = self._remove(cart_id, product, 1) == 1
+        if self.statistics is not None:
+            self.statistics.count_call("remove_from_cart", removed)
+        if not removed:
+            raise ValueError(f"{product} is not in cart {cart_id}")
+        self.logger.debug(
+            "Producer's queue size after \
+                         removing from cart: %s",
+            self.producers.sizes,
         )
+        self.logger.info("---Leaving from remove_from_cart() method---")
 
-        # Multiple consumers may try to remove a product
-        # which was created by the same producer, thus the increasing
-        # of the producer's queue must be atomic.
-        with self.lock_dict["inc_size_lock"]:
-            self.marketplace_products = [*self.marketplace_products, old_prod]
-            producer = self.producers_products[(old_prod.name, old_prod.price)]
-            self.producers_queue_size[producer] += 1
-            self.logger.info(
-                "Producer's queue size after \
-                             removing from cart: %s",
-                self.producers_queue_size,
-            )
-            self.logger.info(
-                "---Leaving from remove_from_cart() method--- \
-                             %s",
-                currentThread().getName(),
-            )
-
-    def place_order(self, cart_id):
+    def publish_many(self, producer_id, product, quantity, block=False, timeout=None):
+        """
+        Adds at most 'quantity' units of the product to the Marketplace
+        in a single critical section, as many as the producer's queue has room for.
+
+        :type producer_id: String
+        :param producer_id: producer id
+
+        :type product: Product
+        :param product: the Product that will be published in the Marketplace
+
+        :type quantity: Int
+        :param quantity: the number of units to publish
+
+        :type block: Bool
+        :param block: if True and the producer's queue is full, the caller waits
+        until one of its products is bought
+
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait when blocking,
+        None meaning no limit
+
+        :returns the number of published units. If it's less than 'quantity',
+        the caller should wait and then publish the rest.
+        """
+        self.logger.info("---Entering in publish_many() method---")
+        self.logger.info("A producer's ID: %s", producer_id)
+        self.logger.info("A producer's product: %s x %s", product, quantity)
+        return_val = self._publish(int(producer_id), product, quantity, block, timeout)
+        self.logger.info("The return value of publish_many() method: %s", return_val)
+        if self.statistics is not None:
+            self.statistics.count_call("publish_many", return_val > 0)
+        self.logger.info("---Leaving the publish_many() method---")
+        return return_val
+
+    def add_many(self, cart_id, product, quantity, block=False, timeout=None):
+        """
+        Adds at most 'quantity' units of the product to the given cart
+        in a single critical section, as many as are available.
+
+        :type cart_id: Int
+        :param cart_id: id cart
+
+        :type product: Product
+        :param product: the product to add to cart
+
+        :type quantity: Int
+        :param quantity: the number of units to add
+
+        :type block: Bool
+        :param block: if True and the product is not available, the caller waits
+        until a unit is published or returned to the Marketplace
+
+        :type timeout: Float
+        :param timeout: the maximum number of seconds to wait when blocking,
+        None meaning no limit
+
+        :returns the number of added units. If it's less than 'quantity',
+        the caller should wait and then add the rest.
+        """
+        self.logger.info("---Entering in add_many() method---")
+        self.logger.info("A consumer's cart ID: %s", cart_id)
+        self.logger.info("A product added by the consumer: %s x %s", product, quantity)
+        return_val = self._add(cart_id, product, quantity, block, timeout)
+        self.logger.info("The return value of add_many() method: %s", return_val)
+        if self.statistics is not None:
+            self.statistics.count_call("add_many", return_val > 0)
+        self.logger.info("---Leaving the add_many() method---")
+        return return_val
+
+    def backorder(self, cart_id, product, quantity):
+        """
+        Places a backorder of 'quantity' units of the product on the given cart.
+        The available units are added at once and the others wait in the product's
+        queue, the units published or returned to the Marketplace being put into
+        the cart, in the backorders' arrival order, by whoever publishes or returns them.
+
+        :type cart_id: Int
+        :param cart_id: id cart
+
+        :type product: Product
+        :param product: the product to add to cart
+
+        :type quantity: Int
+        :param quantity: the number of units to add
+
+        :returns a Future whose result is 'quantity' once all the units are in the cart.
+        It's cancelled if the cart is ordered before.
+        """
+        self.logger.info("---Entering in backorder() method---")
+        self.logger.info("A consumer's cart ID: %s", cart_id)
+        self.logger.info("A product backordered by the consumer: %s x %s", product, quantity)
+        with self._stripe(product):
+            # The inventory only holds the product while no cart waits for it
+            taken = self._take(self.inventory, product, quantity)
+            missing = quantity - sum(num_units for _, num_units in taken)
+            backorder = Backorder(wanted=missing, granted=[], condition=None, cart_id=cart_id,
+                                  product=product, quantity=quantity, delivered=0,
+                                  future=Future())
+            if missing > 0:
+                self.waiters.queues.setdefault(product, deque()).append(backorder)
+                self.waiters.backorders.setdefault(cart_id, []).append(backorder)
+
+        for producer, num_units in taken:
+            self._change_queue_size(producer, -num_units)
+        with self.lock_dict["cart_locks"][cart_id]:
+            for producer, num_units in taken:
+                self._put(self.carts[cart_id], product, producer, num_units)
+            # The missing units may have been delivered meanwhile, between the stripe's
+            # lock and the cart's, in which case the delivery completed the backorder
+            backorder.delivered += quantity - missing
+            if backorder.delivered == quantity and not backorder.future.done():
+                backorder.future.set_result(quantity)
+        self.logger.info("Units added at once by backorder(): %s", quantity - missing)
+        if self.statistics is not None:
+            self.statistics.count_call("backorder", True)
+        self.logger.info("---Leaving the backorder() method---")
+        return backorder.future
+
+    def remove_many(self, cart_id, product, quantity):
+        """
+        Removes at most 'quantity' units of the product from the cart
+        in a single critical section and returns them to the Marketplace.
+
+        :type cart_id: Int
+        :param cart_id: id cart
+
+        :type product: Product
+        :param product: the product to remove from cart
+
+        :type quantity: Int
+        :param quantity: the number of units to remove
+
+        :returns the number of removed units, less than 'quantity' only if
+        the cart doesn't hold enough units
+        """
+        self.logger.info("---Entering in remove_many() method---")
+        self.logger.info("A consumer's cart ID: %s", cart_id)
+        self.logger.info("A product removed by the consumer: %s x %s", product, quantity)
+        return_val = self._remove(cart_id, product, quantity)
+        self.logger.info("The return value of remove_many() method: %s", return_val)
+        if self.statistics is not None:
+            self.statistics.count_call("remove_many", return_val > 0)
+        self.logger.info("---Leaving the remove_many() method---")
+        return return_val
+
+    def place_order(self, cart_id, compact=False):
         """
         Return a list with all the products in the cart.
 
         :type cart_id: Int
         :param cart_id: id cart
+
+        :type compact: Bool
+        :param compact: if True, a dictionary mapping each product to its
+        number of units is returned instead of the list
         """
-        self.logger.info(
-            "---Entering in place_order() method--- \
-                         %s",
-            currentThread().getName(),
-        )
+        self.logger.info("---Entering in place_order() method---")
         self.logger.info("A consumer's cart ID: %s", cart_id)
-        self.logger.info("Cart before order: %s", self.consumer_carts[cart_id])
-        list_of_prod = self.consumer_carts[cart_id]
-        self.consumer_carts[cart_id] = []
-        self.logger.info("Cart after order: %s", self.consumer_carts[cart_id])
-        for product in list_of_prod:
-
-            # A lock is used in order not to interleave the printed strings.
-            with self.lock_dict["safe_print"]:
-                to_print = f"{currentThread().getName()} bought {product}"
-                print(to_print)
-        self.logger.info("The return value of place_order() method: %s", list_of_prod)
-        self.logger.info(
-            "---Leaving the place_order() method--- \
-                         %s",
-            currentThread().getName(),
-        )
-        return list_of_prod
+        self.logger.debug("Cart before order: %s", self.carts[cart_id])
+
+        # The cart leaves the queues it still waits in, its units going to the next
+        # carts. Its backorders are cancelled before the cart is emptied, so that
+        # the units on their way to it are returned instead
+        deliveries = []
+        for backorder in self.waiters.backorders.pop(cart_id, []):
+            with self.lock_dict["cart_locks"][cart_id]:
+                cancelled = backorder.future.cancel()
+            if cancelled:
+                with self._stripe(backorder.product):
+                    self._cancel(backorder.product, backorder, deliveries)
+        for product, waiter in self.waiters.carts.pop(cart_id, {}).items():
+            with self._stripe(product):
+                self._cancel(product, waiter, deliveries)
+        self._deliver(deliveries)
+
+        with self.lock_dict["cart_locks"][cart_id]:
+            cart = self.carts[cart_id]
+            self.carts[cart_id] = {}
+        with self.demand.condition:
+            self.demand.open_carts -= 1
+        self.logger.debug("Cart after order: %s", self.carts[cart_id])
+
+        # The whole order is formatted in a single block, which is handed
+        # to the order writer at once
+        owner = self.demand.owners[cart_id]
+        order = {product: sum(units.values()) for product, units in cart.items()}
+        self.order_writer.write("".join(
+            f"{owner} bought {product}\n" * quantity for product, quantity in order.items()
+        ))
+        result = order if compact else self._expand(cart)
+        self.logger.debug("The return value of place_order() method: %s", result)
+        self.logger.info("---Leaving the place_order() method---")
+        if self.statistics is not None:
+            self.statistics.cart_ordered(cart_id)
+            self.statistics.count_call("place_order", True)
+        return result
+
+    def available(self, cart_id, product):
+        """
+        Returns True if an add of the product to the cart would get a unit: the
+        inventory holds one or, in fair mode, units were handed to the cart
+        """
+        if product in self.inventory:
+            return True
+        waiter = self.waiters.carts.get(cart_id, {}).get(product)
+        return waiter is not None and bool(waiter.granted)
+
+    def is_running(self):
+        """
+        Returns False once the Marketplace is shut down
+        """
+        return self.demand.running
+
+    def shutdown(self):
+        """
+        Stops accepting products: every publish returns 0 from now on and the
+        producers waiting inside the Marketplace are woken, so that they can
+        return and be joined. The consumers can still add, remove and order.
+        """
+        self.logger.info("---Entering in shutdown() method---")
+        self.demand.running = False
+        with self.demand.condition:
+            self.demand.condition.notify_all()
+        for producer_id, condition in list(self.producers.conditions.items()):
+            with self.lock_dict["producer_locks"][producer_id]:
+                condition.notify_all()
+        self.logger.info("---Leaving the shutdown() method---")
+
+    def drain(self):
+        """
+        Removes all the units left in the inventory, emptying the producers' queues.
+        It should be called after shutdown() and after the producers are joined,
+        so that no producer refills the inventory.
+
+        :returns a dictionary mapping each product left unsold to its number of units
+        """
+        self.logger.info("---Entering in drain() method---")
+        drained = {}
+        for product in list(self.inventory):
+            with self._stripe(product):
+                taken = self._take(self.inventory, product, float("inf"))
+            for producer, num_units in taken:
+                self._change_queue_size(producer, -num_units)
+                drained[product] = drained.get(product, 0) + num_units
+        self.logger.info("Units drained from the Marketplace: %s", sum(drained.values()))
+        self.logger.info("---Leaving the drain() method---")
+        return drained
+
+    def stats(self):
+        """
+        Returns the runtime statistics gathered so far, as a dictionary that can be
+        dumped as JSON: the calls of each method, how long each lock of lock_dict was
+        waited for and held, the occupancy of each producer's queue over time, the
+        number of retries of each consumer and the percentiles of the carts' completion
+        times.
+
+        :returns the statistics, or None if they're not collected
+        """
+        if self.statistics is None:
+            return None
+        return self.statistics.snapshot()
+
+    def latencies(self):
+        """
+        Returns the latencies of the methods recorded so far, for each thread by its
+        name: the number of calls, the total and mean times, the p50, p90 and p99
+        latencies and a histogram in buckets of powers of 2 nanoseconds.
+
+        :returns the latencies, or None if the Marketplace is not profiled
+        """
+        if self.profiler is None:
+            return None
+        return self.profiler.snapshot()
+
+    def close(self):
+        """
+        Writes all the placed orders that are still buffered
+        """
+        self.order_writer.close()
@@ -0,0 +1,108 @@
+"""
+This module configures the Marketplace's logger.
+
+The records are put in a queue by the producer and consumer threads and are
+written to a rotating file by a background listener thread, so the callers
+never wait for the file's I/O or rotation.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import atexit
+import logging
+import os
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+
+LOGGER_NAME = "logger"
+
+# Level that disables the logging
+OFF = logging.CRITICAL + 1
+
+# The default logging configuration, each key can be overridden by setup_logger()
+DEFAULT_LOG_CONFIG = {
+    # The file the records are written to
+    "filename": "marketplace.log",
+
+    # The size in bytes at which the file is rotated
+    "max_bytes": 10 * 1024 * 1024,
+
+    # The number of rotated files that are kept
+    "backup_count": 5,
+
+    # The minimum level of the written records, a number or a name such as
+    # "DEBUG" or "OFF". The dumps of whole dictionaries are only logged at DEBUG
+    "level": logging.INFO,
+}
+
+# The pid of the process that configured the logger and its listener,
+# since a forked process doesn't inherit the listener's thread
+_LISTENER = {"pid": None, "listener": None, "atexit": False}
+
+
+def setup_logger(**config):
+    """
+    Configures the Marketplace's logger the first time it's called in a process,
+    or again when a configuration is given.
+
+    :type config: Dict
+    :param config: the keys of DEFAULT_LOG_CONFIG to override
+
+    :returns the Marketplace's logger
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    if _LISTENER["pid"] == os.getpid() and not config:
+        return logger
+
+    stop_logger()
+    config = {**DEFAULT_LOG_CONFIG, **config}
+    level = config["level"]
+    if isinstance(level, str):
+        level = OFF if level.upper() == "OFF" else logging.getLevelName(level.upper())
+    logger.setLevel(level)
+    logger.propagate = False
+    _LISTENER["pid"] = os.getpid()
+    if level >= OFF:
+        return logger
+
+    file_handler = RotatingFileHandler(
+        config["filename"],
+        mode="a",
+        maxBytes=config["max_bytes"],
+        backupCount=config["backup_count"],
+        encoding="utf-8",
+        delay=True,
+    )
+    formatter = logging.Formatter("%(asctime)s %(levelname)8s %(threadName)s: %(message)s")
+    formatter.converter = time.gmtime
+    file_handler.setFormatter(formatter)
+
+    records = SimpleQueue()
+    logger.addHandler(QueueHandler(records))
+    listener = QueueListener(records, file_handler)
+    listener.start()
+    _LISTENER["listener"] = listener
+    if not _LISTENER["atexit"]:
+        atexit.register(stop_logger)
+        _LISTENER["atexit"] = True
+    return logger
+
+
+def stop_logger():
+    """
+    Writes the queued records and stops the background listener.
+    The next setup_logger() call configures the logger again.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    listener = _LISTENER["listener"]
+    if listener is not None and _LISTENER["pid"] == os.getpid():
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    _LISTENER["listener"] = None
+    _LISTENER["pid"] = None
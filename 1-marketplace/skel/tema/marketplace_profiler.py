@@ -0,0 +1,404 @@
+"""
+This module profiles the Marketplace: the latencies of its methods, per thread,
+and the stacks of the running threads, sampled at a fixed interval.
+
+The latencies are recorded by wrappers installed on a single Marketplace instance,
+so an unprofiled Marketplace runs its methods untouched. Each thread records its
+latencies in its own histograms, which are merged when the profile is read.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from functools import wraps
+from json import dumps, load
+from threading import Event, Thread, current_thread, enumerate as enumerate_threads, local
+from time import perf_counter_ns, sleep
+
+# The Marketplace's methods whose latencies are recorded
+PROFILED_METHODS = ("register_producer", "publish", "publish_many", "new_cart",
+                    "add_to_cart", "add_many", "backorder", "remove_from_cart", "remove_many",
+                    "place_order")
+
+# The deepest stack frames kept by a sample
+MAX_STACK_DEPTH = 64
+
+# The number of stacks kept in the summary
+TOP_STACKS = 20
+
+
+class TestMarketplaceProfiler(unittest.TestCase):
+    """
+    Class that represents the test unit of the profiler.
+    """
+
+    def test_histogram(self):
+        """
+        Used for testing the histogram's percentiles, which are bucket upper bounds
+        """
+        histogram = LatencyHistogram()
+        for latency in [1000] * 98 + [1_000_000] * 2:
+            histogram.record(latency)
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.percentile(50), 1024e-9)
+        self.assertAlmostEqual(histogram.percentile(99), 1048576e-9)
+
+    def test_instrument(self):
+        """
+        Used for testing that only the instrumented instance records its calls
+        """
+        class Target:
+            """
+            A class whose method is profiled
+            """
+            def method(self, value):
+                """
+                Returns the value
+                """
+                return value
+
+        profiler = MethodProfiler()
+        target = Target()
+        profiler.instrument(target, ["method"])
+        self.assertEqual(target.method(3), 3)
+        self.assertNotIn("method", vars(Target()))
+        latencies = profiler.snapshot()[current_thread().name]
+        self.assertEqual(latencies["method"]["calls"], 1)
+
+    def test_report(self):
+        """
+        Used for testing that a session writes the summary and the threads' profiles
+        """
+        profiler = MethodProfiler()
+        with tempfile.TemporaryDirectory() as out_dir:
+            session = ProfileSession(out_dir, interval=0.001)
+            session.attach(profiler.snapshot)
+            session.start()
+            worker = Thread(target=sleep, args=(0.05,), name="sleeper")
+            worker.start()
+            worker.join()
+            session.stop()
+            with open(os.path.join(out_dir, "summary.json"), encoding="utf-8") as summary_file:
+                summary = load(summary_file)
+            self.assertIn("sleeper", [thread["thread"] for thread in summary["threads"]])
+            self.assertTrue(os.path.exists(os.path.join(out_dir, "threads", "sleeper.json")))
+            self.assertTrue(os.path.exists(os.path.join(out_dir, "stacks.folded")))
+
+
+class LatencyHistogram:
+    """
+    Class that represents a histogram of latencies, in buckets of powers of 2 nanoseconds
+    """
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, latency):
+        """
+        Records a latency
+
+        :type latency: Int
+        :param latency: the latency, in nanoseconds
+        """
+        self.buckets[latency.bit_length()] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def merge(self, other):
+        """
+        Adds the latencies of another histogram to this one
+        """
+        # dict() copies the other histogram's buckets at once, while its thread may update them
+        self.buckets.update(dict(other.buckets))
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound, in seconds, of the bucket holding the given percentile
+        """
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return (1 << bucket) * 1e-9
+        return 0.0
+
+    def to_dict(self):
+        """
+        Returns the histogram's summary, in seconds
+        """
+        return {"calls": self.count,
+                "total_s": self.total * 1e-9,
+                "mean_s": self.total * 1e-9 / self.count if self.count else 0.0,
+                "p50_s": self.percentile(50),
+                "p90_s": self.percentile(90),
+                "p99_s": self.percentile(99),
+                "max_s": self.max * 1e-9,
+                "buckets_ns": {1 << bucket: count
+                               for bucket, count in sorted(self.buckets.items())}}
+
+    @classmethod
+    def from_dict(cls, summary):
+        """
+        Rebuilds a histogram from its summary
+        """
+        histogram = cls()
+        histogram.buckets = Counter({int(upper_bound).bit_length() - 1: count
+                                     for upper_bound, count in summary["buckets_ns"].items()})
+        histogram.count = summary["calls"]
+        histogram.total = round(summary["total_s"] * 1e9)
+        histogram.max = round(summary["max_s"] * 1e9)
+        return histogram
+
+
+class MethodProfiler:
+    """
+    Class that records the latencies of an object's methods, per thread
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        # Each thread's histograms by method, registered under the thread's name
+        self.local = local()
+        self.threads = []
+
+    def _histograms(self):
+        """
+        Returns the calling thread's histograms
+        """
+        try:
+            return self.local.histograms
+        except AttributeError:
+            histograms = self.local.histograms = {}
+            self.threads.append((current_thread().name, histograms))
+            return histograms
+
+    def instrument(self, obj, methods):
+        """
+        Replaces the object's methods with wrappers recording their latencies.
+        The wrappers are set on the object itself, not on its class.
+
+        :type obj: Object
+        :param obj: the profiled object
+
+        :type methods: List
+        :param methods: the names of the profiled methods
+        """
+        for name in methods:
+            setattr(obj, name, self._timed(name, getattr(obj, name)))
+
+    def _timed(self, name, method):
+        """
+        Returns a wrapper of the method that records its latency
+        """
+        histograms = self._histograms
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                latency = perf_counter_ns() - start
+                thread_histograms = histograms()
+                histogram = thread_histograms.get(name)
+                if histogram is None:
+                    histogram = thread_histograms[name] = LatencyHistogram()
+                histogram.record(latency)
+
+        return timed
+
+    def snapshot(self):
+        """
+        Returns each thread's latencies by method. The threads sharing a name
+        are merged.
+        """
+        merged = {}
+        for thread, histograms in list(self.threads):
+            thread_histograms = merged.setdefault(thread, {})
+            for name, histogram in list(histograms.items()):
+                thread_histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+        return {thread: {name: histogram.to_dict() for name, histogram in histograms.items()}
+                for thread, histograms in merged.items()}
+
+
+def fold_stack(frame):
+    """
+    Returns a frame's stack in the folded format of the flame graphs:
+    the functions from the outermost to the innermost, separated by semicolons
+    """
+    functions = []
+    while frame is not None and len(functions) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        functions.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(functions))
+
+
+class ProfileSession(Thread):
+    """
+    Class that samples the stacks of the process' threads at a fixed interval and
+    writes the profile to a directory:
+        - summary.json: the latencies of the methods, merged over all the threads,
+          the threads ranked by the time they spent in the methods, with their
+          most sampled stack, and the most sampled stacks
+        - stacks.folded: the sampled stacks of all the threads, for a flame graph
+        - threads/{thread}.json: each thread's latencies and sampled stacks
+
+    The summary and the folded stacks are written again every 'flush_interval'
+    seconds, so they're kept even if the process is killed. The threads' files
+    are written when the session is stopped.
+    """
+
+    def __init__(self, out_dir, interval=0.01, flush_interval=1.0):
+        """
+        Constructor
+
+        :type out_dir: String
+        :param out_dir: the directory the profile is written to
+
+        :type interval: Float
+        :param interval: the number of seconds between two samples of the stacks
+
+        :type flush_interval: Float
+        :param flush_interval: the number of seconds between two writes of the summary
+        """
+        Thread.__init__(self, name="ProfileSession", daemon=True)
+        self.out_dir = out_dir
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.latencies = None
+        self.stacks = {}
+        self.stopped = Event()
+        os.makedirs(os.path.join(out_dir, "threads"), exist_ok=True)
+
+    def attach(self, latencies):
+        """
+        Sets the function returning the latencies of the profiled methods, per thread
+
+        :type latencies: Callable
+        :param latencies: e.g. a Marketplace's latencies() method
+        """
+        self.latencies = latencies
+
+    def sample(self):
+        """
+        Samples the stack of each thread, except the session's
+        """
+        names = {thread.ident: thread.name for thread in enumerate_threads()}
+        for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if ident != self.ident:
+                thread_stacks = self.stacks.setdefault(names.get(ident, str(ident)), Counter())
+                thread_stacks[fold_stack(frame)] += 1
+
+    def run(self):
+        """
+        Samples the stacks until the session is stopped, flushing the summary
+        """
+        next_flush = perf_counter_ns() + self.flush_interval * 1e9
+        while not self.stopped.wait(self.interval):
+            self.sample()
+            if perf_counter_ns() >= next_flush:
+                self.write(final=False)
+                next_flush = perf_counter_ns() + self.flush_interval * 1e9
+
+    def stop(self):
+        """
+        Stops sampling and writes the whole profile
+        """
+        self.stopped.set()
+        self.join()
+        self.write(final=True)
+
+    def _write_file(self, name, text):
+        """
+        Replaces a file of the profile at once, so a killed process leaves it whole
+        """
+        path = os.path.join(self.out_dir, name)
+        with open(path + ".tmp", "w", encoding="utf-8") as output_file:
+            output_file.write(text)
+        os.replace(path + ".tmp", path)
+
+    def write(self, final):
+        """
+        Writes the summary and the folded stacks, and the threads' files if final
+        """
+        latencies = self.latencies() if self.latencies is not None else {}
+        latencies = latencies or {}
+        stacks = {thread: Counter(thread_stacks)
+                  for thread, thread_stacks in list(self.stacks.items())}
+
+        self._write_file("summary.json", dumps(summarize(latencies, stacks), indent=4))
+        merged_stacks = Counter()
+        for thread_stacks in stacks.values():
+            merged_stacks.update(thread_stacks)
+        self._write_file("stacks.folded", "".join(f"{stack} {count}\n"
+                                                  for stack, count in merged_stacks.items()))
+        if final:
+            for thread in set(latencies) | set(stacks):
+                self._write_file(
+                    os.path.join("threads", thread.replace(os.sep, "_") + ".json"),
+                    dumps({"thread": thread,
+                           "methods": latencies.get(thread, {}),
+                           "stacks": dict(stacks.get(thread, Counter()).most_common())},
+                          indent=4))
+
+
+def summarize(latencies, stacks):
+    """
+    Returns the summary of a profile
+
+    :type latencies: Dict
+    :param latencies: each thread's latencies by method
+
+    :type stacks: Dict
+    :param stacks: each thread's sampled stacks, as Counters of folded stacks
+    """
+    methods = {}
+    for thread_latencies in latencies.values():
+        for name, summary in thread_latencies.items():
+            methods.setdefault(name, LatencyHistogram()).merge(LatencyHistogram.from_dict(summary))
+
+    threads = []
+    for thread in set(latencies) | set(stacks):
+        thread_latencies = latencies.get(thread, {})
+        thread_stacks = stacks.get(thread, Counter())
+        top_stack = thread_stacks.most_common(1)
+        threads.append({
+            "thread": thread,
+            "calls": sum(summary["calls"] for summary in thread_latencies.values()),
+            "marketplace_s": sum(summary["total_s"] for summary in thread_latencies.values()),
+            "samples": sum(thread_stacks.values()),
+            "top_stack": top_stack[0][0] if top_stack else None,
+        })
+    threads.sort(key=lambda thread: (-thread["marketplace_s"], -thread["samples"],
+                                     thread["thread"]))
+
+    merged_stacks = Counter()
+    for thread_stacks in stacks.values():
+        merged_stacks.update(thread_stacks)
+
+    return {"methods": {name: histogram.to_dict() for name, histogram in sorted(methods.items())},
+            "threads": threads,
+            "hot_stacks": [{"stack": stack, "samples": count}
+                           for stack, count in merged_stacks.most_common(TOP_STACKS)]}
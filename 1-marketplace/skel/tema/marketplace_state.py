@@ -0,0 +1,177 @@
+"""
+This module groups the state the Marketplace keeps about its producers,
+its carts and the consumers waiting for products.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import unittest
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from itertools import count
+from threading import Condition
+
+from .product import Product
+
+
+class TestCartWaiter(unittest.TestCase):
+    """
+    Class that represents the test unit of CartWaiter.
+    """
+
+    def test_identity(self):
+        """
+        Used for testing that a queue removes the given waiter, not an equal one
+        """
+        first, second = CartWaiter(2, [], None), CartWaiter(2, [], None)
+        queue = deque([first, second])
+        queue.remove(second)
+        self.assertIs(queue[0], first)
+        self.assertEqual(len(queue), 1)
+
+    def test_grant(self):
+        """
+        Used for testing that a cart keeps its units and a backorder delivers them
+        """
+        waiter = CartWaiter(2, [], None)
+        backorder = Backorder(2, [], None, 0, Product("Linden", 9), 2, 0, Future())
+        deliveries = []
+        waiter.grant(0, 1, deliveries)
+        backorder.grant(0, 1, deliveries)
+        self.assertEqual(waiter.granted, [(0, 1)])
+        self.assertEqual(deliveries, [(backorder, 0, 1)])
+
+
+@dataclass
+class ProducerQueues:
+    """
+    Class that represents the producers' queues, each of them guarded by the
+    producer's lock of the Marketplace's lock_dict.
+    """
+    # The maximum size of a producer's queue
+    capacity: int
+
+    # A producer's number of items in the queue
+    sizes: dict = field(default_factory=dict)
+
+    # A dictionary mapping producers to the conditions they wait on
+    # while their queue is full, each of them sharing the producer's lock
+    conditions: dict = field(default_factory=dict)
+
+
+@dataclass
+class Demand:
+    """
+    Class that represents the consumers' carts, as the demand the producers
+    waiting inside the Marketplace wait for.
+    """
+    # Used to count the open carts, the producers waiting for demand on it
+    condition: Condition
+
+    # Generator of cart IDs, next() being atomic it needs no lock
+    cart_ids: count = field(default_factory=count)
+
+    # A dictionary mapping each cart to the name of its consumer
+    owners: dict = field(default_factory=dict)
+
+    # The number of carts created and not ordered yet, the producers waiting
+    # inside the Marketplace only publishing while a consumer has an open cart
+    open_carts: int = 0
+
+    # False once the Marketplace is shut down and no longer accepts products
+    running: bool = True
+
+
+@dataclass
+class Waiters:
+    """
+    Class that represents the consumers and carts waiting for products.
+    """
+    # If True, the units of a product are handed to the carts waiting
+    # for it in arrival order
+    fair: bool
+
+    # A dictionary mapping products to the conditions their blocked
+    # consumers wait on, each of them sharing the product's stripe lock
+    conditions: dict = field(default_factory=dict)
+
+    # A dictionary mapping products to the FIFO queues of the carts and backorders
+    # waiting for them, modified under the product's stripe lock. The inventory
+    # only holds a product while no cart waits for it
+    queues: dict = field(default_factory=dict)
+
+    # In fair mode, a dictionary mapping each cart to its waiters by product
+    carts: dict = field(default_factory=dict)
+
+    # A dictionary mapping each cart to its backorders, only modified by its consumer
+    backorders: dict = field(default_factory=dict)
+
+
+@dataclass(eq=False)
+class CartWaiter:
+    """
+    Class that represents a cart waiting in a product's queue, in fair mode.
+    The waiters are compared by identity, since a queue removes them by equality.
+    """
+    __slots__ = ("wanted", "granted", "condition")
+
+    # The number of units still wanted, 0 once the cart left the product's queue
+    wanted: int
+
+    # The (producer's id, number of units) pairs handed to the cart and not added yet
+    granted: list
+
+    # The condition the cart's consumer waits on in blocking mode, sharing
+    # the product's stripe lock, None until it first waits
+    condition: Condition
+
+    def grant(self, producer_id, num_units, deliveries):  # pylint: disable=unused-argument
+        """
+        Hands units to the cart, which its consumer adds at its next attempt.
+        Must be called with the product's stripe lock held.
+
+        :type deliveries: List
+        :param deliveries: unused, the consumer adding the units itself
+        """
+        self.granted.append((producer_id, num_units))
+        if self.condition is not None:
+            self.condition.notify()
+
+
+@dataclass(eq=False)
+class Backorder(CartWaiter):
+    """
+    Class that represents a backorder of units of a product, placed on a cart.
+    The units are put into the cart as they arrive, and the backorder's future
+    is done once all of them are there.
+    """
+    __slots__ = ("cart_id", "product", "quantity", "delivered", "future")
+
+    # The cart the units are put into
+    cart_id: int
+
+    # The backordered product
+    product: Product
+
+    # The number of backordered units
+    quantity: int
+
+    # The number of units in the cart, only changed under the cart's lock
+    delivered: int
+
+    # Its result is the number of backordered units, once all of them are in the cart
+    future: Future
+
+    def grant(self, producer_id, num_units, deliveries):
+        """
+        Hands units to the backorder, which are put into its cart once the product's
+        stripe lock is released, by the caller.
+        Must be called with the product's stripe lock held.
+
+        :type deliveries: List
+        :param deliveries: the (backorder, producer's id, number of units) deliveries
+        """
+        deliveries.append((self, producer_id, num_units))
@@ -0,0 +1,378 @@
+"""
+This module collects the Marketplace's runtime statistics.
+
+The counters are cheap and need no lock of their own: each thread counts the
+method calls in its own Counter, each timed lock is only updated by the thread
+holding it and each producer's queue occupancy is updated under the producer's lock.
+The counters are only added up when the statistics are read.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import unittest
+from collections import Counter
+from threading import Condition, Lock, Thread, local
+from time import perf_counter
+
+
+class TestMarketplaceStats(unittest.TestCase):
+    """
+    Class that represents the test unit of MarketplaceStats.
+    """
+
+    def setUp(self):
+        """
+        Used for creating a MarketplaceStats object instantiation
+        """
+        self.stats = MarketplaceStats()
+
+    def test_calls(self):
+        """
+        Used for testing that the calls of all the threads are added up
+        """
+        def call():
+            self.stats.count_call("add_many", False)
+            self.stats.count_retry("cons1")
+
+        threads = [Thread(target=call) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stats.count_call("add_many", True)
+
+        snapshot = self.stats.snapshot()
+        self.assertEqual(snapshot["methods"]["add_many"],
+                         {"calls": 5, "succeeded": 1, "failed": 4})
+        self.assertEqual(snapshot["consumer_retries"], {"cons1": 4})
+
+    def test_cart_completion(self):
+        """
+        Used for testing the percentiles of the carts' completion times
+        """
+        self.stats.cart_opened(0)
+        self.stats.cart_ordered(0)
+        self.assertEqual(self.stats.carts_opened, {})
+        self.assertEqual(self.stats.snapshot()["cart_completion"]["carts"], 1)
+
+        summary = completion_summary([float(time) for time in range(1, 101)])
+        self.assertEqual((summary["p50_s"], summary["p99_s"], summary["max_s"]),
+                         (50.0, 99.0, 100.0))
+        self.assertEqual(completion_summary([]), {"carts": 0})
+
+    def test_timed_lock(self):
+        """
+        Used for testing that a timed lock counts its acquisitions and works
+        with a condition
+        """
+        lock = self.stats.new_lock("cart_locks")
+        condition = Condition(lock)
+        with condition:
+            self.assertFalse(condition.wait(0.01))
+        with lock:
+            self.assertFalse(lock.acquire(False))
+
+        locks = self.stats.snapshot()["locks"]["cart_locks"]
+        self.assertEqual((locks["locks"], locks["acquisitions"]), (1, 3))
+        self.assertGreater(locks["hold_s"], 0)
+
+    def test_queue_occupancy(self):
+        """
+        Used for testing that the time a queue spends at each size is recorded
+        """
+        self.stats.add_queue(0, 2)
+        self.stats.queue_changed(0, 3)
+        self.stats.queue_changed(0, 2)
+        occupancy = self.stats.snapshot()["producer_queues"][0]
+        self.assertEqual(occupancy["peak"], 3)
+        self.assertEqual(len(occupancy["seconds_by_size"]), 4)
+        self.assertGreater(occupancy["full_s"], 0)
+
+
+class TimedLock:
+    """
+    Class that represents a lock which measures how long it's waited for and held.
+    Only an acquisition that finds the lock taken is timed while waiting.
+    """
+
+    __slots__ = ("lock", "acquisitions", "contended", "wait_time", "max_wait_time",
+                 "hold_time", "acquired_at")
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.lock = Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.hold_time = 0.0
+        self.acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        """
+        Acquires the lock, like Lock.acquire()
+        """
+        # The lock is released by release(), so it can't be held by a with-block here
+        if not self.lock.acquire(False):  # pylint: disable=consider-using-with
+            if not blocking:
+                return False
+            start = perf_counter()
+            if not self.lock.acquire(True, timeout):  # pylint: disable=consider-using-with
+                return False
+            # The lock is held, so no other thread updates the counters
+            waited = perf_counter() - start
+            self.contended += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+        self.acquisitions += 1
+        self.acquired_at = perf_counter()
+        return True
+
+    def release(self):
+        """
+        Releases the lock, like Lock.release()
+        """
+        self.hold_time += perf_counter() - self.acquired_at
+        self.lock.release()
+
+    def locked(self):
+        """
+        Returns True if the lock is held
+        """
+        return self.lock.locked()
+
+    def _is_owned(self):
+        """
+        Used by the conditions, instead of acquiring the lock to check it's held
+        """
+        return self.lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class QueueOccupancy:
+    """
+    Class that records how long a producer's queue holds each number of units
+    """
+
+    __slots__ = ("queue_size", "size", "since", "seconds_by_size")
+
+    def __init__(self, queue_size):
+        """
+        Constructor
+
+        :type queue_size: Int
+        :param queue_size: the maximum size of the queue
+        """
+        self.queue_size = queue_size
+        self.size = 0
+        self.since = perf_counter()
+        self.seconds_by_size = [0.0] * (queue_size + 1)
+
+    def change(self, size, now):
+        """
+        Records the end of the time spent at the current size.
+        The units removed from the carts return to their producer's queue even
+        if it's full, so the queue may grow beyond its maximum size.
+        """
+        self.seconds_by_size[self.size] += now - self.since
+        if size >= len(self.seconds_by_size):
+            self.seconds_by_size.extend([0.0] * (size + 1 - len(self.seconds_by_size)))
+        self.size = size
+        self.since = now
+
+    def snapshot(self, now):
+        """
+        Returns the mean and peak sizes, the time spent full and the time spent
+        at each size, up to now
+        """
+        seconds_by_size = list(self.seconds_by_size)
+        seconds_by_size[self.size] += now - self.since
+        total = sum(seconds_by_size)
+        return {"mean": (sum(size * seconds for size, seconds in enumerate(seconds_by_size))
+                         / total if total else 0.0),
+                "peak": max((size for size, seconds in enumerate(seconds_by_size) if seconds),
+                            default=0),
+                "full_s": sum(seconds_by_size[self.queue_size:]),
+                "seconds_by_size": seconds_by_size}
+
+
+class MarketplaceStats:
+    """
+    Class that represents the statistics of a Marketplace: the calls of its
+    methods, its locks' waiting and holding times, its producers' queue occupancy,
+    its consumers' retries and the time its carts took from creation to order.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.started = perf_counter()
+
+        # The timed locks, by their name in the Marketplace's lock_dict
+        self.locks = {}
+
+        # Each thread's Counter, with (method, outcome) and ("retries", consumer) keys
+        self.local = local()
+        self.counters = []
+
+        # The occupancy of each producer's queue, by producer id
+        self.queues = {}
+
+        # The time each cart was created at, by cart id, and each thread's list of
+        # the times its consumers took to complete their carts
+        self.carts_opened = {}
+        self.completion_times = []
+
+    def new_lock(self, name):
+        """
+        Returns a new timed lock, whose times are reported under the given name
+
+        :type name: String
+        :param name: the lock's name in the Marketplace's lock_dict
+        """
+        lock = TimedLock()
+        self.locks.setdefault(name, []).append(lock)
+        return lock
+
+    def _counter(self):
+        """
+        Returns the calling thread's Counter
+        """
+        try:
+            return self.local.counter
+        except AttributeError:
+            counter = self.local.counter = Counter()
+            self.counters.append(counter)
+            return counter
+
+    def _completion_times(self):
+        """
+        Returns the calling thread's list of cart completion times
+        """
+        try:
+            return self.local.completion_times
+        except AttributeError:
+            completion_times = self.local.completion_times = []
+            self.completion_times.append(completion_times)
+            return completion_times
+
+    def cart_opened(self, cart_id):
+        """
+        Records the time a cart was created at
+        """
+        self.carts_opened[cart_id] = perf_counter()
+
+    def cart_ordered(self, cart_id):
+        """
+        Records the time a cart took from its creation to its order
+        """
+        self._completion_times().append(perf_counter() - self.carts_opened.pop(cart_id))
+
+    def count_call(self, method, succeeded):
+        """
+        Counts a call of a Marketplace's method
+
+        :type method: String
+        :param method: the method's name
+
+        :type succeeded: Bool
+        :param succeeded: False if the call moved no unit or raised an error
+        """
+        counter = self._counter()
+        counter[method, "calls"] += 1
+        counter[method, "succeeded" if succeeded else "failed"] += 1
+
+    def count_retry(self, consumer):
+        """
+        Counts an add that got fewer units than requested, so the consumer tries again
+
+        :type consumer: String
+        :param consumer: the consumer's name
+        """
+        self._counter()["retries", consumer] += 1
+
+    def add_queue(self, producer_id, queue_size):
+        """
+        Starts recording the occupancy of a new producer's queue
+        """
+        self.queues[producer_id] = QueueOccupancy(queue_size)
+
+    def queue_changed(self, producer_id, size):
+        """
+        Records the new size of a producer's queue.
+        Must be called with the producer's lock held.
+        """
+        self.queues[producer_id].change(size, perf_counter())
+
+    def snapshot(self):
+        """
+        Returns the statistics gathered so far, as a dictionary that can be dumped as JSON
+        """
+        now = perf_counter()
+        totals = Counter()
+        for counter in list(self.counters):
+            # dict() copies a thread's Counter at once, while the thread may update it
+            totals.update(dict(counter))
+
+        methods = {}
+        retries = {}
+        for (key, detail), value in sorted(totals.items()):
+            if key == "retries":
+                retries[detail] = value
+            else:
+                methods.setdefault(key, {"calls": 0, "succeeded": 0, "failed": 0})[detail] = value
+
+        locks = {}
+        for name, timed_locks in self.locks.items():
+            timed_locks = list(timed_locks)
+            locks[name] = {
+                "locks": len(timed_locks),
+                "acquisitions": sum(lock.acquisitions for lock in timed_locks),
+                "contended": sum(lock.contended for lock in timed_locks),
+                "wait_s": sum(lock.wait_time for lock in timed_locks),
+                "max_wait_s": max((lock.max_wait_time for lock in timed_locks), default=0.0),
+                "hold_s": sum(lock.hold_time for lock in timed_locks),
+            }
+
+        completion_times = sorted(time for times in list(self.completion_times)
+                                  for time in list(times))
+
+        return {"elapsed_s": now - self.started,
+                "methods": methods,
+                "locks": locks,
+                "producer_queues": {producer_id: occupancy.snapshot(now)
+                                    for producer_id, occupancy in list(self.queues.items())},
+                "consumer_retries": retries,
+                "cart_completion": completion_summary(completion_times)}
+
+
+def completion_summary(completion_times):
+    """
+    Returns the number of carts and the mean, percentiles and maximum of their
+    completion times, in seconds
+
+    :type completion_times: List
+    :param completion_times: the sorted completion times
+    """
+    def percentile(percent):
+        # The nearest rank, so that the percentile is one of the times
+        return completion_times[max(0, -(-len(completion_times) * percent // 100) - 1)]
+
+    if not completion_times:
+        return {"carts": 0}
+    return {"carts": len(completion_times),
+            "mean_s": sum(completion_times) / len(completion_times),
+            "p50_s": percentile(50),
+            "p90_s": percentile(90),
+            "p99_s": percentile(99),
+            "max_s": completion_times[-1]}
@@ -0,0 +1,146 @@
+"""
+This module writes the orders placed in the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import io
+import sys
+import unittest
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+
+
+class TestOrderWriter(unittest.TestCase):
+    """
+    Class that represents the test unit of OrderWriter.
+    """
+
+    def test_synchronous(self):
+        """
+        Used for testing that a synchronous writer writes each order at once
+        """
+        stream = io.StringIO()
+        writer = OrderWriter(stream)
+        writer.write("cons1 bought a\ncons1 bought b\n")
+        self.assertEqual(stream.getvalue(), "cons1 bought a\ncons1 bought b\n")
+
+    def test_background(self):
+        """
+        Used for testing that a background writer writes all the orders, in order
+        """
+        stream = io.StringIO()
+        writer = OrderWriter(stream, background=True, flush_every=2)
+        orders = [f"cons{i} bought a\n" for i in range(100)]
+        for order in orders:
+            writer.write(order)
+        writer.close()
+        self.assertEqual(stream.getvalue(), "".join(orders))
+
+
+class OrderWriter:
+    """
+    Class that writes the orders to an output stream.
+    Each order is a single block of lines, so the lines of an order are never
+    interleaved with other orders' lines.
+
+    A synchronous writer writes each order under a lock. A background writer hands
+    the orders to a single writer thread, so the consumers never contend for the stream.
+    """
+
+    def __init__(self, stream=None, background=False, flush_every=1, flush_interval=0.1,
+                 lock=None):
+        """
+        Constructor
+
+        :type stream: TextIO
+        :param stream: the output stream, the current sys.stdout by default
+
+        :type background: Bool
+        :param background: if True, the orders are written by a writer thread
+
+        :type flush_every: Int
+        :param flush_every: the number of orders after which the stream is flushed
+
+        :type flush_interval: Float
+        :param flush_interval: the maximum number of seconds the background writer
+        keeps written orders unflushed
+
+        :type lock: Lock
+        :param lock: the lock of the synchronous writes
+        """
+        self.stream = stream
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.lock = lock or Lock()
+        self.unflushed = 0
+        self.orders = None
+        self.thread = None
+        if background:
+            self.orders = SimpleQueue()
+            self.thread = Thread(target=self.run, name="OrderWriter", daemon=True)
+            self.thread.start()
+
+    def _stream(self):
+        """
+        Returns the output stream
+        """
+        return self.stream or sys.stdout
+
+    def _write(self, text):
+        """
+        Writes an order and flushes the stream every 'flush_every' orders
+        """
+        self._stream().write(text)
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every:
+            self._stream().flush()
+            self.unflushed = 0
+
+    def write(self, text):
+        """
+        Writes an order, given as the text of all its lines
+
+        :type text: String
+        :param text: the order's lines, each of them ending with a new line
+        """
+        if self.orders is not None:
+            self.orders.put(text)
+            return
+        # A lock is used in order not to interleave the written orders.
+        with self.lock:
+            self._write(text)
+
+    def run(self):
+        """
+        Writes the queued orders until the writer is closed.
+        The stream is flushed every 'flush_every' orders, or when no order
+        came for 'flush_interval' seconds.
+        """
+        while True:
+            try:
+                text = self.orders.get(timeout=self.flush_interval)
+            except Empty:
+                if self.unflushed > 0:
+                    self._stream().flush()
+                    self.unflushed = 0
+                continue
+            if text is None:
+                break
+            self._write(text)
+        self._stream().flush()
+
+    def close(self):
+        """
+        Writes all the queued orders, flushes the stream and stops the writer thread
+        """
+        if self.thread is not None:
+            self.orders.put(None)
+            self.thread.join()
+            self.thread = None
+            self.orders = None
+        else:
+            with self.lock:
+                self._stream().flush()
@@ -0,0 +1,148 @@
+"""
+This module runs the Marketplace in a dedicated server process, shared by
+producers and consumers running in other processes.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import multiprocessing
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import BaseManager
+
+from .consumer import Consumer
+from .marketplace import Marketplace
+from .producer import Producer
+from .product import Product
+
+
+class TestMarketplaceManager(unittest.TestCase):
+    """
+    Class that represents the test unit of MarketplaceManager.
+    """
+
+    def setUp(self):
+        """
+        Used for starting the server process
+        """
+        # The server process lives from setUp() to tearDown(), so no with-block can hold it
+        self.manager = MarketplaceManager()
+        self.manager.start()  # pylint: disable=consider-using-with
+        # Marketplace() is added to the manager by register(), at runtime
+        self.marketplace = self.manager.Marketplace(15)  # pylint: disable=no-member
+
+    def tearDown(self):
+        """
+        Used for stopping the server process
+        """
+        self.manager.shutdown()
+
+    def test_proxy(self):
+        """
+        Used for testing the Marketplace's methods through a proxy
+        """
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart("cons1")
+        self.assertEqual(
+            self.marketplace.publish_many(producer, Product("Linden", 9), 3), 3,
+            "wrong return value for publish_many()",
+        )
+        self.assertEqual(
+            self.marketplace.add_many(cart, Product("Linden", 9), 5, block=True, timeout=0.01),
+            3,
+            "wrong return value for add_many()",
+        )
+        self.assertEqual(self.marketplace.remove_many(cart, Product("Linden", 9), 1), 1)
+
+    def test_workers(self):
+        """
+        Used for testing that consumers running in worker processes get their products
+        """
+        consumer = {"name": "cons1", "retry_wait_time": 0.01,
+                    "carts": [[("add", Product("Linden", 9), 4)]]}
+        producer = {"name": "prod1", "republish_wait_time": 0.01,
+                    "products": [(Product("Linden", 9), 2, 0)]}
+        producers = multiprocessing.Process(
+            target=run_producers, args=(self.marketplace, [producer], True), daemon=True
+        )
+        producers.start()
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            executor.submit(run_consumers, self.marketplace, [consumer], True).result()
+        self.marketplace.shutdown()
+        producers.join(5)
+        self.assertFalse(producers.is_alive(), "the producers weren't shut down")
+        self.assertEqual(self.marketplace.new_cart("cons2"), 1, "wrong number of carts")
+
+
+class MarketplaceManager(BaseManager):
+    """
+    Class that serves a Marketplace from a dedicated server process.
+    The Marketplace is created with manager.Marketplace(queue_size_per_producer)
+    and is used by the other processes through the returned proxy.
+    Each proxy call is a request to the server, thus the agents should
+    use the bulk operations, which move many units in a single request.
+    """
+
+
+MarketplaceManager.register(
+    "Marketplace",
+    Marketplace,
+    exposed=[
+        "register_producer", "publish", "publish_many", "new_cart", "add_to_cart",
+        "add_many", "remove_from_cart", "remove_many", "place_order", "close", "stats",
+        "latencies", "is_running", "shutdown", "drain",
+    ],
+)
+
+
+def run_producers(marketplace, producers, blocking):
+    """
+    Runs the producers as threads of a worker process, until the Marketplace is shut down
+
+    :type marketplace: Marketplace proxy
+    :param marketplace: the proxy of the served Marketplace
+
+    :type producers: List
+    :param producers: the producers' configurations
+
+    :type blocking: Bool
+    :param blocking: if True, the producers wait inside the Marketplace
+    """
+    threads = [Producer(**config, marketplace=marketplace, blocking=blocking)
+               for config in producers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_consumers(marketplace, consumers, blocking):
+    """
+    Runs the consumers as threads of a worker process, until all of them finish.
+    The consumers of a worker run concurrently, so that none of them waits for
+    a product that only a consumer queued behind it would free.
+
+    :type marketplace: Marketplace proxy
+    :param marketplace: the proxy of the served Marketplace
+
+    :type consumers: List
+    :param consumers: the consumers' configurations
+
+    :type blocking: Bool
+    :param blocking: if True, the consumers wait inside the Marketplace
+    """
+    threads = [Consumer(**config, marketplace=marketplace, blocking=blocking)
+               for config in consumers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def split(items, parts):
+    """
+    Splits the list in at most 'parts' interleaved chunks of almost the same size
+    """
+    return [chunk for chunk in (items[i::parts] for i in range(parts)) if chunk]
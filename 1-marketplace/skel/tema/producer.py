@@ -6,8 +6,9 @@ Assignment 1
 March 2021
 """
 
-from threading import Thread
-from time import sleep
+from threading import Event, Thread
+
+from .clock import REAL_CLOCK
 
 
 class Producer(Thread):
@@ -15,7 +16,8 @@ class Producer(Thread):
     Class that represents a producer.
     """
 
-    def __init__(self, products, marketplace, republish_wait_time, **kwargs):
+    def __init__(self, products, marketplace, republish_wait_time, blocking=True, clock=REAL_CLOCK,
+                 **kwargs):
         """
         Constructor.
 
@@ -29,6 +31,14 @@ class Producer(Thread):
         @param republish_wait_time: the number of seconds that a producer must
         wait until the marketplace becomes available
 
+        @type blocking: Bool
+        @param blocking: if True, a producer waits inside publish() until its queue
+        has room and a consumer has an open cart, instead of sleeping between attempts
+
+        @type clock: RealClock or VirtualClock
+        @param clock: the clock the producer sleeps on; a virtual clock
+        registers the producer here, so that the time stands still until it runs
+
         @type kwargs:
         @param kwargs: other arguments that are passed to the Thread's __init__()
         """
@@ -36,22 +46,56 @@ class Producer(Thread):
         self.products = products
         self.marketplace = marketplace
         self.republish_wait_time = republish_wait_time
+        self.blocking = blocking
+        self.clock = clock
+        self.clock.register()
         self.prod_id = marketplace.register_producer()
 
+        # Set by stop(), it also interrupts the producer's sleeps
+        self.stopped = Event()
+
+    def stop(self):
+        """
+        Asks the producer to stop. It returns once its current publish or sleep ends,
+        so the Marketplace should be shut down too, to wake it if it's waiting inside.
+        """
+        self.stopped.set()
+
+    def running(self):
+        """
+        Returns False once the producer is stopped or the Marketplace is shut down
+        """
+        return not self.stopped.is_set() and self.marketplace.is_running()
+
     def run(self):
         """
-        Takes a product from the list and then publishes it in the Marketplace.
+        Takes a product from the list and then publishes all of its units
+        in the Marketplace, as many as possible at a time.
         If the operation fails, the producer sleeps 'republish_wait_time' seconds.
-        If the operation succeeds, the producers sleeps 'wait_time' seconds.
+        In blocking mode, the producer pauses inside the Marketplace, without polling,
+        until its queue has room and a consumer has an open cart.
+        If the operation succeeds, the producers sleeps 'wait_time' seconds
+        for each published unit.
         'wait_time' is a time associated with the current product.
+        The producer returns once it's stopped or the Marketplace is shut down.
         """
-        while 1:
-            for product, quantity, wait_time in self.products:
-                cnt = quantity
-                while cnt > 0:
-                    result = self.marketplace.publish(self.prod_id, product)
-                    if not result:
-                        sleep(self.republish_wait_time)
-                    else:
-                        sleep(wait_time)
-                        cnt -= 1
+        try:
+            while not self.stopped.is_set():
+                for product, quantity, wait_time in self.products:
+                    cnt = quantity
+                    while cnt > 0 and not self.stopped.is_set():
+                        result = self.marketplace.publish_many(
+                            self.prod_id, product, cnt, block=self.blocking,
+                            timeout=None if self.blocking else self.republish_wait_time
+                        )
+                        if not result:
+                            # A failed publish is the only one that may be due to a shutdown
+                            if not self.running():
+                                return
+                            if not self.blocking:
+                                self.clock.sleep(self.republish_wait_time, self.stopped)
+                        else:
+                            self.clock.sleep(wait_time * result, self.stopped)
+                            cnt -= result
+        finally:
+            self.clock.unregister()
@@ -1,12 +1,15 @@
 """
 This module offers the available Products.
 
+The products are slotted and compute their hash once, when they're created,
+since they're looked up in the Marketplace's dictionaries on every operation.
+
 Computer Systems Architecture Course
 Assignment 1
 March 2021
 """
 
-from dataclasses import dataclass
+from dataclasses import astuple, dataclass
 
 
 @dataclass(init=True, repr=True, order=False, frozen=True)
@@ -14,15 +17,36 @@ class Product:
     """
     Class that represents a product.
     """
+    __slots__ = ("name", "price", "_hash")
     name: str
     price: int
 
+    def __post_init__(self):
+        """
+        Caches the hash of the product's fields
+        """
+        object.__setattr__(self, "_hash", hash(astuple(self)))
+
+    def __hash__(self):
+        # The slot is set by __post_init__(), outside of the dataclass's fields,
+        # which would otherwise be part of astuple() and the comparisons
+        return self._hash  # pylint: disable=no-member
+
+    def __reduce__(self):
+        """
+        Pickles the product by its fields, so the hash is computed again by the
+        unpickling process, whose string hashes may differ
+        """
+        return self.__class__, astuple(self)
+
 
 @dataclass(init=True, repr=True, order=False, frozen=True)
 class Tea(Product):
     """
     Tea products
     """
+    __slots__ = ("type",)
+    __hash__ = Product.__hash__
     type: str
 
 
@@ -31,5 +55,7 @@ class Coffee(Product):
     """
     Coffee products
     """
+    __slots__ = ("acidity", "roast_level")
+    __hash__ = Product.__hash__
     acidity: str
     roast_level: str
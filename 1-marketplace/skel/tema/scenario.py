@@ -0,0 +1,316 @@
+"""
+This module reads and writes the line-delimited scenarios.
+
+A scenario has one JSON record per line, each of them an object with a single key:
+the "marketplace" record comes first, then the "producer" records and then the
+"consumer" records, holding the same fields as in a test's input file. A "product"
+record, holding the product's id and fields, may come anywhere before the product
+is used. The records are parsed as they are needed, so a scenario never has to fit
+in memory.
+
+Usage: python -m tema.scenario test.in test.jsonl, to convert a test's input file.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from json import dumps, loads
+
+from .catalog import ProductCatalog
+from .product import Coffee, Product, Tea
+
+PRODUCT_TYPES = {"Product": Product, "Tea": Tea, "Coffee": Coffee}
+
+
+class TestScenario(unittest.TestCase):
+    """
+    Class that represents the test unit of the scenario's reader and writer.
+    """
+
+    def test_round_trip(self):
+        """
+        Used for testing that a written scenario is read back with actual products
+        """
+        products = {"id1": {"product_type": "Tea", "name": "Linden", "type": "Herbal",
+                            "price": 9}}
+        producers = [{"name": "prod1", "products": [["id1", 2, 0.1]],
+                      "republish_wait_time": 0.2}]
+        consumers = [{"name": f"cons{i}", "retry_wait_time": 0.1,
+                      "carts": [[{"type": "add", "product": "id1", "quantity": 2}]]}
+                     for i in range(3)]
+        with tempfile.TemporaryDirectory() as scenario_dir:
+            filename = os.path.join(scenario_dir, "test.jsonl")
+            with open(filename, "w", encoding="utf-8") as scenario_file:
+                write_scenario(scenario_file, {"queue_size_per_producer": 4},
+                               products, producers, iter(consumers))
+
+            reader = ScenarioReader(filename)
+            market_config = reader.market_config()
+            self.assertEqual(market_config["marketplace"], {"queue_size_per_producer": 4})
+            linden = Tea("Linden", 9, "Herbal")
+            self.assertEqual(list(market_config["producers"])[0]["products"],
+                             [(linden, 2, 0.1)])
+            read_consumers = list(market_config["consumers"])
+            self.assertEqual([consumer["name"] for consumer in read_consumers],
+                             ["cons0", "cons1", "cons2"])
+            self.assertEqual(read_consumers[0]["carts"], [[("add", linden, 2)]])
+            self.assertIs(read_consumers[0]["carts"][0][0][1],
+                          read_consumers[2]["carts"][0][0][1])
+            self.assertTrue(reader.file.closed)
+
+    def test_order(self):
+        """
+        Used for testing that a record out of order is rejected
+        """
+        with tempfile.TemporaryDirectory() as scenario_dir:
+            filename = os.path.join(scenario_dir, "test.jsonl")
+            with open(filename, "w", encoding="utf-8") as scenario_file:
+                scenario_file.write('{"marketplace": {"queue_size_per_producer": 4}}\n'
+                                    '{"consumer": {"name": "cons1", "retry_wait_time": 0.1,'
+                                    ' "carts": []}}\n'
+                                    '{"producer": {"name": "prod1", "products": [],'
+                                    ' "republish_wait_time": 0.2}}\n')
+            market_config = ScenarioReader(filename).market_config()
+            self.assertEqual(list(market_config["producers"]), [])
+            with self.assertRaises(ValueError):
+                list(market_config["consumers"])
+
+
+def load_product(catalog, definition):
+    """
+    Returns the catalog's product with the given definition
+
+    :type catalog: ProductCatalog
+    :param catalog: the catalog the product is interned in
+
+    :type definition: Dict
+    :param definition: the product's fields and its "product_type"
+    """
+    fields = dict(definition)
+    product_type = PRODUCT_TYPES[fields.pop("product_type")]
+    return catalog.intern(product_type(**fields))
+
+
+def load_products(definitions):
+    """
+    Returns the products with the given definitions, interned in a new catalog
+
+    :type definitions: Iterable
+    :param definitions: the products' fields and their "product_type"
+    """
+    catalog = ProductCatalog()
+    return [load_product(catalog, definition) for definition in definitions]
+
+
+def read_test_input(usage):
+    """
+    Reads the test's input file given on the command line, along with the
+    scenario's file. Prints the usage if the arguments are wrong.
+
+    :type usage: String
+    :param usage: the command's usage
+    :return: the test's market configuration and the scenario's file name, or None
+    """
+    if len(sys.argv) != 3:
+        print(usage)
+        return None
+
+    with open(sys.argv[1], encoding="utf-8") as input_file:
+        return loads(input_file.read()), sys.argv[2]
+
+
+def write_scenario(output_file, marketplace, products, producers, consumers):
+    """
+    Writes a scenario, one record per line.
+
+    :type output_file: TextIO
+    :param output_file: the output file
+
+    :type marketplace: Dict
+    :param marketplace: the marketplace's arguments
+
+    :type products: Dict
+    :param products: the product definitions, by product id
+
+    :type producers: Iterable
+    :param producers: the producers' configurations, with product ids
+
+    :type consumers: Iterable
+    :param consumers: the consumers' configurations, with product ids
+    """
+    writer = ScenarioWriter(output_file, marketplace, products, producers)
+    for consumer in consumers:
+        writer.add_consumer(consumer)
+    writer.close()
+
+
+class ScenarioWriter:
+    """
+    Class that writes a scenario, one consumer at a time.
+    """
+
+    def __init__(self, output_file, marketplace, products, producers):
+        """
+        Constructor. Writes the marketplace's, the products' and the producers' records.
+
+        :type output_file: TextIO
+        :param output_file: the output file
+
+        :type marketplace: Dict
+        :param marketplace: the marketplace's arguments
+
+        :type products: Dict
+        :param products: the product definitions, by product id
+
+        :type producers: Iterable
+        :param producers: the producers' configurations, with product ids
+        """
+        self.file = output_file
+        self._write_record("marketplace", marketplace)
+        for product_id, definition in products.items():
+            self._write_record("product", {"id": product_id, **definition})
+        for producer in producers:
+            self._write_record("producer", producer)
+
+    def _write_record(self, kind, fields):
+        """
+        Writes a single record
+        """
+        self.file.write(dumps({kind: fields}) + "\n")
+
+    def add_consumer(self, consumer):
+        """
+        Writes a consumer's record
+
+        :type consumer: Dict
+        :param consumer: the consumer's configuration, with product ids
+        """
+        self._write_record("consumer", consumer)
+
+    def close(self):
+        """
+        Completes the scenario, flushing its records to the file
+        """
+        self.file.flush()
+
+
+class ScenarioReader:
+    """
+    Class that reads a scenario's records as they are needed.
+
+    The marketplace's record is read when the reader is created. The producers
+    and then the consumers are read one at a time, their product ids being turned
+    into products interned in a catalog. The file is closed after the last record.
+    """
+
+    def __init__(self, filename):
+        """
+        Constructor
+
+        :type filename: String
+        :param filename: the scenario's file
+        """
+        # The file is read as the scenario runs and closed by close()
+        self.file = open(filename, encoding="utf-8")  # pylint: disable=consider-using-with
+        self.catalog = ProductCatalog()
+        self.products = {}
+        self.record = None
+        self._read_record()
+
+        if self.record is None or self.record[0] != "marketplace":
+            self.close()
+            raise ValueError(f"{filename}: the scenario must start with the marketplace")
+        self.marketplace = self.record[1]
+        self._read_record()
+
+    def _read_record(self):
+        """
+        Reads the next producer, consumer or marketplace record, registering
+        the products found on the way. The record is None at the end of the file.
+        """
+        for line in self.file:
+            if not line.strip():
+                continue
+            (kind, fields), = loads(line).items()
+            if kind == "product":
+                product_id = fields.pop("id")
+                self.products[product_id] = load_product(self.catalog, fields)
+                continue
+            self.record = (kind, fields)
+            return
+        self.record = None
+        self.close()
+
+    def _records(self, kind):
+        """
+        Yields the fields of the consecutive records of the given kind
+        """
+        while self.record is not None and self.record[0] == kind:
+            fields = self.record[1]
+            self._read_record()
+            yield fields
+
+    def producers(self):
+        """
+        Yields the producers' configurations, with products instead of product ids
+        """
+        for producer in self._records("producer"):
+            producer["products"] = [(self.products[i], quantity, sleep_time)
+                                    for i, quantity, sleep_time in producer["products"]]
+            yield producer
+
+    def consumers(self):
+        """
+        Yields the consumers' configurations, whose operations are turned into
+        (type, product, quantity) tuples. The producers must have been read before.
+        """
+        for consumer in self._records("consumer"):
+            consumer["carts"] = [[(operation["type"], self.products[operation["product"]],
+                                   operation["quantity"])
+                                  for operation in cart]
+                                 for cart in consumer["carts"]]
+            yield consumer
+        if self.record is not None:
+            kind = self.record[0]
+            self.close()
+            raise ValueError(f"unexpected {kind} record after the consumers")
+
+    def market_config(self):
+        """
+        Returns the scenario as a test's market configuration, whose producers
+        and consumers are iterators that read the records as they are needed
+        """
+        return {"marketplace": self.marketplace,
+                "producers": self.producers(),
+                "consumers": self.consumers()}
+
+    def close(self):
+        """
+        Closes the scenario's file
+        """
+        self.file.close()
+
+
+def main():
+    """
+    Converts a test's input file to a scenario
+    """
+    test_input = read_test_input("Usage: python -m tema.scenario input_filepath "
+                                 "scenario_filepath")
+    if test_input is None:
+        return
+
+    market_config, filename = test_input
+    with open(filename, "w", encoding="utf-8") as scenario_file:
+        write_scenario(scenario_file, market_config["marketplace"],
+                       market_config["products"], market_config["producers"],
+                       market_config["consumers"])
+
+
+if __name__ == "__main__":
+    main()
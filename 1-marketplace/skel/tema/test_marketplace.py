@@ -0,0 +1,477 @@
+"""
+This module represents the test unit of the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import os
+import tempfile
+import unittest
+from threading import Thread
+
+from .marketplace import Marketplace
+from .marketplace_logging import stop_logger
+from .product import Product
+
+
+class PublishingLock:
+    """
+    Class that represents a lock which publishes before it's first acquired,
+    to interleave a publish with another method's critical sections
+    """
+
+    def __init__(self, lock, publish):
+        """
+        Constructor
+
+        :type lock: Lock
+        :param lock: the wrapped lock
+
+        :type publish: Callable
+        :param publish: called once, before the lock is first acquired
+        """
+        self.lock = lock
+        self.publish = publish
+
+    def __enter__(self):
+        publish, self.publish = self.publish, None
+        if publish is not None:
+            publish()
+        return self.lock.__enter__()
+
+    def __exit__(self, *args):
+        return self.lock.__exit__(*args)
+
+
+class TestMarketplace(unittest.TestCase):
+    """
+    Class that represents the test unit of Marketplace.
+    """
+
+    def setUp(self):
+        """
+        Used for creating a Marketplace object instantiation
+        """
+        self.marketplace = Marketplace(15)
+        self.assertEqual(
+            self.marketplace.queue_size_per_producer, 15, "wrong queue size"
+        )
+
+    def test_register_producer(self):
+        """
+        Used for testing the register_producer() method
+        """
+        self.assertEqual(self.marketplace.register_producer(), 0, "wrong producer id")
+
+    def test_publish(self):
+        """
+        Used for testing the publish() method
+        """
+        producer = self.marketplace.register_producer()
+        self.assertTrue(
+            self.marketplace.publish(producer, Product("Indonezia", 1)),
+            "wrong return value for publish()",
+        )
+        i = 0
+        while i < self.marketplace.queue_size_per_producer - 1:
+            self.marketplace.publish(producer, Product("Linden", 9))
+            i += 1
+        self.assertFalse(
+            self.marketplace.publish(producer, Product("Indonezia", 1)),
+            "wrong limit size",
+        )
+        self.assertTrue(
+            self.marketplace.publish(
+                self.marketplace.register_producer(), Product("Indonezia", 1)
+            ),
+            "wrong return value for publish()",
+        )
+
+    def test_blocking_publish(self):
+        """
+        Used for testing the blocking mode of the publish() method
+        """
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        for _ in range(self.marketplace.queue_size_per_producer):
+            self.marketplace.publish(producer, Product("Linden", 9))
+        self.assertFalse(
+            self.marketplace.publish(
+                producer, Product("Linden", 9), block=True, timeout=0.01
+            ),
+            "wrong return value for a timed out publish()",
+        )
+        consumer = Thread(
+            target=self.marketplace.add_to_cart, args=(cart, Product("Linden", 9))
+        )
+        consumer.start()
+        self.assertTrue(
+            self.marketplace.publish(producer, Product("Indonezia", 1), block=True),
+            "wrong return value for a blocking publish()",
+        )
+        consumer.join()
+
+    def test_new_cart(self):
+        """
+        Used for testing the new_cart() method
+        """
+        self.assertEqual(self.marketplace.new_cart(), 0, "wrong cart id value")
+
+    def test_add_to_cart(self):
+        """
+        Used for testing the add_cart() method
+        """
+        self.marketplace.publish(
+            self.marketplace.register_producer(), Product("Indonezia", 1)
+        )
+        self.assertFalse(
+            self.marketplace.add_to_cart(
+                self.marketplace.new_cart(), Product("Linden", 9)
+            ),
+            "wrong return value for add_to_cart()",
+        )
+        self.assertTrue(
+            self.marketplace.add_to_cart(
+                self.marketplace.new_cart(), Product("Indonezia", 1)
+            ),
+            "wrong return value for add_to_cart()",
+        )
+
+    def test_remove_from_cart(self):
+        """
+        Used for testing the remove_from_cart() method
+        """
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        self.marketplace.publish(producer, Product("Indonezia", 1))
+        self.marketplace.publish(producer, Product("Linden", 9))
+        self.marketplace.add_to_cart(cart, Product("Linden", 9))
+        self.assertNotEqual(
+            self.marketplace.marketplace_products[0],
+            Product("Linden", 9),
+            "remove failed",
+        )
+        self.marketplace.remove_from_cart(cart, Product("Linden", 9))
+        self.assertEqual(
+            self.marketplace.marketplace_products[0],
+            Product("Indonezia", 1),
+            "add failed",
+        )
+        return cart
+
+    def test_demand(self):
+        """
+        Used for testing that a blocking publish waits for a consumer's open cart
+        """
+        producer = self.marketplace.register_producer()
+        self.assertFalse(
+            self.marketplace.publish(producer, Product("Linden", 9), block=True, timeout=0.01),
+            "a producer published without demand",
+        )
+        cart = self.marketplace.new_cart()
+        self.assertTrue(
+            self.marketplace.publish(producer, Product("Linden", 9), block=True, timeout=0.01)
+        )
+        self.marketplace.place_order(cart)
+        self.assertEqual(self.marketplace.demand.open_carts, 0)
+
+    def test_shutdown(self):
+        """
+        Used for testing that shutdown() wakes the waiting producers and that
+        drain() empties the inventory
+        """
+        producer = self.marketplace.register_producer()
+        self.marketplace.new_cart()
+        self.marketplace.publish_many(producer, Product("Linden", 9), 20)
+        results = []
+        publisher = Thread(target=lambda: results.append(
+            self.marketplace.publish(producer, Product("Linden", 9), block=True)
+        ))
+        publisher.start()
+        self.marketplace.shutdown()
+        publisher.join(1)
+        self.assertFalse(publisher.is_alive(), "shutdown() didn't wake the producer")
+        self.assertEqual(results, [False])
+        self.assertFalse(self.marketplace.is_running())
+        self.assertEqual(
+            self.marketplace.drain(),
+            {Product("Linden", 9): self.marketplace.queue_size_per_producer},
+        )
+        self.assertEqual(self.marketplace.producers_queue_size, {producer: 0})
+
+    def test_inventory_index(self):
+        """
+        Used for testing that units are taken from and returned to their producers
+        """
+        first = self.marketplace.register_producer()
+        second = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        self.marketplace.publish(first, Product("Linden", 9))
+        self.marketplace.publish(second, Product("Linden", 9))
+        self.assertEqual(
+            self.marketplace.inventory[Product("Linden", 9)],
+            {first: 1, second: 1},
+            "wrong inventory index",
+        )
+        self.assertTrue(self.marketplace.add_to_cart(cart, Product("Linden", 9)))
+        self.assertEqual(
+            self.marketplace.producers_queue_size,
+            {first: 0, second: 1},
+            "wrong producer for the bought unit",
+        )
+        self.marketplace.remove_from_cart(cart, Product("Linden", 9))
+        self.assertEqual(
+            self.marketplace.producers_queue_size,
+            {first: 1, second: 1},
+            "wrong producer for the returned unit",
+        )
+        self.assertEqual(
+            self.marketplace.marketplace_products,
+            [Product("Linden", 9)] * 2,
+            "wrong products view",
+        )
+
+    def test_blocking_add_to_cart(self):
+        """
+        Used for testing the blocking mode of the add_to_cart() method
+        """
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        self.assertFalse(
+            self.marketplace.add_to_cart(
+                cart, Product("Linden", 9), block=True, timeout=0.01
+            ),
+            "wrong return value for a timed out add_to_cart()",
+        )
+        publisher = Thread(
+            target=self.marketplace.publish, args=(producer, Product("Linden", 9))
+        )
+        publisher.start()
+        self.assertTrue(
+            self.marketplace.add_to_cart(cart, Product("Linden", 9), block=True),
+            "wrong return value for a blocking add_to_cart()",
+        )
+        publisher.join()
+        self.assertEqual(
+            self.marketplace.consumer_carts[cart], [Product("Linden", 9)], "add failed"
+        )
+
+    def test_global_lock(self):
+        """
+        Used for testing that the methods don't deadlock when all the
+        fine-grained locks are the same lock
+        """
+        self.marketplace = Marketplace(1, striped=False)
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        self.assertTrue(self.marketplace.publish(producer, Product("Linden", 9)))
+        self.assertFalse(
+            self.marketplace.publish(
+                producer, Product("Linden", 9), block=True, timeout=0.01
+            ),
+            "wrong limit size",
+        )
+        self.assertTrue(
+            self.marketplace.add_to_cart(cart, Product("Linden", 9), block=True)
+        )
+        self.marketplace.remove_from_cart(cart, Product("Linden", 9))
+        self.assertEqual(
+            self.marketplace.marketplace_products, [Product("Linden", 9)], "remove failed"
+        )
+
+    def test_bulk_operations(self):
+        """
+        Used for testing the publish_many(), add_many() and remove_many() methods
+        """
+        first = self.marketplace.register_producer()
+        second = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        self.assertEqual(
+            self.marketplace.publish_many(first, Product("Linden", 9), 20),
+            self.marketplace.queue_size_per_producer,
+            "wrong return value for publish_many()",
+        )
+        self.marketplace.publish_many(second, Product("Linden", 9), 5)
+        self.assertEqual(
+            self.marketplace.add_many(cart, Product("Linden", 9), 30),
+            self.marketplace.queue_size_per_producer + 5,
+            "wrong return value for add_many()",
+        )
+        self.assertEqual(
+            self.marketplace.producers_queue_size, {first: 0, second: 0}
+        )
+        self.assertEqual(
+            self.marketplace.remove_many(cart, Product("Linden", 9), 3), 3,
+            "wrong return value for remove_many()",
+        )
+        self.assertEqual(
+            self.marketplace.remove_many(cart, Product("Indonezia", 1), 3), 0,
+            "wrong return value for remove_many()",
+        )
+        self.assertEqual(
+            len(self.marketplace.consumer_carts[cart]),
+            self.marketplace.queue_size_per_producer + 2,
+            "remove_many failed",
+        )
+        self.assertEqual(
+            self.marketplace.producers_queue_size, {first: 0, second: 3}
+        )
+
+    def test_fair_add(self):
+        """
+        Used for testing that in fair mode the units are handed to the waiting carts
+        in arrival order and that a newer cart doesn't take them first
+        """
+        self.marketplace = Marketplace(15, fair=True)
+        producer = self.marketplace.register_producer()
+        first, second, third = (self.marketplace.new_cart() for _ in range(3))
+        self.assertEqual(self.marketplace.add_many(first, Product("Linden", 9), 2), 0)
+        self.assertEqual(self.marketplace.add_many(second, Product("Linden", 9), 1), 0)
+        self.marketplace.publish_many(producer, Product("Linden", 9), 2)
+        self.assertEqual(self.marketplace.add_many(third, Product("Linden", 9), 1), 0)
+        self.assertEqual(self.marketplace.add_many(second, Product("Linden", 9), 1), 0)
+        self.assertTrue(self.marketplace.available(first, Product("Linden", 9)))
+        self.assertEqual(self.marketplace.add_many(first, Product("Linden", 9), 2), 2)
+        self.marketplace.publish(producer, Product("Linden", 9))
+        self.assertEqual(self.marketplace.add_many(third, Product("Linden", 9), 1), 0)
+        self.assertEqual(self.marketplace.add_many(second, Product("Linden", 9), 1), 1)
+        self.assertEqual(self.marketplace.producers_queue_size, {producer: 0})
+
+        # an ordered cart leaves the queue and its units go to the next cart
+        fourth = self.marketplace.new_cart()
+        self.assertEqual(self.marketplace.add_many(fourth, Product("Linden", 9), 1), 0)
+        self.marketplace.publish(producer, Product("Linden", 9))
+        self.marketplace.place_order(third)
+        self.assertEqual(self.marketplace.waiters.queues, {})
+        self.assertEqual(self.marketplace.add_many(fourth, Product("Linden", 9), 1), 1)
+
+    def test_fair_blocking_add(self):
+        """
+        Used for testing that in fair mode a blocked consumer is woken by the units
+        handed to its cart
+        """
+        self.marketplace = Marketplace(15, fair=True)
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        results = []
+        consumer = Thread(target=lambda: results.append(
+            self.marketplace.add_many(cart, Product("Linden", 9), 3, block=True)
+        ))
+        consumer.start()
+        while not self.marketplace.waiters.queues:
+            consumer.join(0.001)
+        self.marketplace.publish_many(producer, Product("Linden", 9), 2)
+        consumer.join(1)
+        self.assertEqual(results, [2])
+        self.assertEqual(self.marketplace.add_many(cart, Product("Linden", 9), 1), 0)
+        self.marketplace.publish_many(producer, Product("Linden", 9), 2)
+        self.assertEqual(self.marketplace.add_many(cart, Product("Linden", 9), 1), 1)
+        self.assertEqual(self.marketplace.marketplace_products, [Product("Linden", 9)])
+
+    def test_backorder(self):
+        """
+        Used for testing that the published and returned units fill the backorders
+        in arrival order, before the polling consumers get them
+        """
+        producer = self.marketplace.register_producer()
+        first, second, third = (self.marketplace.new_cart() for _ in range(3))
+        self.marketplace.publish(producer, Product("Linden", 9))
+        future = self.marketplace.backorder(first, Product("Linden", 9), 3)
+        self.assertFalse(future.done())
+        self.assertEqual(self.marketplace.carts[first], {Product("Linden", 9): {producer: 1}})
+        later = self.marketplace.backorder(second, Product("Linden", 9), 1)
+        self.marketplace.publish(producer, Product("Linden", 9))
+        self.assertEqual(self.marketplace.add_many(third, Product("Linden", 9), 1), 0)
+        self.marketplace.publish_many(producer, Product("Linden", 9), 2)
+        self.assertEqual(future.result(0), 3)
+        self.assertEqual(later.result(0), 1)
+        self.assertEqual(self.marketplace.producers_queue_size, {producer: 0})
+
+        # a returned unit fills the next backorder
+        future = self.marketplace.backorder(third, Product("Linden", 9), 1)
+        self.marketplace.remove_from_cart(first, Product("Linden", 9))
+        self.assertEqual(future.result(0), 1)
+        self.assertEqual(self.marketplace.consumer_carts[third], [Product("Linden", 9)])
+
+    def test_cancelled_backorder(self):
+        """
+        Used for testing that ordering a cart cancels its backorders and that
+        their units go to the inventory
+        """
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart()
+        future = self.marketplace.backorder(cart, Product("Linden", 9), 2)
+        self.marketplace.publish(producer, Product("Linden", 9))
+        self.assertEqual(self.marketplace.place_order(cart), [Product("Linden", 9)])
+        self.assertTrue(future.cancelled())
+        self.assertEqual(self.marketplace.waiters.queues, {})
+        self.marketplace.publish(producer, Product("Linden", 9))
+        self.assertEqual(self.marketplace.marketplace_products, [Product("Linden", 9)])
+
+    def test_logging(self):
+        """
+        Used for testing that the whole dictionaries are only logged at DEBUG level
+        """
+        with tempfile.TemporaryDirectory() as log_dir:
+            filename = os.path.join(log_dir, "marketplace.log")
+            for level, dumps in (("INFO", False), ("DEBUG", True)):
+                marketplace = Marketplace(15, log_config={"filename": filename,
+                                                          "level": level})
+                marketplace.new_cart()
+                stop_logger()
+                with open(filename, encoding="utf-8") as log_file:
+                    self.assertEqual(
+                        "Carts from Marketplace" in log_file.read(), dumps,
+                        f"wrong records at {level} level",
+                    )
+
+    def test_place_order(self):
+        """
+        Used for testing the place_order() method
+        """
+        cart = self.test_remove_from_cart()
+        self.marketplace.place_order(cart)
+        self.assertEqual(
+            self.marketplace.consumer_carts[cart], [], "place_order failed"
+        )
+
+    def test_compact_order(self):
+        """
+        Used for testing that a cart keeps counts and that place_order()
+        can return them instead of the expanded list
+        """
+        producer = self.marketplace.register_producer()
+        cart = self.marketplace.new_cart("cons1")
+        self.marketplace.publish_many(producer, Product("Linden", 9), 10)
+        self.assertEqual(self.marketplace.add_many(cart, Product("Linden", 9), 10), 10)
+        self.assertEqual(self.marketplace.carts[cart], {Product("Linden", 9): {producer: 10}})
+        self.assertEqual(
+            self.marketplace.place_order(cart, compact=True), {Product("Linden", 9): 10},
+            "wrong return value for a compact place_order()",
+        )
+        self.assertEqual(self.marketplace.carts[cart], {}, "place_order failed")
+
+
+class TestBackorderInterleaving(unittest.TestCase):
+    """
+    Class that represents the test unit of the backorders' lock sections.
+    """
+
+    def test_backorder_filled_at_once(self):
+        """
+        Used for testing that a backorder filled by a publish between its stripe
+        lock and its cart lock is completed once
+        """
+        marketplace = Marketplace(15)
+        producer = marketplace.register_producer()
+        cart = marketplace.new_cart()
+        cart_locks = marketplace.lock_dict["cart_locks"]
+        cart_locks[cart] = PublishingLock(
+            cart_locks[cart],
+            lambda: marketplace.publish_many(producer, Product("Linden", 9), 2)
+        )
+        future = marketplace.backorder(cart, Product("Linden", 9), 2)
+        self.assertEqual(future.result(0), 2)
+        self.assertEqual(marketplace.place_order(cart), [Product("Linden", 9)] * 2)
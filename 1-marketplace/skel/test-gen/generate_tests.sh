@@ -1,4 +1,5 @@
-# usage: test_generator.py [-h] test_name [producers] [consumers] [products] [marketplace_q] [min_carts] [max_carts] [is_basic] [supports_removal]
+# usage: test_generator.py [-h] [--seed SEED] [--output-dir OUTPUT_DIR] [--sort-buffer SORT_BUFFER] [--jsonl] [--binary] test_name [producers] [consumers] [products] [marketplace_q] [min_carts] [max_carts] [is_basic] [supports_removal]
+# stress test, not part of the checked tests: python3 test_generator.py stress 50 20000 2000 40 1 5 --seed 7 --output-dir /tmp
 
 python3 test_generator.py 01 1 1 2 15 1 1 False
 python3 test_generator.py 02 1 1 2 15 2 2
@@ -11,12 +11,23 @@ Script input
     - max number of carts per consumer
     - is basic test
     - should have removal operations
+    - --seed, --output-dir, --sort-buffer, --jsonl and --binary options
+
+The consumers are generated and written one at a time and the reference output
+is sorted with an external merge sort, so scenarios with millions of operations
+never have to fit in memory.
 """
 import argparse
+import heapq
 import random
-from json import loads, dumps
+import tempfile
+from contextlib import ExitStack
+from itertools import islice
+from json import dumps
 
 from tema.product import *  # pylint: disable=wildcard-import, unused-wildcard-import
+from tema.scenario import ScenarioWriter
+from tema.binary_scenario import BinaryScenarioWriter
 from test_utils import *  # pylint: disable=wildcard-import, unused-wildcard-import
 
 
@@ -26,13 +37,13 @@ def generate_test():
 
     :return: nothing
     """
-    random.seed(0)
-
     cmdline_arguments = parse_input()
     if not sanitize_inputs(cmdline_arguments):
         print("Invalid arguments")
     print(cmdline_arguments)
 
+    random.seed(cmdline_arguments[ARG_SEED])
+
     products = generate_products(cmdline_arguments[ARG_PRODUCTS])
     producers = generate_producers(cmdline_arguments[ARG_PRODUCERS],
                                    products, cmdline_arguments[ARG_IS_BASIC])
@@ -43,6 +54,9 @@ def generate_test():
         if not products[prod_id]["is_produced"]:
             del products[prod_id]
 
+    for prod_id in products.keys():
+        del products[prod_id]["is_produced"]
+
     consumers = generate_consumers(cmdline_arguments[ARG_CONSUMERS],
                                    products,
                                    cmdline_arguments[ARG_MIN_CARTS],
@@ -51,17 +65,12 @@ def generate_test():
                                    cmdline_arguments[ARG_SUPPORTS_REMOVAL])
     marketplace = generate_marketplace(cmdline_arguments[ARG_MARKETPLACE_Q])
 
-    for prod_id in products.keys():
-        del products[prod_id]["is_produced"]
-
-    json_data = {ARG_PRODUCTS: products, ARG_PRODUCERS: producers,
-                 ARG_CONSUMERS: consumers, "marketplace": marketplace}
-
-    # write to json test file (tests/{test_name}.json)
-    with open(f'{TESTS_DIR}/{cmdline_arguments[ARG_TEST_NAME]}.json', 'w') as json_file:
-        print(dumps(json_data, indent=4), file=json_file)
-
-    generate_in_out_test_files(cmdline_arguments[ARG_TEST_NAME])
+    generate_in_out_test_files(f'{cmdline_arguments[ARG_OUTPUT_DIR]}/'
+                               f'{cmdline_arguments[ARG_TEST_NAME]}',
+                               products, producers, consumers, marketplace,
+                               cmdline_arguments[ARG_SORT_BUFFER],
+                               cmdline_arguments[ARG_JSONL],
+                               cmdline_arguments[ARG_BINARY])
 
 
 def parse_input():
@@ -93,6 +102,20 @@ def parse_input():
                         help="True if it is a simple test, False otherwise")
     parser.add_argument(ARG_SUPPORTS_REMOVAL, type=bool, nargs='?', default=True,
                         help="True if the consumer can remove products from cart, False otherwise")
+    parser.add_argument("--" + ARG_SEED, type=int, default=DEFAULT_SEED,
+                        help="seed of the random generator, the same seed and arguments "
+                             "always generate the same test")
+    parser.add_argument("--" + ARG_OUTPUT_DIR.replace("_", "-"), dest=ARG_OUTPUT_DIR,
+                        default=TESTS_DIR, help="directory the test files are written to")
+    parser.add_argument("--" + ARG_SORT_BUFFER.replace("_", "-"), dest=ARG_SORT_BUFFER,
+                        type=int, default=DEFAULT_SORT_BUFFER,
+                        help="number of reference output lines sorted in memory at a time")
+    parser.add_argument("--" + ARG_JSONL, action="store_true",
+                        help="also write the input as a line-delimited scenario (.jsonl), "
+                             "which test.py reads as it runs")
+    parser.add_argument("--" + ARG_BINARY, action="store_true",
+                        help="also write the input as a binary scenario (.bin), "
+                             "which test.py memory-maps")
 
     return parser.parse_args().__dict__
 
@@ -109,7 +132,8 @@ def sanitize_inputs(arguments):
             and arguments[ARG_MARKETPLACE_Q] > 0 \
             and arguments[ARG_MIN_CARTS] > 0 \
             and arguments[ARG_MAX_CARTS] > 0 \
-            and arguments[ARG_MAX_CARTS] >= arguments[ARG_MIN_CARTS]:
+            and arguments[ARG_MAX_CARTS] >= arguments[ARG_MIN_CARTS] \
+            and arguments[ARG_SORT_BUFFER] > 0:
         return True
 
     return False
@@ -146,17 +170,14 @@ def generate_products(count):
     for i in range(count):
         if i < count / 2:
             product = {"product_type": "Coffee"}
-            name = random.choice(coffee_names_copy)
-            coffee_names_copy.remove(name)
-            product["name"] = name
+            product["name"] = pick_name(coffee_names_copy, COFFEE_NAMES, i)
             product["acidity"] = round(random.uniform(MIN_ACIDITY, MAX_ACIDITY), 2)
             product["roast_level"] = random.choice(ROAST_LEVEL)
         else:
             product = {"product_type": "Tea"}
-            tea = random.choice(tea_list_copy)
+            tea = pick_name(tea_list_copy, list(TEA_NAMES_TYPES.keys()), i)
             product["name"] = tea
-            product["type"] = TEA_NAMES_TYPES[tea]
-            tea_list_copy.remove(tea)
+            product["type"] = TEA_NAMES_TYPES[tea.split(SYNTHETIC_NAME_SEPARATOR)[0]]
 
         product["price"] = random.randint(1, 10)
         product["is_produced"] = False  # temporary field used for generating carts for consumers
@@ -165,6 +186,23 @@ def generate_products(count):
     return products
 
 
+def pick_name(names_left, names, index):
+    """
+    Picks a random name that wasn't picked yet. When all the names were picked,
+    a synthetic name is built out of a random name and the product's index,
+    so a test can have any number of products.
+    :param names_left: the names that weren't picked yet, the picked name is removed
+    :param names: all the names
+    :param index: the index of the product
+    :return: the name of the product
+    """
+    if names_left:
+        name = random.choice(names_left)
+        names_left.remove(name)
+        return name
+    return f"{random.choice(names)}{SYNTHETIC_NAME_SEPARATOR}{index + 1}"
+
+
 def generate_marketplace(queue_size):
     """
     Generates the marketplace
@@ -204,7 +242,7 @@ def generate_producers(count, products, basic_test):
         producer = {"name": PRODUCER_NAME_PREFIX + str(i + 1)}
 
         num_products_per_producer = random.randint(1, len(products.keys()))
-        products_to_produce = random.sample(products.keys(), num_products_per_producer)
+        products_to_produce = random.sample(list(products.keys()), num_products_per_producer)
 
         products_list = [[x, random.randint(1, max_quantity), round(random.uniform(0.05, 0.4), 2)]
                          for x in products_to_produce]
@@ -240,9 +278,10 @@ def generate_consumers(count, products, min_cart, max_cart,
             ]
         }
     ],
-    :return: list of consumers
+    The consumers are generated one at a time, as they are consumed.
+    :return: an iterator over the consumers
     """
-    consumers = []
+    product_ids = list(products.keys())
     max_operations_per_cart = 3 if basic_test else 10
     max_quantity = 5 if basic_test else 10
 
@@ -256,13 +295,12 @@ def generate_consumers(count, products, min_cart, max_cart,
         for _ in range(num_carts):
             num_operations = random.randint(1, max_operations_per_cart)
 
-            print(products.keys(), " ", num_operations)
-            if len(products) < num_operations:
-                num_operations = len(products)
+            if len(product_ids) < num_operations:
+                num_operations = len(product_ids)
 
-            product_ids = random.sample(products.keys(), num_operations)
             operations = [{"type": ADD_TO_CART_OP, "product": x,
-                           "quantity": random.randint(1, max_quantity)} for x in product_ids]
+                           "quantity": random.randint(1, max_quantity)}
+                          for x in random.sample(product_ids, num_operations)]
 
             # artificially insert 0 or 1 removal operations, aka not all carts will have removals
             if has_remove_operation:
@@ -277,8 +315,7 @@ def generate_consumers(count, products, min_cart, max_cart,
             consumer["carts"].append({"ops": operations,
                                       "expected_cart": compute_expected_cart(operations)})
 
-        consumers.append(consumer)
-    return consumers
+        yield consumer
 
 
 def compute_expected_cart(operations):
@@ -301,48 +338,147 @@ def compute_expected_cart(operations):
     return expected_cart
 
 
-def generate_in_out_test_files(test_name):
+def indented_dumps(value, level):
     """
-    Creates two files for the given test: the input file and the reference output file
-    :param test_name: the name (excluding the extension) given to all the files of the test
-    :return: nothing
+    Serializes the value as it would be nested 'level' times in a document
+    serialized with dumps(indent=4)
+    :param value: the value to serialize
+    :param level: the nesting level of the value
+    :return: the JSON string of the value
     """
-    filename = f'{TESTS_DIR}/{test_name}.json'
+    return dumps(value, indent=4).replace("\n", "\n" + " " * 4 * level)
 
-    with open(filename) as json_file:
-        conf = loads(json_file.read())
 
-    # turn product definitions into actual products
-    products = {}
-    for k, prod_dict in conf['products'].items():
+class LineSorter:
+    """
+    Sorts an unbounded number of lines with an external merge sort: at most
+    'buffer_size' lines are kept in memory, sorted and written to a temporary file,
+    and all the sorted runs are merged when the lines are written.
+    """
+
+    def __init__(self, buffer_size):
+        """
+        :param buffer_size: the maximum number of lines kept in memory
+        """
+        self.buffer_size = buffer_size
+        self.lines = []
+        self.runs = []
+
+    def _write_run(self):
+        """
+        Sorts the lines kept in memory and writes them to a new run
+        """
+        self.lines.sort()
+        run = tempfile.TemporaryFile("w+")
+        run.writelines(line + "\n" for line in self.lines)
+        run.seek(0)
+        self.runs.append(run)
+        self.lines = []
+
+    def add(self, lines):
+        """
+        Adds lines to sort
+        :param lines: an iterable of lines, without new lines
+        """
+        lines = iter(lines)
+        while True:
+            chunk = list(islice(lines, self.buffer_size - len(self.lines)))
+            if not chunk:
+                return
+            self.lines.extend(chunk)
+            if len(self.lines) == self.buffer_size:
+                self._write_run()
+
+    def write(self, output_file):
+        """
+        Writes all the added lines to the output file in sorted order,
+        each of them followed by a new line
+        :param output_file: the output file
+        :return: nothing
+        """
+        try:
+            if not self.runs:
+                self.lines.sort()
+                print('\n'.join(self.lines), file=output_file)
+                return
+            if self.lines:
+                self._write_run()
+            output_file.writelines(heapq.merge(*self.runs))
+        finally:
+            for run in self.runs:
+                run.close()
+            self.runs = []
+            self.lines = []
+
+
+def generate_in_out_test_files(test_path, products, producers, consumers, marketplace,
+                               sort_buffer=DEFAULT_SORT_BUFFER, jsonl=False, binary=False):
+    """
+    Creates the files of the given test: the json file, the input file, the
+    reference output file and, optionally, the line-delimited and binary scenarios.
+    The consumers are written as they are generated.
+    :param test_path: the path, excluding the extension, given to all the files of the test
+    :param products: the dict of products
+    :param producers: the list of producers
+    :param consumers: an iterable of consumers, whose carts have the operations
+    and the expected cart
+    :param marketplace: the marketplace's dict
+    :param sort_buffer: the number of reference output lines sorted in memory at a time
+    :param jsonl: True if the line-delimited scenario (tests/{test_name}.jsonl) is written
+    :param binary: True if the binary scenario (tests/{test_name}.bin) is written
+    :return: nothing
+    """
+    # turn product definitions into the names of actual products
+    product_names = {}
+    for k, prod_dict in products.items():
         params = {k: v for k, v in prod_dict.items() if k != 'product_type'}
-        products[k] = globals()[prod_dict['product_type']](**params)
-
-    # turn product ids into products in consumer order lists and expected carts
-    for consumer in conf['consumers']:
-        for cart in consumer['carts']:
-            cart['expected_cart'] = {products[k]: v
-                                     for k, v
-                                     in cart['expected_cart'].items()}
-
-    lines = []
-    for consumer in conf['consumers']:
-        print("consumer" + str(consumer))
-        for cart in consumer['carts']:
-            for product, count in cart['expected_cart'].items():
-                lines += ([f'{consumer["name"]} bought {product}'] * count)
-
-    # write to output file (tests/{test_name}.out)
-    with open(f'{TESTS_DIR}/{test_name}.ref.out', 'w') as output_file:
-        lines.sort()
-        print('\n'.join(lines), file=output_file)
-
-    for consumer in conf['consumers']:
-        consumer['carts'] = [d['ops'] for d in consumer['carts']]
-
-    # write to input file (tests/{test_name}.in)
-    with open(f'{TESTS_DIR}/{test_name}.in', 'w') as input_file:
-        print(dumps(conf, indent=4), file=input_file)
+        product_names[k] = str(globals()[prod_dict['product_type']](**params))
+
+    header = ('{\n    "products": ' + indented_dumps(products, 1)
+              + ',\n    "producers": ' + indented_dumps(producers, 1)
+              + ',\n    "consumers": [')
+    footer = '\n    ],\n    "marketplace": ' + indented_dumps(marketplace, 1) + '\n}\n'
+
+    sorter = LineSorter(sort_buffer)
+    with open(f'{test_path}.json', 'w') as json_file, \
+            open(f'{test_path}.in', 'w') as input_file, \
+            ExitStack() as scenario_files:
+        json_file.write(header)
+        input_file.write(header)
+
+        # the scenario writers get the same consumers as the input file
+        scenario_writers = []
+        if jsonl:
+            scenario_file = scenario_files.enter_context(open(f'{test_path}.jsonl', 'w'))
+            scenario_writers.append(ScenarioWriter(scenario_file, marketplace,
+                                                   products, producers))
+        if binary:
+            scenario_file = scenario_files.enter_context(open(f'{test_path}.bin', 'wb'))
+            scenario_writers.append(BinaryScenarioWriter(scenario_file, marketplace,
+                                                         products, producers))
+
+        separator = '\n'
+        for consumer in consumers:
+            json_file.write(separator + ' ' * 8 + indented_dumps(consumer, 2))
+            input_consumer = dict(consumer, carts=[d['ops'] for d in consumer['carts']])
+            input_file.write(separator + ' ' * 8 + indented_dumps(input_consumer, 2))
+            for scenario_writer in scenario_writers:
+                scenario_writer.add_consumer(input_consumer)
+            separator = ',\n'
+
+            for cart in consumer['carts']:
+                for product_id, count in cart['expected_cart'].items():
+                    line = f'{consumer["name"]} bought {product_names[product_id]}'
+                    sorter.add([line] * count)
+
+        json_file.write(footer)
+        input_file.write(footer)
+        for scenario_writer in scenario_writers:
+            scenario_writer.close()
+
+    # write to output file (tests/{test_name}.ref.out)
+    with open(f'{test_path}.ref.out', 'w') as output_file:
+        sorter.write(output_file)
 
 
 if __name__ == "__main__":
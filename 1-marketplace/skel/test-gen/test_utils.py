@@ -41,6 +41,12 @@ DEFAULT_NUM_PRODUCTS = 7
 DEFAULT_MARKETPLACE_QUEUE_SIZE = 8
 DEFAULT_MIN_NUMBER_CARTS_PER_CONSUMER = 1
 DEFAULT_MAX_NUMBER_CARTS_PER_CONSUMER = 3
+DEFAULT_SEED = 0
+DEFAULT_SORT_BUFFER = 1000000
+
+# Separates a name and the index of the product in a synthetic product name,
+# used once all the names of a product type were picked
+SYNTHETIC_NAME_SEPARATOR = " #"
 
 # Input arguments names for the test_generator script
 ARG_TEST_NAME = "test_name"
@@ -52,3 +58,8 @@ ARG_MAX_CARTS = "max_carts"
 ARG_MARKETPLACE_Q = "marketplace_q"
 ARG_IS_BASIC = "is_basic"
 ARG_SUPPORTS_REMOVAL = "supports_removal"
+ARG_SEED = "seed"
+ARG_OUTPUT_DIR = "output_dir"
+ARG_SORT_BUFFER = "sort_buffer"
+ARG_JSONL = "jsonl"
+ARG_BINARY = "binary"
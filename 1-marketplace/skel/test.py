@@ -6,35 +6,244 @@ Assignment 1
 March 2020
 """
 
-import sys
-from json import loads
+import argparse
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from json import dumps, loads
 
 from tema.producer import Producer
 from tema.consumer import Consumer
+from tema.consumer_pool import ConsumerPool
 from tema.marketplace import Marketplace
+from tema.async_producer import AsyncProducer
+from tema.async_consumer import AsyncConsumer
+from tema.async_marketplace import AsyncMarketplace
+from tema.process_marketplace import MarketplaceManager, run_consumers, run_producers, split
+from tema.marketplace_logging import DEFAULT_LOG_CONFIG
+from tema.catalog import ProductCatalog
+from tema.scenario import ScenarioReader
+from tema.binary_scenario import BinaryScenario
 from tema.product import Product, Coffee, Tea
+from tema.clock import REAL_CLOCK, VirtualClock
+from tema.marketplace_profiler import ProfileSession
 
+# The finished consumers are dropped each time the number of started ones
+# exceeds twice the number left running, plus this many
+REAP_MIN_CONSUMERS = 64
 
-def main():
+
+def _stop_producers(marketplace, producers, clock=REAL_CLOCK):
     """
-        Convert the market_configuration input file into specific models:
-        Producer, Consumer, Marketplace
+        Stops accepting products, wakes the producers, from the Marketplace and
+        from their sleeps on the given clock, and joins them
+    """
+    marketplace.shutdown()
+    for producer in producers:
+        producer.stop()
+    clock.close()
+    for producer in producers:
+        producer.join()
+
+
+def run_threads(market_config, blocking, clock=REAL_CLOCK, profile=None, backorders=False):
     """
+        Runs each producer and consumer in its own thread, sleeping on the given clock.
+        With backorders, the consumers wait for their backorders instead of adding.
+        Returns the Marketplace's statistics, if they're collected
+    """
+    # build the marketplace
+    marketplace = Marketplace(**market_config['marketplace'])
+    if profile is not None:
+        profile.attach(marketplace.latencies)
+
+    # a virtual time stands still until all the producers and consumers are started
+    clock.register()
+
+    # build and start the producers
+    producers = [Producer(**p_market_config, marketplace=marketplace,
+                          blocking=blocking, clock=clock)
+                 for p_market_config in market_config['producers']]
+
+    for producer in producers:
+        producer.start()
+
     try:
-        filename = sys.argv[1]
-    except IndexError:
-        print("no input file specified")
-        raise SystemExit
+        # build and start the consumers as they are read, keeping only the running
+        # ones, so that a streamed scenario's finished consumers can be freed; they're
+        # daemons, so that the ones left waiting for products don't outlive a failure
+        consumers = []
+        running = 0
+        for c_market_config in market_config['consumers']:
+            consumer = Consumer(**c_market_config, marketplace=marketplace,
+                                blocking=blocking, clock=clock, backorders=backorders,
+                                daemon=True)
+            consumer.start()
+            consumers.append(consumer)
+            if len(consumers) > 2 * running + REAP_MIN_CONSUMERS:
+                consumers = [consumer for consumer in consumers if consumer.is_alive()]
+                running = len(consumers)
+
+        clock.unregister()
+
+        for consumer in consumers:
+            consumer.join()
+    finally:
+        # the consumers are done, or the scenario failed: the publishing is stopped,
+        # the producers are woken, from the Marketplace and from their sleeps,
+        # and joined, so that the process can exit
+        _stop_producers(marketplace, producers, clock)
+
+    # the units left unsold are removed
+    marketplace.drain()
+
+    marketplace.close()
+    return marketplace.stats()
+
+
+def run_pool(market_config, blocking, workers=None, profile=None, backorders=False):
+    """
+        Runs each producer in its own thread and the consumers as tasks of a
+        bounded pool of worker threads. The consumers poll, or wait for their
+        backorders, yielding their worker while they wait; the blocking mode only
+        applies to the producers.
+        Returns the Marketplace's statistics, if they're collected
+    """
+    # build the marketplace
+    marketplace = Marketplace(**market_config['marketplace'])
+    if profile is not None:
+        profile.attach(marketplace.latencies)
+
+    # build and start the producers
+    producers = [Producer(**p_market_config, marketplace=marketplace, blocking=blocking)
+                 for p_market_config in market_config['producers']]
+
+    for producer in producers:
+        producer.start()
+
+    # submit the consumers as they are read; a consumer is a Thread object that is
+    # never started, so it holds no thread of its own
+    try:
+        pool = ConsumerPool(workers)
+        for c_market_config in market_config['consumers']:
+            pool.submit(Consumer(**c_market_config, marketplace=marketplace, blocking=False,
+                                 backorders=backorders))
+
+        pool.join()
+    finally:
+        # the consumers are done, or one of them failed: the publishing is stopped
+        # and the producers are woken and joined, before the error is raised
+        _stop_producers(marketplace, producers)
+
+    # the units left unsold are removed
+    marketplace.drain()
+
+    marketplace.close()
+    return marketplace.stats()
+
+
+async def run_asyncio(market_config, blocking, profile=None):
+    """
+        Runs each producer and consumer as an asyncio task of the same event loop.
+        Returns the Marketplace's statistics, if they're collected
+    """
+    # build the marketplace
+    marketplace = AsyncMarketplace(**market_config['marketplace'])
+    if profile is not None:
+        profile.attach(marketplace.latencies)
+
+    # build and start the producers
+    producers = [AsyncProducer(**p_market_config, marketplace=marketplace,
+                               blocking=blocking)
+                 for p_market_config in market_config['producers']]
+    producer_tasks = [asyncio.create_task(producer.run(), name=producer.name)
+                      for producer in producers]
+
+    # build and start the consumers
+    consumers = [AsyncConsumer(**c_market_config, marketplace=marketplace,
+                               blocking=blocking)
+                 for c_market_config in market_config['consumers']]
+    consumer_tasks = [asyncio.create_task(consumer.run(), name=consumer.name)
+                      for consumer in consumers]
+
+    await asyncio.gather(*consumer_tasks)
+
+    # the consumers are done: the publishing is stopped, the producers' sleeps
+    # are cancelled and the units left unsold are removed
+    marketplace.shutdown()
+    for task in producer_tasks:
+        task.cancel()
+    await asyncio.gather(*producer_tasks, return_exceptions=True)
+    marketplace.drain()
+
+    marketplace.close()
+    return marketplace.stats()
+
+
+def run_processes(market_config, blocking, profile=None):
+    """
+        Runs the marketplace in a server process and the producers and consumers
+        as threads of worker processes, one group of workers per CPU.
+        Returns the Marketplace's statistics, if they're collected
+    """
+    num_workers = os.cpu_count() or 1
 
-    with open(filename) as input_file:
+    with MarketplaceManager() as manager:
+        # build the marketplace
+        marketplace = manager.Marketplace(  # pylint: disable=no-member
+            **market_config['marketplace'])
+        if profile is not None:
+            profile.attach(marketplace.latencies)
+
+        # build and start the producers
+        producers = [multiprocessing.Process(target=run_producers,
+                                             args=(marketplace, chunk, blocking))
+                     for chunk in split(list(market_config['producers']), num_workers)]
+
+        for producer in producers:
+            producer.start()
+
+        # build and start the consumers
+        chunks = split(list(market_config['consumers']), num_workers)
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            consumers = [executor.submit(run_consumers, marketplace, chunk, blocking)
+                         for chunk in chunks]
+
+            for consumer in consumers:
+                consumer.result()
+
+        # the consumers are done: the publishing is stopped, the producers return
+        # once their current sleep ends and the units left unsold are removed
+        marketplace.shutdown()
+        for producer in producers:
+            producer.join()
+        marketplace.drain()
+
+        marketplace.close()
+        stats = marketplace.stats()
+        if profile is not None:
+            # the latencies are written while the server process is still running
+            profile.stop()
+
+    return stats
+
+
+def load_market_config(filename):
+    """
+        Loads a test's input file, turning the product ids into products
+    """
+    with open(filename, encoding="utf-8") as input_file:
         market_config = loads(input_file.read())
 
-    # turn product definitions into actual products
+    # turn product definitions into actual products, interning each distinct
+    # product once so that all the ids of equal products share the same object
+    catalog = ProductCatalog()
     products = {}
 
     for k, products_dict in market_config['products'].items():
         params = {k: products_dict[k] for k in products_dict.keys() if k != 'product_type'}
-        products[k] = globals()[products_dict['product_type']](**params)
+        products[k] = catalog.intern(globals()[products_dict['product_type']](**params))
     del market_config['products']
 
     # turn product ids into products in producers
@@ -43,31 +252,128 @@ def main():
                                 for i, quantity, sleep_time
                                 in producer['products']]
 
-    # turn product ids into products in consumer order lists and expected carts
+    # turn the consumers' operations into (type, product, quantity) tuples
     for consumer in market_config['consumers']:
-        for cart in consumer['carts']:
-            for operation in cart:
-                operation['product'] = products[operation['product']]
+        consumer['carts'] = [[(operation['type'], products[operation['product']],
+                               operation['quantity'])
+                              for operation in cart]
+                             for cart in consumer['carts']]
 
-    # build the marketplace
-    marketplace = Marketplace(**market_config['marketplace'])
-    
-    # build and start the producers
-    producers = [Producer(**p_market_config, marketplace=marketplace, daemon=True)
-                 for p_market_config in market_config['producers']]
+    return market_config
 
-    for producer in producers:
-        producer.start()
 
-    # build and start the consumers
-    consumers = [Consumer(**c_market_config, marketplace=marketplace)
-                 for c_market_config in market_config['consumers']]
+def run_test(market_config, args):
+    """
+        Runs the test's market configuration with the engine given by the arguments
+        and returns the Marketplace's runtime statistics
+    """
+    blocking = args.wait != "poll"
+    backorders = args.wait == "backorder"
+
+    market_config['marketplace']['log_config'] = {"level": args.log_level,
+                                                  "max_bytes": args.log_max_bytes}
+
+    market_config['marketplace']['order_output'] = {"background": True,
+                                                    "flush_every": args.flush_every}
+
+    market_config['marketplace']['fair'] = args.fair
+    market_config['marketplace']['collect_stats'] = args.stats is not None
+    market_config['marketplace']['profile'] = args.profile is not None
+
+    profile = None
+    if args.profile:
+        profile = ProfileSession(args.profile, interval=args.profile_interval)
+        profile.start()
+
+    if args.engine == "asyncio":
+        stats = asyncio.run(run_asyncio(market_config, blocking, profile))
+    elif args.engine == "pool":
+        stats = run_pool(market_config, blocking, args.workers, profile, backorders)
+    elif args.engine == "processes":
+        stats = run_processes(market_config, blocking, profile)
+    elif args.clock == "virtual":
+        stats = run_threads(market_config, False, VirtualClock(), profile)
+    else:
+        stats = run_threads(market_config, blocking, profile=profile, backorders=backorders)
+
+    if profile is not None and profile.is_alive():
+        profile.stop()
+
+    return stats
+
+
+def main():
+    """
+        Convert the market_configuration input file into specific models:
+        Producer, Consumer, Marketplace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename",
+                        help="the test's input file, a line-delimited scenario "
+                             "read as it runs if its name ends in .jsonl, or a "
+                             "memory-mapped binary scenario if it ends in .bin")
+    parser.add_argument("--wait", choices=["block", "poll", "backorder"], default="block",
+                        help="block: producers and consumers wait inside the Marketplace, "
+                             "poll: producers and consumers sleep and retry, "
+                             "backorder: producers wait inside the Marketplace and consumers "
+                             "place backorders, filled by the producers, and wait for them; "
+                             "only with the threads and pool engines")
+    parser.add_argument("--engine", choices=["threads", "pool", "asyncio", "processes"],
+                        default="threads",
+                        help="threads: a thread per producer and consumer, "
+                             "pool: a thread per producer and the consumers as tasks "
+                             "of a pool of worker threads, "
+                             "asyncio: an asyncio task per producer and consumer, "
+                             "processes: the marketplace in a server process and the "
+                             "producers and consumers in worker processes")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="the pool engine's number of worker threads, "
+                             "the number of CPUs by default")
+    parser.add_argument("--clock", choices=["real", "virtual"], default="real",
+                        help="real: producers and consumers sleep for real, "
+                             "virtual: a discrete-event simulation of the threads engine "
+                             "that skips the time all of them spend sleeping; they poll "
+                             "instead of waiting inside the Marketplace")
+    parser.add_argument("--log-level", default="INFO",
+                        choices=["DEBUG", "INFO", "WARNING", "OFF"],
+                        help="the minimum level of the marketplace.log records")
+    parser.add_argument("--log-max-bytes", type=int,
+                        default=DEFAULT_LOG_CONFIG["max_bytes"],
+                        help="the size at which marketplace.log is rotated")
+    parser.add_argument("--stats",
+                        help="file the Marketplace's runtime statistics are written to "
+                             "as JSON at the end of the run")
+    parser.add_argument("--profile", metavar="OUT_DIR",
+                        help="directory the latencies of the Marketplace's methods and "
+                             "the sampled stacks of the threads are written to, per "
+                             "thread and merged in a summary")
+    parser.add_argument("--profile-interval", type=float, default=0.01,
+                        help="the number of seconds between two samples of the stacks")
+    parser.add_argument("--fair", action="store_true",
+                        help="hand the units of a product to the carts waiting for it "
+                             "in arrival order, instead of to whichever consumer tries first")
+    parser.add_argument("--flush-every", type=int, default=64,
+                        help="the number of orders after which the output is flushed")
+    args = parser.parse_args()
+    if args.clock == "virtual" and args.engine != "threads":
+        parser.error("the virtual clock only drives the threads engine")
+    if args.wait == "backorder" and (args.engine not in ("threads", "pool")
+                                     or args.clock == "virtual"):
+        parser.error("the backorders are only waited for by the threads and pool engines, "
+                     "on the real clock")
 
-    for consumer in consumers:
-        consumer.start()
+    if args.filename.endswith(".bin"):
+        # the consumers' carts are read from the mapped file until the engine finishes
+        with BinaryScenario(args.filename) as scenario:
+            stats = run_test(scenario.market_config(), args)
+    elif args.filename.endswith(".jsonl"):
+        stats = run_test(ScenarioReader(args.filename).market_config(), args)
+    else:
+        stats = run_test(load_market_config(args.filename), args)
 
-    for consumer in consumers:
-        consumer.join()
+    if args.stats:
+        with open(args.stats, "w", encoding="utf-8") as stats_file:
+            stats_file.write(dumps(stats, indent=4))
 
 
 if __name__ == '__main__':